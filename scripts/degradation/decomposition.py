@@ -0,0 +1,190 @@
+"""
+Decompose MOF structures into metal(-oxo) nodes and organic linkers.
+
+Bonds are perceived from covalent radii with a periodic cell list neighbor search. Metal atoms, together with
+the non-metal atoms that are only bonded to metals (oxo / hydroxo / aqua ligands and their hydrogens), form the
+nodes. Every other atom belongs to a linker. Nodes and linkers are the connected components of the bond graph
+after the metal-linker coordination bonds are removed.
+
+ >>> from decomposition import decompose_mof
+ >>> mof = decompose_mof('UiO-66.cif')
+ >>> packed_mof = pack_linkers_nodes(pack_mof(mof['atoms'], mof['coordinates'], mof['cell'], [2, 2, 2]), mof)
+"""
+import os
+import re
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from lattice import cell_vectors
+from neighbors import neighbor_pairs
+from file_io import read_xyz
+from structure_cache import cached_structure, structure_hash
+
+
+# Covalent radii (Angstrom) from Cordero et al. Dalton Trans. 2008 (high spin for Mn, Fe, Co)
+COVALENT_RADII = dict(H=0.31, B=0.84, C=0.76, N=0.71, O=0.66, F=0.57, Si=1.11, P=1.07, S=1.05, Cl=1.02,
+                      Se=1.20, Br=1.20, I=1.39, Li=1.28, Be=0.96, Na=1.66, Mg=1.41, Al=1.21, K=2.03, Ca=1.76,
+                      Sc=1.70, Ti=1.60, V=1.53, Cr=1.39, Mn=1.61, Fe=1.52, Co=1.50, Ni=1.24, Cu=1.32, Zn=1.22,
+                      Ga=1.22, Ge=1.20, As=1.19, Rb=2.20, Sr=1.95, Y=1.90, Zr=1.75, Nb=1.64, Mo=1.54, Ru=1.46,
+                      Rh=1.42, Pd=1.39, Ag=1.45, Cd=1.44, In=1.42, Sn=1.39, Sb=1.39, Te=1.38, Cs=2.44, Ba=2.15,
+                      La=2.07, Ce=2.04, Pr=2.03, Nd=2.01, Sm=1.98, Eu=1.98, Gd=1.96, Tb=1.94, Dy=1.92, Ho=1.92,
+                      Er=1.89, Tm=1.90, Yb=1.87, Lu=1.87, Hf=1.75, W=1.62, Pt=1.36, Au=1.36, Hg=1.32, Pb=1.46,
+                      Bi=1.48, U=1.96)
+
+METALS = {'Li', 'Be', 'Na', 'Mg', 'Al', 'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn',
+          'Ga', 'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn', 'Cs', 'Ba', 'La',
+          'Ce', 'Pr', 'Nd', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb', 'Lu', 'Hf', 'W', 'Pt', 'Au',
+          'Hg', 'Pb', 'Bi', 'U'}
+
+_decomposition_cache = {}
+
+
+def read_cif(file_name):
+    """
+    Read cell and atomic coordinates from a cif file (P1 symmetry is assumed).
+
+    Returns:
+        - dict: 'atoms', 'coordinates' (cartesian) and 'cell' keys
+    """
+    cell, columns, rows = {}, [], []
+    reading_columns, in_atom_loop = False, False
+    with open(file_name, 'r') as cif:
+        for line in cif:
+            tokens = line.split()
+            if len(tokens) == 0 or tokens[0].startswith('#'):
+                continue
+            if tokens[0].startswith('_cell_length') or tokens[0].startswith('_cell_angle'):
+                cell[tokens[0]] = float(re.sub(r'\(.*\)', '', tokens[1]))
+            elif tokens[0] == 'loop_':
+                columns, reading_columns, in_atom_loop = [], True, False
+            elif tokens[0].startswith('_'):
+                if reading_columns:
+                    columns.append(tokens[0])
+                    in_atom_loop = '_atom_site_fract_x' in columns and len(rows) == 0
+                else:
+                    in_atom_loop = False
+            else:
+                reading_columns = False
+                if in_atom_loop:
+                    rows.append(tokens)
+    cell = [cell['_cell_length_a'], cell['_cell_length_b'], cell['_cell_length_c'],
+            cell['_cell_angle_alpha'], cell['_cell_angle_beta'], cell['_cell_angle_gamma']]
+    element_column = '_atom_site_type_symbol' if '_atom_site_type_symbol' in columns else '_atom_site_label'
+    element_idx = columns.index(element_column)
+    frac_idx = [columns.index('_atom_site_fract_%s' % i) for i in 'xyz']
+    atoms = [re.match(r'[A-Z][a-z]?', row[element_idx]).group() for row in rows]
+    frac = np.array([[float(re.sub(r'\(.*\)', '', row[i])) for i in frac_idx] for row in rows])
+    return dict(atoms=atoms, coordinates=(frac @ np.array(cell_vectors(cell))).tolist(), cell=cell)
+
+
+def read_structure(file_name, cell=None):
+    """
+    Read cif or xyz structure file. For xyz files the cell needs to be given for periodic structures.
+
+    Returns:
+        - dict: 'atoms', 'coordinates' and 'cell' keys
+    """
+    if os.path.splitext(file_name)[1].lower() == '.cif':
+        structure = read_cif(file_name)
+        if cell is not None:
+            structure['cell'] = list(cell)
+    else:
+        structure = read_xyz(file_name)[0]
+        structure['cell'] = None if cell is None else list(cell)
+    return structure
+
+
+def perceive_bonds(atoms, coordinates, cell=None, tolerance=0.45):
+    """
+    Find bonded atom pairs -> d(i, j) < r_cov(i) + r_cov(j) + tolerance
+
+    Args:
+        - atoms (list): list of elements -> ['O', 'C', 'H', ...]
+        - coordinates (list): 2D list of atomic coordinates
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma] (None for non-periodic structures)
+        - tolerance (float): Bond length tolerance in Angstrom
+
+    Returns:
+        - tuple: bonded atom indices i, j (i < j)
+    """
+    unknown = set(atoms) - set(COVALENT_RADII)
+    if len(unknown) > 0:
+        raise ValueError('Covalent radius not known for: %s' % ', '.join(sorted(unknown)))
+    radii = np.array([COVALENT_RADII[a] for a in atoms])
+    cutoff = 2 * radii.max() + tolerance
+    i, j, distances, _ = neighbor_pairs(coordinates, cell=cell, cutoff=cutoff)
+    bonded = (distances < radii[i] + radii[j] + tolerance) & (distances > 0.1)
+    return i[bonded], j[bonded]
+
+
+def _components(n_atoms, i, j, selection):
+    """ Connected components (list of atom index lists) of the bond graph restricted to selected atoms """
+    same = selection[i] & selection[j]
+    graph = coo_matrix((np.ones(same.sum()), (i[same], j[same])), shape=(n_atoms, n_atoms))
+    _, labels = connected_components(graph, directed=False)
+    atom_idx = np.flatnonzero(selection)
+    labels = labels[atom_idx]
+    order = np.argsort(labels, kind='stable')
+    split = np.flatnonzero(np.diff(labels[order])) + 1
+    return [c.tolist() for c in np.split(atom_idx[order], split)] if len(atom_idx) > 0 else []
+
+
+def decompose(atoms, coordinates, cell=None, tolerance=0.45):
+    """
+    Separate metal nodes and organic linkers of a MOF.
+
+    Args:
+        - atoms (list): list of elements -> ['O', 'C', 'H', ...]
+        - coordinates (list): 2D list of atomic coordinates
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma] (None for non-periodic structures)
+        - tolerance (float): Bond length tolerance in Angstrom
+
+    Returns:
+        - dict: 'nodes' and 'linkers' keys with list of atom index lists (same as irmof1)
+    """
+    atoms = np.asarray(atoms)
+    n_atoms = len(atoms)
+    i, j = perceive_bonds(atoms.tolist(), coordinates, cell=cell, tolerance=tolerance)
+    metal = np.isin(atoms, list(METALS))
+    hydrogen = atoms == 'H'
+    # Non-metal heavy atoms bonded to anything other than metals and hydrogens belong to linkers
+    organic_bond = ~metal[i] & ~metal[j] & ~hydrogen[i] & ~hydrogen[j]
+    organic = np.zeros(n_atoms, dtype=bool)
+    organic[i[organic_bond]] = True
+    organic[j[organic_bond]] = True
+    metal_bond = metal[i] ^ metal[j]
+    metal_bonded = np.zeros(n_atoms, dtype=bool)
+    metal_bonded[np.where(metal[i], j, i)[metal_bond]] = True
+    node = metal | (metal_bonded & ~organic & ~hydrogen)
+    # Hydrogens follow the (non-metal) heavy atom they are bonded to
+    h_bond = hydrogen[i] ^ hydrogen[j]
+    h_atom, heavy_atom = np.where(hydrogen[i], i, j)[h_bond], np.where(hydrogen[i], j, i)[h_bond]
+    node[h_atom[node[heavy_atom] & ~metal[heavy_atom]]] = True
+    return dict(nodes=_components(n_atoms, i, j, node), linkers=_components(n_atoms, i, j, ~node))
+
+
+def decompose_mof(file_name, cell=None, tolerance=0.45):
+    """
+    Read a MOF structure file and separate its nodes and linkers.
+    Results are cached per structure (file contents, cell and tolerance) in memory and on disk (see structure_cache).
+
+    Args:
+        - file_name (str): Path to cif or xyz file
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma] (required for periodic xyz files)
+        - tolerance (float): Bond length tolerance in Angstrom
+
+    Returns:
+        - dict: MOF with 'atoms', 'coordinates', 'cell', 'nodes' and 'linkers' keys
+    """
+    params = dict(cell=None if cell is None else [float(i) for i in cell], tolerance=tolerance)
+    key = structure_hash([file_name], params)
+
+    def build():
+        mof = read_structure(file_name, cell=cell)
+        mof.update(decompose(mof['atoms'], mof['coordinates'], cell=mof['cell'], tolerance=tolerance))
+        return mof
+
+    if key not in _decomposition_cache:
+        name = 'decomposed-%s' % os.path.splitext(os.path.basename(file_name))[0]
+        _decomposition_cache[key] = cached_structure(name, [file_name], params, build, as_list=True)
+    return _decomposition_cache[key]
@@ -0,0 +1,227 @@
+"""
+Degradation models and replica ensembles for packed MOFs.
+
+A degradation model decides in which order linkers and nodes are removed. Each replica uses its own random
+number generator derived from a single seed, so ensembles are reproducible regardless of how replicas are
+distributed over worker processes.
+
+ >>> from degradation_models import SurfaceErosion, degrade_ensemble
+ >>> degrade_ensemble(packed_mof, (0.5, 0.5), SurfaceErosion(), 200, 'IRMOF1-222-L50-N50-R%03i.xyz', seed=42)
+"""
+import os
+import heapq
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from degradation_tools import pack_linkers_nodes, center_of_mass, fragment_centers
+from file_io import write_xyz
+
+
+class DegradationModel:
+    """
+    Base class for degradation models. Subclasses implement `rank` which returns the deletion order of the
+    linkers and nodes (fragment indices, first deleted first).
+    """
+    name = 'model'
+
+    def rank(self, linker_centers, node_centers, mof_center, rng):
+        """
+        Args:
+            - linker_centers (ndarray): (n_linkers, 3) linker centers of mass
+            - node_centers (ndarray): (n_nodes, 3) node centers of mass
+            - mof_center (ndarray): (3,) MOF center of mass
+            - rng (Generator): numpy random number generator of the replica
+
+        Returns:
+            - tuple: linker and node deletion orders (ndarray)
+        """
+        raise NotImplementedError
+
+
+class CenterDistance(DegradationModel):
+    """
+    Delete fragments farthest from the MOF center of mass first (deterministic, same as delete_linkers_nodes).
+    """
+    name = 'distance'
+
+    def rank(self, linker_centers, node_centers, mof_center, rng):
+        orders = []
+        for centers in [linker_centers, node_centers]:
+            distances = np.round(np.linalg.norm(centers - mof_center, axis=1), 6)
+            orders.append(np.argsort(-distances, kind='stable'))
+        return tuple(orders)
+
+
+class RandomHydrolysis(DegradationModel):
+    """
+    Every linker and node is equally likely to be hydrolyzed.
+    """
+    name = 'random'
+
+    def rank(self, linker_centers, node_centers, mof_center, rng):
+        return rng.permutation(len(linker_centers)), rng.permutation(len(node_centers))
+
+
+class WeightedNodeLoss(DegradationModel):
+    """
+    Nodes are lost at random with probability weights that increase with the distance to the MOF center:
+    w = (d / d_max) ^ power. Linkers use the same weighting with linker_power (0 -> random hydrolysis).
+    """
+    name = 'weighted'
+
+    def __init__(self, power=2.0, linker_power=0.0):
+        self.power = power
+        self.linker_power = linker_power
+
+    def rank(self, linker_centers, node_centers, mof_center, rng):
+        orders = []
+        for centers, power in [(linker_centers, self.linker_power), (node_centers, self.power)]:
+            distances = np.linalg.norm(centers - mof_center, axis=1)
+            weights = (distances / max(distances.max(), 1e-12)) ** power + 1e-12
+            # Weighted random order without replacement (Efraimidis & Spirakis): sort by u^(1/w)
+            orders.append(np.argsort(-rng.random(len(centers)) ** (1 / weights)))
+        return tuple(orders)
+
+
+class SurfaceErosion(DegradationModel):
+    """
+    Erosion front moving in from the solvent accessible surface. Fragments (linkers and nodes together) with the
+    fewest remaining neighbors are removed first, and removing a fragment exposes its neighbors.
+    Neighbors are found with a KD-tree of fragment centers of mass.
+
+    Args:
+        - radius (float): Neighbor radius in Angstrom (default: 1.25 x median nearest fragment distance)
+        - noise (float): Random noise added to neighbor counts, larger values give a rougher erosion front
+    """
+    name = 'erosion'
+
+    def __init__(self, radius=None, noise=0.5):
+        self.radius = radius
+        self.noise = noise
+
+    def rank(self, linker_centers, node_centers, mof_center, rng):
+        from scipy.spatial import cKDTree
+        n_linkers = len(linker_centers)
+        centers = np.concatenate([linker_centers, node_centers])
+        tree = cKDTree(centers)
+        radius = self.radius
+        if radius is None:
+            radius = 1.25 * np.median(tree.query(centers, k=2)[0][:, 1])
+        neighbors = tree.query_ball_point(centers, radius)
+        counts = np.array([len(n) - 1 for n in neighbors], dtype=float)
+        noise = self.noise * rng.random(len(centers))
+        tie_break = rng.random(len(centers))
+        heap = [(c + e, t, i) for i, (c, e, t) in enumerate(zip(counts, noise, tie_break))]
+        heapq.heapify(heap)
+        deleted = np.zeros(len(centers), dtype=bool)
+        order = []
+        while heap:
+            key, _, i = heapq.heappop(heap)
+            if deleted[i] or key != counts[i] + noise[i]:
+                continue
+            deleted[i] = True
+            order.append(i)
+            for j in neighbors[i]:
+                if not deleted[j]:
+                    counts[j] -= 1
+                    heapq.heappush(heap, (counts[j] + noise[j], tie_break[j], j))
+        order = np.array(order, dtype=int)
+        return order[order < n_linkers], order[order >= n_linkers] - n_linkers
+
+
+def _flatten(fragments):
+    """ Flatten fragments (list of atom index lists) -> atom indices, offsets """
+    lengths = np.array([len(f) for f in fragments], dtype=int)
+    flat = np.fromiter((i for f in fragments for i in f), dtype=int, count=lengths.sum())
+    return flat, np.concatenate([[0], np.cumsum(lengths)])
+
+
+def _fragment_atoms(flat, offsets, selected):
+    """ Atom indices of selected fragments (vectorized gather from flattened fragments) """
+    lengths = offsets[1:][selected] - offsets[:-1][selected]
+    starts = np.repeat(offsets[:-1][selected] - (np.cumsum(lengths) - lengths), lengths)
+    return flat[starts + np.arange(lengths.sum())]
+
+
+_shared = {}
+
+
+def _init_worker(shared_dir, model):
+    """ Load the packed MOF read-only (memory mapped) in a worker process """
+    for name in os.listdir(shared_dir):
+        _shared[os.path.splitext(name)[0]] = np.load(os.path.join(shared_dir, name), mmap_mode='r')
+    _shared['model'] = model
+
+
+def _degrade_replica(replica, seed_sequence, degradation, file_name):
+    """ Degrade and save a single replica in a worker process """
+    s = _shared
+    rng = np.random.default_rng(seed_sequence)
+    linker_order, node_order = s['model'].rank(s['linker_centers'], s['node_centers'], s['mof_center'], rng)
+    n_linkers_del = int(degradation[0] * len(linker_order))
+    n_nodes_del = int(degradation[1] * len(node_order))
+    keep = np.ones(len(s['atoms']), dtype=bool)
+    keep[_fragment_atoms(s['linkers'], s['linker_offsets'], linker_order[:n_linkers_del])] = False
+    keep[_fragment_atoms(s['nodes'], s['node_offsets'], node_order[:n_nodes_del])] = False
+    replica_file = file_name % replica
+    header = '%s L%i-N%i replica %i' % (s['model'].name, round(degradation[0] * 100), round(degradation[1] * 100), replica)
+    write_xyz(replica_file, s['atoms'][keep], s['coordinates'][keep], header=header)
+    return dict(replica=replica, file=replica_file, n_atoms=int(keep.sum()),
+                linkers_deleted=n_linkers_del, nodes_deleted=n_nodes_del)
+
+
+def degrade_ensemble(packed_mof, degradation, model, n_replicas, file_name, seed=None, workers=None, mof=None,
+                     minimum_image=False):
+    """
+    Generate an ensemble of degraded MOF replicas in a process pool. The packed MOF is shared with the workers
+    as read-only memory mapped arrays and every replica is written to disk by its worker.
+
+    Args:
+        - packed_mof (dict): Packed MOF atoms, coordinates (linkers and nodes are packed if missing)
+        - degradation (tuple): Degradation fractions for linkers and nodes (d_l, d_n)
+        - model (DegradationModel): Degradation model -> RandomHydrolysis(), SurfaceErosion(), ...
+        - n_replicas (int): Number of replicas
+        - file_name (str): Replica file name formatted with the replica index -> 'IRMOF1-L50-N50-R%03i.xyz'
+        - seed (int): Random seed for the whole ensemble (replica i always gets the same random stream)
+        - workers (int): Number of worker processes (default: number of cpus, 1 -> run in this process)
+        - mof (dict): Unit cell MOF with 'linkers' and 'nodes' indices (default: irmof1)
+        - minimum_image (bool): Unwrap fragments split across the unit cell boundary (see fragment_centers)
+
+    Returns:
+        - list: replica results (replica, file, n_atoms, linkers_deleted, nodes_deleted) sorted by replica
+    """
+    if 'linkers' not in packed_mof or 'nodes' not in packed_mof:
+        packed_mof = pack_linkers_nodes(packed_mof, mof)
+    unit_cell = None
+    if minimum_image:
+        unit_cell = [i / j for i, j in zip(packed_mof['cell'][:3], packed_mof['pack'])] + list(packed_mof['cell'][3:6])
+    atoms, coordinates = np.asarray(packed_mof['atoms']), np.asarray(packed_mof['coordinates'], dtype=float)
+    linkers, linker_offsets = _flatten(packed_mof['linkers'])
+    nodes, node_offsets = _flatten(packed_mof['nodes'])
+    _, linker_centers = fragment_centers(atoms, coordinates, packed_mof['linkers'], cell=unit_cell)
+    _, node_centers = fragment_centers(atoms, coordinates, packed_mof['nodes'], cell=unit_cell)
+    shared = dict(atoms=atoms, coordinates=coordinates, linkers=linkers, linker_offsets=linker_offsets,
+                  nodes=nodes, node_offsets=node_offsets, linker_centers=linker_centers,
+                  node_centers=node_centers, mof_center=center_of_mass(atoms, coordinates))
+    seeds = np.random.SeedSequence(seed).spawn(n_replicas)
+    workers = os.cpu_count() if workers is None else workers
+    results = []
+    with tempfile.TemporaryDirectory(prefix='degrade-') as shared_dir:
+        for name, array in shared.items():
+            np.save(os.path.join(shared_dir, '%s.npy' % name), array)
+        if workers == 1:
+            _init_worker(shared_dir, model)
+            for replica in range(n_replicas):
+                results.append(_degrade_replica(replica, seeds[replica], degradation, file_name))
+                print('\rDegrading replicas... %3i / %3i' % (len(results), n_replicas), end='')
+            _shared.clear()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(shared_dir, model)) as executor:
+                jobs = [executor.submit(_degrade_replica, r, seeds[r], degradation, file_name)
+                        for r in range(n_replicas)]
+                for job in as_completed(jobs):
+                    results.append(job.result())
+                    print('\rDegrading replicas... %3i / %3i' % (len(results), n_replicas), end='')
+    print('\nDone! %i replicas saved -> %s' % (n_replicas, file_name))
+    return sorted(results, key=lambda r: r['replica'])
@@ -2,16 +2,27 @@
 Tools for packing and degrading MOF
 """
 import math
-from copy import deepcopy
+import numpy as np
 from irmof1 import irmof1
+from lattice import cell_vectors
 from file_io import write_xyz
-from thermof.trajectory.tools import center_of_mass
+from structure_cache import cached_structure
 
 
 MW = dict(PZA=123.113, RFP=822.94, NIZ=137.139, H2O=18.01528, NODE=277.5194, LINKER=164.115, IRMOF1=6158.9142)
 
+ATOMIC_MASS = dict(H=1.008, B=10.81, C=12.011, N=14.007, O=15.999, F=18.998, Si=28.085, P=30.974, S=32.06,
+                   Cl=35.45, Se=78.971, Br=79.904, I=126.904, Li=6.94, Be=9.012, Na=22.990, Mg=24.305, Al=26.982,
+                   K=39.098, Ca=40.078, Sc=44.956, Ti=47.867, V=50.942, Cr=51.996, Mn=54.938, Fe=55.845,
+                   Co=58.933, Ni=58.693, Cu=63.546, Zn=65.38, Ga=69.723, Ge=72.630, As=74.922, Rb=85.468,
+                   Sr=87.62, Y=88.906, Zr=91.224, Nb=92.906, Mo=95.95, Ru=101.07, Rh=102.906, Pd=106.42,
+                   Ag=107.868, Cd=112.414, In=114.818, Sn=118.710, Sb=121.760, Te=127.60, Cs=132.905, Ba=137.327,
+                   La=138.905, Ce=140.116, Pr=140.908, Nd=144.242, Sm=150.36, Eu=151.964, Gd=157.25, Tb=158.925,
+                   Dy=162.500, Ho=164.930, Er=167.259, Tm=168.934, Yb=173.045, Lu=174.967, Hf=178.49, W=183.84,
+                   Pt=195.084, Au=196.967, Hg=200.592, Pb=207.2, Bi=208.980, U=238.029)
 
-def pack_mof(atoms, coordinates, cell, packing):
+
+def pack_mof(atoms, coordinates, cell, packing, as_array=False):
     """
     Pack MOF
 
@@ -20,79 +31,69 @@ def pack_mof(atoms, coordinates, cell, packing):
     - coordinates (list): 2D list of atomic coordinates -> [[x1, y1, z1], ... , [xn, yn, zn]]
     - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma]
     - packing (list): Packing of the cell -> [2, 2, 2]
+    - as_array (bool): Return atoms and coordinates as numpy arrays -> (N,) str and (N, 3) float
 
     Returns:
     - dict: Packed MOF with atoms, coordinates and cell keys
     """
     v_cell = cell_vectors(cell)
     v_translation = translation_vectors(packing, v_cell)
-    cell_coor = supercell_coordinates(v_translation, packing, v_cell, coordinates)
-    packed_coordinates = [coor for cell in cell_coor for coor in cell]
-    packed_atoms = atoms * (packing[0] * packing[1] * packing[2])
-    packed_cell = [i * j for i, j in zip(cell[:3], packing)] + cell[3:6]
+    packed_coordinates = supercell_coordinates(v_translation, packing, v_cell, coordinates).reshape(-1, 3)
+    packed_atoms = np.tile(np.asarray(atoms), len(v_translation))
+    packed_cell = [i * j for i, j in zip(cell[:3], packing)] + list(cell[3:6])
+    if not as_array:
+        packed_atoms, packed_coordinates = packed_atoms.tolist(), packed_coordinates.tolist()
     return {'atoms': packed_atoms, 'coordinates': packed_coordinates, 'cell': packed_cell, 'pack': packing}
 
 
-def cell_vectors(cell):
+def cached_pack_mof(mof, packing, name='mof'):
     """
-    Calculate unit cell vectors for given cell dimensions -> [a, b, c, alpha, beta, gamma]
+    Pack MOF together with its linkers and nodes and cache the result as binary arrays (see structure_cache).
+    The cache entry is rebuilt when the MOF or the packing changes.
+
+    Args:
+    - mof (dict): Unit cell MOF with atoms, coordinates, cell, linkers and nodes -> irmof1
+    - packing (list): Packing of the cell -> [8, 8, 8]
+    - name (str): MOF name used for the cache entry -> 'IRMOF1'
+
+    Returns:
+    - dict: Packed MOF (see pack_mof) with read-only memory mapped atoms and coordinates arrays
     """
-    a, b, c = cell[:3]
-    alpha, beta, gamma = [math.radians(i) for i in cell[3:6]]
+    params = dict(atoms=np.asarray(mof['atoms']), coordinates=np.asarray(mof['coordinates'], dtype=float),
+                  cell=[float(i) for i in mof['cell']], packing=[int(i) for i in packing])
+    for key in ['linkers', 'nodes']:
+        params[key] = np.array([i for f in mof[key] for i in f] + [-1] + [len(f) for f in mof[key]])
 
-    x_v = [a, 0, 0]
-    y_v = [b * math.cos(gamma), b * math.sin(gamma), 0]
-    z_v = [0.0] * 3
-    z_v[0] = c * math.cos(beta)
-    z_v[1] = (c * b * math.cos(alpha) - y_v[0] * z_v[0]) / y_v[1]
-    z_v[2] = math.sqrt(c * c - z_v[0] * z_v[0] - z_v[1] * z_v[1])
-    return [x_v, y_v, z_v]
+    def build():
+        packed_mof = pack_mof(mof['atoms'], mof['coordinates'], mof['cell'], packing, as_array=True)
+        return pack_linkers_nodes(packed_mof, mof)
+
+    packed_mof = cached_structure('packed-%s-%s' % (name, ''.join(str(i) for i in packing)), [], params, build)
+    packed_mof['cell'], packed_mof['pack'] = packed_mof['cell'].tolist(), packed_mof['pack'].tolist()
+    return packed_mof
 
 
 def translation_vectors(packing_factor, cell_vectors):
     """
-    Calculate translation vectors for given packing factor and uc vectors
-    """
-    packing_amount = []
-    for x in range(packing_factor[0]):
-        for y in range(packing_factor[1]):
-            for z in range(packing_factor[2]):
-                packing_amount.append([x, y, z])
+    Calculate translation vectors for given packing factor and uc vectors.
 
-    x_v, y_v, z_v = cell_vectors
-    translation_vectors = []
-    for pack in packing_amount:
-        x_trans = x_v[0] * pack[0] + y_v[0] * pack[1] + z_v[0] * pack[2]
-        y_trans = x_v[1] * pack[0] + y_v[1] * pack[1] + z_v[1] * pack[2]
-        z_trans = x_v[2] * pack[0] + y_v[2] * pack[1] + z_v[2] * pack[2]
-        translation_vectors.append([x_trans, y_trans, z_trans])
-    return translation_vectors
+    Returns an (n_cells, 3) array ordered with z changing fastest (same order as nested x, y, z loops).
+    """
+    packing_amount = np.indices(packing_factor).reshape(3, -1).T
+    return packing_amount @ np.asarray(cell_vectors, dtype=float)
 
 
 def supercell_coordinates(translation_vectors, packing_factors, cell_vectors, coordinates):
     """
     Calculate packed coordinates for given:
     - translation vectors  - packing factor     - unit cell vectors    - atom coordinates
+
+    Returns an (n_cells, n_atoms, 3) array, the packed supercell is centered on the original unit cell.
     """
-    x_v, y_v, z_v = cell_vectors
-    packed_coors = [[] for i in range(len(translation_vectors))]
-    translation_factor = []
-    origin_trans_vec = []
-    for dim, factor in enumerate(packing_factors):
-        translation_factor.append((factor - 1) / 2)
-        origin_translation = (factor - 1) / 2 * x_v[dim] + (factor - 1) / 2 * y_v[dim]
-        origin_translation += (factor - 1) / 2 * z_v[dim]
-        origin_trans_vec.append(origin_translation)
-
-    packing_index = 0
-    for translation in translation_vectors:
-        for coor in coordinates:
-            x = coor[0] + translation[0] - origin_trans_vec[0]
-            y = coor[1] + translation[1] - origin_trans_vec[1]
-            z = coor[2] + translation[2] - origin_trans_vec[2]
-            packed_coors[packing_index].append([x, y, z])
-        packing_index += 1
-    return packed_coors
+    origin_trans_vec = (np.asarray(packing_factors) - 1) / 2 @ np.asarray(cell_vectors, dtype=float)
+    coordinates = np.asarray(coordinates, dtype=float)
+    translations = np.asarray(translation_vectors, dtype=float) - origin_trans_vec
+    return coordinates[np.newaxis, :, :] + translations[:, np.newaxis, :]
 
 
 def calculate_distance(p1, p2):
@@ -104,69 +105,193 @@ def calculate_distance(p1, p2):
     return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2 + (z2 - z1) ** 2)
 
 
-def pack_linkers_nodes(packed_mof):
+def pack_linkers_nodes(packed_mof, mof=None):
     """
     Calculate atomic indices for packed linkers and nodes.
+
+    Args:
+        - packed_mof (dict): Packed MOF (see pack_mof)
+        - mof (dict): Unit cell MOF with 'linkers' and 'nodes' indices (default: irmof1, see decomposition for others)
     """
+    mof = irmof1 if mof is None else mof
     n_cells = packed_mof['pack'][0] * packed_mof['pack'][1] * packed_mof['pack'][2]
     n_atoms = int(len(packed_mof['atoms']) / n_cells)
-    single_mof = deepcopy(irmof1)
-    packed_mof['linkers'], packed_mof['nodes'] = [], []
-    for c in range(n_cells):
-        for l in single_mof['linkers']:
-            packed_mof['linkers'].append([i + c * n_atoms for i in l])
-        for n in single_mof['nodes']:
-            packed_mof['nodes'].append([i + c * n_atoms for i in n])
+    packed_mof['linkers'] = pack_fragments(mof['linkers'], n_cells, n_atoms)
+    packed_mof['nodes'] = pack_fragments(mof['nodes'], n_cells, n_atoms)
     return packed_mof
 
 
-def delete_linkers_nodes(packed_mof, n_linkers_del, n_nodes_del):
+def pack_fragments(fragments, n_cells, n_atoms):
+    """
+    Repeat unit cell fragment indices (list of atom index lists) for each cell of a packed MOF.
+    Fragments are ordered cell by cell, same as the atoms of the packed MOF.
+    """
+    lengths = [len(f) for f in fragments]
+    flat = np.array([i for f in fragments for i in f], dtype=int)
+    packed = (flat[np.newaxis, :] + n_atoms * np.arange(n_cells)[:, np.newaxis]).ravel()
+    return [f.tolist() for f in np.split(packed, np.cumsum(lengths * n_cells)[:-1])]
+
+
+def atomic_masses(atoms):
+    """
+    Get atomic masses for given list of elements -> (N,) array
+    """
+    elements, element_idx = np.unique(np.asarray(atoms), return_inverse=True)
+    return np.array([ATOMIC_MASS[e] for e in elements])[element_idx]
+
+
+def center_of_mass(atoms, coordinates):
+    """
+    Calculate center of mass for given atoms and coordinates.
+    """
+    masses = atomic_masses(atoms)
+    return masses @ np.asarray(coordinates, dtype=float) / masses.sum()
+
+
+def fragment_centers(atoms, coordinates, fragments, cell=None):
+    """
+    Calculate masses and centers of mass of many fragments with a single segmented reduction.
+
+    Args:
+        - atoms (list): list of elements -> ['O', 'C', 'H', ...]
+        - coordinates (list): 2D list (or (N, 3) array) of atomic coordinates
+        - fragments (list): list of atom index lists -> [[0, 1, 2], [3, 4], ...]
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma]. If given, fragment atoms are unwrapped to
+                       the minimum image of the first atom of the fragment, so fragments split across the cell
+                       boundary are handled (fragments must be smaller than half of the cell).
+
+    Returns:
+        - tuple: fragment masses (M,) and centers of mass (M, 3)
+    """
+    lengths = np.array([len(f) for f in fragments], dtype=int)
+    frag_atoms = np.fromiter((i for f in fragments for i in f), dtype=int, count=lengths.sum())
+    segment = np.repeat(np.arange(len(fragments)), lengths)
+    coordinates = np.asarray(coordinates, dtype=float)[frag_atoms]
+    masses = atomic_masses(atoms)[frag_atoms]
+    if cell is not None:
+        lattice = np.array(cell_vectors(cell))
+        reference = coordinates[np.repeat(np.cumsum(lengths) - lengths, lengths)]
+        frac = (coordinates - reference) @ np.linalg.inv(lattice)
+        coordinates = reference + (frac - np.round(frac)) @ lattice
+    frag_masses = np.bincount(segment, weights=masses, minlength=len(fragments))
+    centers = np.column_stack([np.bincount(segment, weights=masses * coordinates[:, k], minlength=len(fragments))
+                               for k in range(3)])
+    return frag_masses, centers / frag_masses[:, np.newaxis]
+
+
+def rank_fragments(packed_mof, fragments, minimum_image=False):
+    """
+    Sort fragments (list of atom index lists) according to their distance to MOF center of mass.
+
+    Args:
+        - packed_mof (dict): Packed MOF atoms, coordinates, cell and pack
+        - fragments (list): list of atom index lists
+        - minimum_image (bool): Unwrap fragments split across the unit cell boundary (see fragment_centers)
+
+    Returns:
+        - ndarray: fragment indices, the farthest fragment first
+    """
+    mof_com = center_of_mass(packed_mof['atoms'], packed_mof['coordinates'])
+    unit_cell = None
+    if minimum_image:
+        unit_cell = [i / j for i, j in zip(packed_mof['cell'][:3], packed_mof['pack'])] + list(packed_mof['cell'][3:6])
+    _, centers = fragment_centers(packed_mof['atoms'], packed_mof['coordinates'], fragments, cell=unit_cell)
+    # Round off floating point noise so that equidistant fragments keep their original order
+    distances = np.round(np.linalg.norm(centers - mof_com, axis=1), 6)
+    return np.argsort(-distances, kind='stable')
+
+
+class FragmentQueue:
+    """
+    Atom indices of fragments laid out in deletion order, so the atoms of the first n fragments
+    to delete are a single contiguous slice.
+    """
+    def __init__(self, fragments, order):
+        """
+        Args:
+            - fragments (list): list of atom index lists
+            - order (ndarray): fragment indices in deletion order (see rank_fragments)
+        """
+        ordered = [fragments[i] for i in order]
+        self.atoms = np.array([i for f in ordered for i in f], dtype=int)
+        self.offsets = np.concatenate([[0], np.cumsum([len(f) for f in ordered])]).astype(int)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def atoms_between(self, start, stop):
+        """ Atom indices of fragments [start, stop) in deletion order """
+        return self.atoms[self.offsets[start]:self.offsets[stop]]
+
+
+def _atom_arrays(packed_mof):
+    """ Atoms and coordinates of a packed MOF as arrays and whether the input was given as lists """
+    as_list = not isinstance(packed_mof['coordinates'], np.ndarray)
+    return np.asarray(packed_mof['atoms']), np.asarray(packed_mof['coordinates']), as_list
+
+
+def _select_atoms(atoms, coordinates, keep, as_list=False):
+    """ Select atoms and coordinates (arrays) with a boolean mask (returned as lists if as_list) """
+    if as_list:
+        return dict(atoms=atoms[keep].tolist(), coordinates=coordinates[keep].tolist())
+    return dict(atoms=atoms[keep], coordinates=coordinates[keep])
+
+
+def delete_linkers_nodes(packed_mof, n_linkers_del, n_nodes_del, minimum_image=False):
     """
     Delete atoms that belong to selected linkers and nodes.
+    Linkers and nodes farthest from the MOF center of mass are deleted first.
 
     Args:
         - packed_mof (dict): MOF atoms, coordinates
         - n_linkers_del (int): Number of linkers to delete
         - n_nodes_del (int): Number of nodes to delete
+        - minimum_image (bool): Unwrap fragments split across the unit cell boundary (see fragment_centers)
     """
-    mof_com = center_of_mass(packed_mof['atoms'], packed_mof['coordinates'])
-    # --- Calculate distance of linkers to MOF center of mass
-    d_linkers = []
-    for link in packed_mof['linkers']:
-        link_coors = [packed_mof['coordinates'][i] for i in link]
-        link_atoms = [packed_mof['atoms'][i] for i in link]
-        l_com = center_of_mass(link_atoms, link_coors)
-        d_linkers.append(calculate_distance(mof_com, l_com))
-    # --- Calculate distance of nodes to MOF center of mass
-    d_nodes = []
-    for node in packed_mof['nodes']:
-        node_coors = [packed_mof['coordinates'][i] for i in node]
-        node_atoms = [packed_mof['atoms'][i] for i in node]
-        n_com = (center_of_mass(node_atoms, node_coors))
-        d_nodes.append(calculate_distance(mof_com, n_com))
-    # --- Sort nodes and linkers according to their distance and get the indices
-    sorted_node_idx = sorted(range(len(d_nodes)), key=lambda k: d_nodes[k], reverse=True)
-    sorted_linker_idx = sorted(range(len(d_linkers)), key=lambda k: d_linkers[k], reverse=True)
-    # --- Get all the linkers to be deleted
-    linkers_del = [packed_mof['linkers'][l] for l in sorted_linker_idx[:n_linkers_del]]
-    # --- Flatten to list to get all linker atoms to delete
-    linker_atoms_del = [i for s in linkers_del for i in s]
-    # --- Get all the nodes to be deleted
-    nodes_del = [packed_mof['nodes'][n] for n in sorted_node_idx[:n_nodes_del]]
-    # --- Flatten to list to get all linker atoms to delete
-    node_atoms_del = [i for s in nodes_del for i in s]
-    # --- Join list of atoms to delete
-    all_atoms_del = linker_atoms_del + node_atoms_del
-    # --- Select the atoms for degraded MOF
-    degraded_mof = dict(atoms=[], coordinates=[])
-    for i, (atom, coor) in enumerate(zip(packed_mof['atoms'], packed_mof['coordinates'])):
-        if i not in all_atoms_del:
-            degraded_mof['atoms'].append(atom)
-            degraded_mof['coordinates'].append(coor)
-    return degraded_mof
-
-
-def degrade_mof(packed_mof, degradation, file_name):
+    linkers = FragmentQueue(packed_mof['linkers'], rank_fragments(packed_mof, packed_mof['linkers'], minimum_image))
+    nodes = FragmentQueue(packed_mof['nodes'], rank_fragments(packed_mof, packed_mof['nodes'], minimum_image))
+    keep = np.ones(len(packed_mof['atoms']), dtype=bool)
+    keep[linkers.atoms_between(0, n_linkers_del)] = False
+    keep[nodes.atoms_between(0, n_nodes_del)] = False
+    atoms, coordinates, as_list = _atom_arrays(packed_mof)
+    return _select_atoms(atoms, coordinates, keep, as_list)
+
+
+def degradation_sweep(packed_mof, degradations, mof=None, minimum_image=False):
+    """
+    Degrade packed MOF for a series of degradation levels in a single pass.
+    Fragments are ranked once and each level only deletes (or restores) the fragments that changed
+    since the previous level, so increasing levels are the cheapest to sweep.
+
+    Args:
+        - packed_mof (dict): MOF atoms, coordinates (linkers and nodes are packed if missing)
+        - degradations (list): Degradation fractions for linkers and nodes -> [(d_l, d_n), ...]
+        - mof (dict): Unit cell MOF with 'linkers' and 'nodes' indices (default: irmof1)
+        - minimum_image (bool): Unwrap fragments split across the unit cell boundary (see fragment_centers)
+
+    Yields:
+        - tuple: (d_l, d_n), degraded MOF dict with atoms and coordinates keys
+    """
+    if 'linkers' not in packed_mof or 'nodes' not in packed_mof:
+        packed_mof = pack_linkers_nodes(packed_mof, mof)
+    queues = [FragmentQueue(packed_mof[key], rank_fragments(packed_mof, packed_mof[key], minimum_image))
+              for key in ['linkers', 'nodes']]
+    # Lists are converted to arrays once for all levels
+    atoms, coordinates, as_list = _atom_arrays(packed_mof)
+    keep = np.ones(len(atoms), dtype=bool)
+    n_deleted = [0, 0]
+    for degradation in degradations:
+        for i, (queue, fraction) in enumerate(zip(queues, degradation)):
+            n_del = int(fraction * len(queue))
+            if n_del > n_deleted[i]:
+                keep[queue.atoms_between(n_deleted[i], n_del)] = False
+            elif n_del < n_deleted[i]:
+                keep[queue.atoms_between(n_del, n_deleted[i])] = True
+            n_deleted[i] = n_del
+        yield tuple(degradation), _select_atoms(atoms, coordinates, keep, as_list)
+
+
+def degrade_mof(packed_mof, degradation, file_name, mof=None):
     """
     Degrade packed MOF.
 
@@ -174,16 +299,48 @@ def degrade_mof(packed_mof, degradation, file_name):
         - packed_mpf (dict): MOF atoms, coordinates
         - degradation (tuple): Degradation fractions for linkers and nodes (d_l, d_n)
         - file_name (str): File name to save degradaded MOF coordinates
+        - mof (dict): Unit cell MOF with 'linkers' and 'nodes' indices (default: irmof1)
     """
+    mof = irmof1 if mof is None else mof
     n_cells = packed_mof['pack'][0] * packed_mof['pack'][1] * packed_mof['pack'][2]
-    n_linkers, n_nodes = len(irmof1['linkers']) * n_cells, len(irmof1['nodes']) * n_cells
+    n_linkers, n_nodes = len(mof['linkers']) * n_cells, len(mof['nodes']) * n_cells
     n_linkers_del, n_nodes_del = int(degradation[0] * n_linkers), int(degradation[1] * n_nodes)
     print('%i / %i linkers will be deleted...' % (n_linkers_del, n_linkers))
     print('%i / %i nodes will be deleted...' % (n_nodes_del, n_nodes))
     print('Packing linkers and nodes...')
-    packed_mof = pack_linkers_nodes(packed_mof)
+    packed_mof = pack_linkers_nodes(packed_mof, mof)
     print('Deleting linker and note atoms...')
     degraded_mof = delete_linkers_nodes(packed_mof, n_linkers_del, n_nodes_del)
     print('Writing to file...')
     write_xyz(file_name, degraded_mof['atoms'], degraded_mof['coordinates'])
     print('Done! Saved as -> %s' % file_name)
+
+
+def degrade_mof_sweep(packed_mof, degradations, file_name, multiframe=False, mof=None):
+    """
+    Degrade packed MOF for many degradation levels and save each level.
+
+    Args:
+        - packed_mof (dict): MOF atoms, coordinates
+        - degradations (list): Degradation fractions for linkers and nodes -> [(d_l, d_n), ...]
+        - file_name (str): File name to save degraded MOF coordinates. Unless multiframe is used, it is
+                           formatted with linker and node degradation percentages -> 'IRMOF1-222-L%i-N%i.xyz'
+        - multiframe (bool): Save all levels as frames of a single xyz file (header -> 'L50-N50')
+        - mof (dict): Unit cell MOF with 'linkers' and 'nodes' indices (default: irmof1)
+
+    Returns:
+        - list: saved file names
+    """
+    saved = []
+    if multiframe:
+        open(file_name, 'w').close()
+    for (d_l, d_n), degraded_mof in degradation_sweep(packed_mof, degradations, mof):
+        header = 'L%i-N%i' % (round(d_l * 100), round(d_n * 100))
+        if multiframe:
+            write_xyz(file_name, degraded_mof['atoms'], degraded_mof['coordinates'], header=header, mode='a')
+        else:
+            level_file = file_name % (round(d_l * 100), round(d_n * 100))
+            write_xyz(level_file, degraded_mof['atoms'], degraded_mof['coordinates'], header=header)
+            saved.append(level_file)
+        print('%s -> %i atoms' % (header, len(degraded_mof['atoms'])))
+    return [file_name] if multiframe else saved
@@ -3,6 +3,10 @@ File input output
 """
 import os
 import glob
+import mmap
+import itertools
+import numpy as np
+from lattice import cell_vectors
 
 
 def read_xyz(file_name):
@@ -14,50 +18,162 @@ def read_xyz(file_name):
     Returns:
         - list: list of dictionaries with 'atoms' and 'coordinates' keys for each molecule in xyz file
      """
-    with open(file_name, 'r') as f:
-        xyz_lines = f.readlines()
-    mol_start = []
-    mol_idx = 0
-    for line_idx, line in enumerate(xyz_lines):
-        if len(line.split()) == 1 and line.split()[0].isdigit() and line_idx != mol_idx + 1:
-            mol_idx = line_idx
-            mol_start.append(mol_idx)
-    mol_start.append(len(xyz_lines))
-    molecules = []
-    for i in range(len(mol_start) - 1):
-        mol_lines = xyz_lines[mol_start[i] + 2:mol_start[i + 1]]
-        molecule = dict(atoms=[], coordinates=[])
-        for line in mol_lines:
-            molecule['atoms'].append(line.split()[0])
-            molecule['coordinates'].append([float(i) for i in line.split()[1:4]])
-        molecules.append(molecule)
-    return molecules
-
-
-def write_pdb(file_name, atoms, coordinates, header='mol'):
-    """ Write given atomic coordinates to file in pdb format """
-    with open(file_name, 'w') as pdb_file:
+    return [dict(atoms=frame['atoms'].tolist(), coordinates=frame['coordinates'].tolist()) for frame in iter_xyz(file_name)]
+
+
+def iter_xyz(file_name):
+    """ Iterate over frames of a (multi-frame) xyz file, only one frame is kept in memory.
+
+    Args:
+        - file_name (str): Path to the xyz file
+
+    Yields:
+        - dict: 'atoms' (N,) str array, 'coordinates' (N, 3) float array and 'header' for each frame
+    """
+    with open(file_name, 'rb') as xyz_file:
+        for line in xyz_file:
+            if len(line.strip()) == 0:
+                continue
+            n_atoms = int(line)
+            header = xyz_file.readline()
+            block = b''.join(itertools.islice(xyz_file, n_atoms))
+            yield _parse_xyz_block(block, n_atoms, header)
+
+
+def _parse_xyz_block(block, n_atoms, header=b''):
+    """ Parse atom lines of a single xyz frame into numpy arrays """
+    tokens = block.split()
+    if len(tokens) != 4 * n_atoms:
+        # Extra columns (velocities, charges...) -> only keep element and coordinates
+        tokens = [t for line in block.splitlines() for t in line.split()[:4]]
+    if len(tokens) != 4 * n_atoms:
+        raise ValueError('Expected %i atoms in xyz frame, found %i' % (n_atoms, len(tokens) // 4))
+    atoms = np.array(tokens[::4]).astype(str)
+    del tokens[::4]
+    coordinates = np.fromiter(map(float, tokens), dtype=float, count=3 * n_atoms).reshape(n_atoms, 3)
+    return dict(atoms=atoms, coordinates=coordinates, header=header.decode().strip())
+
+
+def index_xyz(file_name, save=True):
+    """ Build (or load) the byte offset index of the frames in a multi-frame xyz file.
+    The index is saved next to the xyz file (file_name.idx.npz) and rebuilt when the xyz file changes.
+
+    Args:
+        - file_name (str): Path to the xyz file
+        - save (bool): Save index file
+
+    Returns:
+        - ndarray: (n_frames, 4) -> number of atoms, header, atom lines start and atom lines end byte offsets
+    """
+    index_file = '%s.idx.npz' % file_name
+    stat = os.stat(file_name)
+    if os.path.exists(index_file):
+        index = np.load(index_file)
+        if index['size'] == stat.st_size and index['mtime'] == stat.st_mtime_ns:
+            return index['frames']
+    frames = []
+    if stat.st_size > 0:
+        with open(file_name, 'rb') as xyz_file, mmap.mmap(xyz_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            position = 0
+            while position < stat.st_size:
+                line_end = _line_end(mm, position)
+                if len(mm[position:line_end].strip()) == 0:
+                    position = line_end
+                    continue
+                n_atoms = int(mm[position:line_end])
+                atoms_start = _line_end(mm, line_end)
+                atoms_end = _skip_lines(mm, atoms_start, n_atoms)
+                frames.append([n_atoms, line_end, atoms_start, atoms_end])
+                position = atoms_end
+    frames = np.array(frames, dtype=np.int64).reshape(-1, 4)
+    if save:
+        np.savez(index_file, frames=frames, size=stat.st_size, mtime=stat.st_mtime_ns)
+    return frames
+
+
+def _line_end(mm, position):
+    """ Byte offset of the start of the next line """
+    newline = mm.find(b'\n', position)
+    return len(mm) if newline < 0 else newline + 1
+
+
+def _skip_lines(mm, position, n_lines, line_length=64):
+    """ Byte offset after skipping n lines, newlines are counted with numpy in blocks """
+    while n_lines > 0 and position < len(mm):
+        block = np.frombuffer(mm[position:position + max(n_lines * line_length, 4096)], dtype=np.uint8)
+        newlines = np.flatnonzero(block == 10)
+        if len(newlines) >= n_lines:
+            return position + int(newlines[n_lines - 1]) + 1
+        n_lines -= len(newlines)
+        position += len(block)
+    return min(position, len(mm))
+
+
+def read_xyz_frame(file_name, frame, index=None):
+    """ Read a single frame of a multi-frame xyz file using the frame index (random access).
+
+    Args:
+        - file_name (str): Path to the xyz file
+        - frame (int): Frame number (negative numbers count from the end)
+        - index (ndarray): Frame index (see index_xyz), built or loaded if not given
+
+    Returns:
+        - dict: 'atoms' (N,) str array, 'coordinates' (N, 3) float array and 'header'
+    """
+    index = index_xyz(file_name) if index is None else index
+    n_atoms, header_start, start, end = index[frame]
+    with open(file_name, 'rb') as xyz_file, mmap.mmap(xyz_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _parse_xyz_block(mm[start:end], n_atoms, mm[header_start:start])
+
+
+def _write_rows(out_file, row_format, columns, chunk_size=50000):
+    """ Format and write table rows in chunks, every chunk is formatted with a single % operation.
+
+    Args:
+        - out_file (file): Open file to write to
+        - row_format (str): Format of a single row -> '%s %.4f %.4f %.4f\\n'
+        - columns (list): Row values as columns (sequences with the same length)
+        - chunk_size (int): Number of rows formatted at once (bounds the size of the string buffer)
+    """
+    n_rows = len(columns[0]) if len(columns) > 0 else 0
+    for start in range(0, n_rows, chunk_size):
+        chunk = [np.asarray(c[start:start + chunk_size]).tolist() for c in columns]
+        values = tuple(itertools.chain.from_iterable(zip(*chunk)))
+        out_file.write((row_format * len(chunk[0])) % values)
+
+
+def _as_columns(atoms, coordinates):
+    """ Element and x, y, z columns """
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 3)
+    return np.asarray(atoms, dtype=str), coordinates[:, 0], coordinates[:, 1], coordinates[:, 2]
+
+
+def write_pdb(file_name, atoms, coordinates, header='mol', mode='w'):
+    """ Write given atomic coordinates to file in pdb format (use mode='a' to append a new frame) """
+    atoms, x, y, z = _as_columns(atoms, coordinates)
+    with open(file_name, mode) as pdb_file:
         pdb_file.write('HEADER    ' + header + '\n')
         format = 'HETATM%5d%3s  MOL     1     %8.3f%8.3f%8.3f  1.00  0.00          %2s\n'
-        for atom_index, (atom_name, atom_coor) in enumerate(zip(atoms, coordinates), start=1):
-            x, y, z = atom_coor
-            pdb_file.write(format % (atom_index, atom_name, x, y, z, atom_name.rjust(2)))
+        _write_rows(pdb_file, format, [np.arange(1, len(atoms) + 1), atoms, x, y, z, np.char.rjust(atoms, 2)])
         pdb_file.write('END\n')
 
 
-def write_xyz(file_name, atoms, coordinates, header='mol'):
-    """ Write given atomic coordinates to file in xyz format """
-    with open(file_name, 'w') as xyz_file:
-        xyz_file.write(str(len(coordinates)) + '\n')
+def write_xyz(file_name, atoms, coordinates, header='mol', mode='w'):
+    """ Write given atomic coordinates to file in xyz format (use mode='a' to append a new frame) """
+    atoms, x, y, z = _as_columns(atoms, coordinates)
+    with open(file_name, mode) as xyz_file:
+        xyz_file.write(str(len(atoms)) + '\n')
         xyz_file.write(header + '\n')
-        format = '%s %.4f %.4f %.4f\n'
-        for atom, coor in zip(atoms, coordinates):
-            xyz_file.write(format % (atom, coor[0], coor[1], coor[2]))
+        _write_rows(xyz_file, '%s %.4f %.4f %.4f\n', [atoms, x, y, z])
+
 
+def write_cif(file_name, atoms, coordinates, header='mol', cell=[1, 1, 1, 90, 90, 90], fractional=False, mode='w'):
+    """ Write given atomic coordinates to file in cif format (use mode='a' to append a new data block)
 
-def write_cif(file_name, atoms, coordinates, header='mol', cell=[1, 1, 1, 90, 90, 90], fractional=False):
-    """ Write given atomic coordinates to file in cif format """
-    with open(file_name, 'w') as cif_file:
+    Args:
+        - fractional (bool): Convert given cartesian coordinates to fractional coordinates (any triclinic cell)
+    """
+    with open(file_name, mode) as cif_file:
         cif_file.write('data_%s\n' % header)
         cif_file.write('_cell_length_a                  %7.4f\n' % cell[0])
         cif_file.write('_cell_length_b                  %7.4f\n' % cell[1])
@@ -73,14 +189,27 @@ def write_cif(file_name, atoms, coordinates, header='mol', cell=[1, 1, 1, 90, 90
         cif_file.write('_atom_site_fract_z\n')
         cif_format = '%s%-4i %2s %7.4f %7.4f %7.4f\n'
         if fractional:
-            coordinates = fractional_coordinates(coordinates, cell=cell[:3])
-        for i, (atom, coor) in enumerate(zip(atoms, coordinates)):
-            cif_file.write(cif_format % (atom, i, atom, coor[0], coor[1], coor[2]))
+            coordinates = fractional_coordinates(coordinates, cell=cell)
+        atoms, x, y, z = _as_columns(atoms, coordinates)
+        _write_rows(cif_file, cif_format, [atoms, np.arange(len(atoms)), atoms, x, y, z])
+
+
+def fractional_coordinates(coordinates, cell=[1, 1, 1, 90, 90, 90]):
+    """ Convert cartesian coordinates to fractional coordinates using the inverse lattice matrix.
+
+    Args:
+        - coordinates (list): 2D list (or (N, 3) array) of cartesian coordinates
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma] ([a, b, c] for orthogonal cells)
+
+    Returns:
+        - ndarray: (N, 3) fractional coordinates
+    """
+    cell = list(cell) + [90, 90, 90] if len(cell) == 3 else cell
+    lattice = np.array(cell_vectors(cell))
+    return np.asarray(coordinates, dtype=float).reshape(-1, 3) @ np.linalg.inv(lattice)
 
 
-def fractional_coordinates(coordinates, cell=[1, 1, 1]):
-    """ Convert cartesian coordinates to fractional coordinates (ONLY ORTHOGONAL CELLS!) """
-    frac_coor = []
-    for coor in coordinates:
-        frac_coor.append([cr / cl for (cr, cl) in zip(coor, cell)])
-    return frac_coor
+def cartesian_coordinates(fractional, cell=[1, 1, 1, 90, 90, 90]):
+    """ Convert fractional coordinates to cartesian coordinates -> (N, 3) array """
+    cell = list(cell) + [90, 90, 90] if len(cell) == 3 else cell
+    return np.asarray(fractional, dtype=float).reshape(-1, 3) @ np.array(cell_vectors(cell))
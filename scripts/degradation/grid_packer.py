@@ -0,0 +1,303 @@
+"""
+Native insertion packer for simple solvation boxes.
+
+Fixed structures (the MOF) are voxelized once: a voxel is blocked when every point inside it is closer than the
+tolerance to a fixed atom. Rigid molecules are inserted with random rotations in batches of trial positions; trials
+with an atom in a blocked voxel are rejected at once and the remaining trials are checked exactly (and vectorized)
+against a cell list of all placed atoms. Structures are given in the same format as Packmol.add_structure and Packmol is only run when
+some molecules can not be placed.
+
+ >>> gpack = GridPacker(options={'tolerance': 2.0, 'seed': 42})
+ >>> gpack.add_structure({'structure': 'IRMOF1-222-L50-N50.xyz', 'number': 1,
+ ...                      'position': {'fixed': '46. 46. 46. 0. 0. 0.', 'centerofmass': ''}})
+ >>> gpack.add_structure({'structure': 'water.xyz', 'number': 3000, 'position': {'inside box': '2. 2. 2. 90. 90. 90.'}})
+ >>> result = gpack.run('pmol-temp', 'packmol')
+"""
+import os
+import time
+import numpy as np
+from file_io import read_xyz, write_xyz
+from neighbors import OFFSETS
+from packmol import Packmol
+
+
+SUPPORTED_POSITIONS = ['fixed', 'center', 'centerofmass', 'inside box', 'inside sphere']
+
+
+def random_rotations(n, rng):
+    """ Uniformly distributed random rotation matrices (n, 3, 3) from random unit quaternions """
+    q = rng.normal(size=(n, 4))
+    w, x, y, z = (q / np.linalg.norm(q, axis=1)[:, None]).T
+    return np.stack([np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=1),
+                     np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=1),
+                     np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1)], axis=1)
+
+
+def euler_rotation(a, b, g):
+    """ Rotation matrix for rotations around x, y and z axes (radians) """
+    rx = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]])
+    ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    rz = np.array([[np.cos(g), -np.sin(g), 0], [np.sin(g), np.cos(g), 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+
+class _CellList:
+    """
+    Cell list of placed atoms stored as a dense (n_cells, capacity, 3) array (empty slots are at infinity),
+    so the overlap test of a batch of trial molecules is a single vectorized gather.
+    """
+    def __init__(self, origin, size, cell_size, capacity=4):
+        # One empty cell on every side so neighbor cells are always inside the grid
+        self.origin = np.asarray(origin, dtype=float) - cell_size
+        self.cell_size = cell_size
+        self.dims = np.maximum(np.ceil(np.asarray(size) / cell_size).astype(int), 1) + 2
+        self.positions = np.full((np.prod(self.dims), capacity, 3), np.inf)
+        self.counts = np.zeros(np.prod(self.dims), dtype=int)
+        self.offsets = np.ravel_multi_index((OFFSETS + 1).T, self.dims) - np.ravel_multi_index((1, 1, 1), self.dims)
+
+    def _ids(self, coordinates):
+        idx = np.clip(np.floor((coordinates - self.origin) / self.cell_size).astype(int), 1, self.dims - 2)
+        return np.ravel_multi_index(np.moveaxis(idx, -1, 0), self.dims)
+
+    def add(self, coordinates):
+        ids = self._ids(coordinates)
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+        first = np.searchsorted(sorted_ids, sorted_ids)
+        slots = np.empty(len(ids), dtype=int)
+        slots[order] = self.counts[sorted_ids] + np.arange(len(ids)) - first
+        if slots.max() >= self.positions.shape[1]:
+            grown = np.full((len(self.positions), 2 * slots.max() + 1, 3), np.inf)
+            grown[:, :self.positions.shape[1]] = self.positions
+            self.positions = grown
+        self.positions[ids, slots] = coordinates
+        np.add.at(self.counts, ids, 1)
+
+    def min_distance2(self, trials):
+        """ Minimum squared distance between the atoms of every trial (first axis) and the placed atoms """
+        neighbor_ids = self._ids(trials)[..., None] + self.offsets
+        vectors = self.positions[neighbor_ids] - trials[..., None, None, :]
+        return np.einsum('...i,...i->...', vectors, vectors).reshape(len(trials), -1).min(axis=1)
+
+
+class _VoxelGrid:
+    """ Voxels that are fully within the tolerance distance of placed atoms """
+    def __init__(self, origin, size, tolerance):
+        self.origin = np.asarray(origin, dtype=float)
+        self.voxel = tolerance / 2
+        self.dims = np.maximum(np.ceil(np.asarray(size) / self.voxel).astype(int), 1)
+        self.blocked = np.zeros(self.dims, dtype=bool)
+        # Voxel center closer than r_block to an atom -> every point in the voxel is closer than the tolerance
+        self.r_block = tolerance - self.voxel * np.sqrt(3) / 2
+        n = int(np.ceil(self.r_block / self.voxel)) + 1
+        self.stencil = np.indices((2 * n + 1,) * 3).reshape(3, -1).T - n
+
+    def block(self, coordinates, chunk_size=20000):
+        for start in range(0, len(coordinates), chunk_size):
+            scaled = (coordinates[start:start + chunk_size] - self.origin) / self.voxel
+            idx = (np.floor(scaled).astype(int)[:, None, :] + self.stencil).reshape(-1, 3)
+            distances = np.linalg.norm((idx + 0.5 - np.repeat(scaled, len(self.stencil), axis=0)) * self.voxel, axis=1)
+            idx = idx[(distances < self.r_block) & np.all((idx >= 0) & (idx < self.dims), axis=1)]
+            self.blocked[tuple(idx.T)] = True
+
+    def overlapping(self, coordinates):
+        """ Trials (first axis) with at least one atom in a blocked voxel """
+        idx = np.floor((coordinates - self.origin) / self.voxel).astype(int)
+        inside = np.all((idx >= 0) & (idx < self.dims), axis=-1)
+        idx = np.where(inside[..., None], idx, 0)
+        return np.any(self.blocked[idx[..., 0], idx[..., 1], idx[..., 2]] & inside, axis=-1)
+
+
+class GridPacker:
+    """
+    Grid based insertion packer with the same interface as Packmol (options, add_structure, run).
+
+    Options:
+        - tolerance (float): Minimum distance between atoms of different molecules
+        - seed (int): Random seed
+        - output (str): Packed structure file name (xyz)
+        - batch (int): Number of trial positions tested at once
+        - max_trials (int): Number of trial positions per molecule before the packing is given up
+    """
+    def __init__(self, options={}, structures=[]):
+        self.structures = list(structures)
+        self.options = {'command_line': 'packmol',
+                        'seed': None,
+                        'tolerance': 2.0,
+                        'filetype': 'xyz',
+                        'output': 'packed.xyz',
+                        'input': 'packmol.inp',
+                        'batch': 64,
+                        'max_trials': 20000
+                        }
+        self.set_options(options)
+
+    def set_options(self, options):
+        """ Update option values """
+        for key, value in options.items():
+            self.options[key] = value
+
+    def add_structure(self, structure):
+        """
+        Add one or more structure group to be packed (see Packmol.add_structure).
+        """
+        self.structures.append(structure)
+
+    def supported(self):
+        """ Check if all structure constraints can be handled by the grid packer """
+        return self.options['filetype'] == 'xyz' and all(key in SUPPORTED_POSITIONS for s in self.structures
+                                                         for key in s['position'])
+
+    def _read(self, source_dir):
+        """ Read structures and split them into fixed structures and molecules to insert """
+        fixed, molecules = [], []
+        for s in self.structures:
+            structure = read_xyz(os.path.join(source_dir, s['structure']))[0]
+            atoms, coordinates = structure['atoms'], np.array(structure['coordinates'], dtype=float)
+            position = s['position']
+            if 'fixed' in position:
+                x, y, z, a, b, g = [float(i) for i in position['fixed'].split()]
+                center = coordinates.mean(axis=0)
+                coordinates = (coordinates - center) @ euler_rotation(a, b, g).T + center
+                if 'center' in position or 'centerofmass' in position:
+                    coordinates += np.array([x, y, z]) - center
+                else:
+                    coordinates += np.array([x, y, z])
+                fixed.append(dict(atoms=atoms, coordinates=coordinates, number=int(s['number'])))
+            else:
+                region = [(key, [float(i) for i in value.split()]) for key, value in position.items()
+                          if key.startswith('inside')]
+                coordinates = coordinates - coordinates.mean(axis=0)
+                molecules.append(dict(atoms=atoms, coordinates=coordinates, number=int(s['number']), region=region,
+                                      radius=np.linalg.norm(coordinates, axis=1).max()))
+        return fixed, molecules
+
+    @staticmethod
+    def _bounds(region):
+        """ Lower and upper corner of the box containing the molecule centers for the region constraints """
+        lower, upper = np.full(3, -np.inf), np.full(3, np.inf)
+        for key, values in region:
+            if key == 'inside box':
+                lo, hi = np.array(values[:3]), np.array(values[3:6])
+            else:
+                lo, hi = np.array(values[:3]) - values[3], np.array(values[:3]) + values[3]
+            lower, upper = np.maximum(lower, lo), np.minimum(upper, hi)
+        return lower, upper
+
+    @staticmethod
+    def _inside(trials, region):
+        """ Trials (first axis) with all atoms inside all region constraints """
+        inside = np.ones(len(trials), dtype=bool)
+        for key, values in region:
+            if key == 'inside box':
+                inside &= np.all((trials >= values[:3]) & (trials <= values[3:6]), axis=(1, 2))
+            else:
+                inside &= np.all(np.linalg.norm(trials - values[:3], axis=2) <= values[3], axis=1)
+        return inside
+
+    @staticmethod
+    def _conflicts(trials, tolerance, radius):
+        """ Pairs of trials (first axis) closer than the tolerance to each other -> (n_trials, n_trials) bool """
+        conflicts = np.zeros((len(trials), len(trials)), dtype=bool)
+        centers = trials.mean(axis=1)
+        close = ((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2) < (2 * radius + tolerance) ** 2
+        i, j = np.nonzero(np.triu(close, 1))
+        if len(i) > 0:
+            d2 = ((trials[i][:, :, None, :] - trials[j][:, None, :, :]) ** 2).sum(axis=3).reshape(len(i), -1)
+            overlap = d2.min(axis=1) < tolerance ** 2
+            conflicts[i[overlap], j[overlap]] = conflicts[j[overlap], i[overlap]] = True
+        return conflicts
+
+    def pack(self, source_dir):
+        """
+        Pack structures without running packmol.
+
+        Args:
+            - source_dir (str): Directory with the structure files
+
+        Returns:
+            - dict: status ('success' or 'failed'), atoms, coordinates (ndarray), placed (number of molecules placed
+                    for each inserted structure) and duration
+        """
+        start = time.time()
+        rng = np.random.default_rng(self.options['seed'])
+        tolerance, batch = self.options['tolerance'], self.options['batch']
+        fixed, molecules = self._read(source_dir)
+        for m in molecules:
+            m['lower'], m['upper'] = self._bounds(m['region'])
+            if not np.all(np.isfinite(m['lower'])):
+                raise ValueError('Molecules to insert need an inside box or inside sphere constraint')
+
+        fixed_coordinates = np.concatenate([f['coordinates'] for f in fixed]) if fixed else np.empty((0, 3))
+        corners = np.concatenate([fixed_coordinates] + [[m['lower'], m['upper']] for m in molecules])
+        origin = corners.min(axis=0) - tolerance
+        size = corners.max(axis=0) + tolerance - origin
+        cells = _CellList(origin, size, tolerance)
+        voxels = _VoxelGrid(origin, size, tolerance)
+        if len(fixed_coordinates) > 0:
+            cells.add(fixed_coordinates)
+            voxels.block(fixed_coordinates)
+
+        atoms = [a for f in fixed for a in f['atoms']]
+        coordinates = [fixed_coordinates]
+        placed = []
+        for m in molecules:
+            n_placed, n_trials = 0, 0
+            while n_placed < m['number'] and n_trials < self.options['max_trials']:
+                centers = m['lower'] + rng.random((batch, 3)) * (m['upper'] - m['lower'])
+                trials = np.einsum('nij,aj->nai', random_rotations(batch, rng), m['coordinates']) + centers[:, None, :]
+                n_trials += batch
+                trials = trials[self._inside(trials, m['region']) & ~voxels.overlapping(trials)]
+                trials = trials[cells.min_distance2(trials) >= tolerance ** 2]
+                # Trials of the same batch can overlap each other -> accept them one by one
+                conflicts = self._conflicts(trials, tolerance, m['radius'])
+                selected = np.zeros(len(trials), dtype=bool)
+                for i in range(len(trials)):
+                    if selected.sum() == m['number'] - n_placed:
+                        break
+                    selected[i] = not np.any(conflicts[i] & selected)
+                accepted = list(trials[selected])
+                if len(accepted) > 0:
+                    accepted = np.concatenate(accepted)
+                    cells.add(accepted)
+                    coordinates.append(accepted)
+                    n_new = len(accepted) // len(m['atoms'])
+                    atoms += m['atoms'] * n_new
+                    n_placed += n_new
+                    n_trials = 0
+            placed.append(n_placed)
+        status = 'success' if all(n == m['number'] for n, m in zip(placed, molecules)) else 'failed'
+        return dict(status=status, atoms=atoms, coordinates=np.concatenate(coordinates), placed=placed,
+                    duration=time.time() - start)
+
+    def run(self, run_dir, source_dir, fallback=True, **kwargs):
+        """
+        Pack structures and save the packed structure to the run directory. Packmol is run when the constraints are
+        not supported or not all molecules could be placed.
+
+        Args:
+            - run_dir (str): Run directory
+            - source_dir (str): Directory with the structure files (and the packmol executable for the fallback)
+            - fallback (bool): Run packmol if the grid packer fails
+            - kwargs: Packmol.run arguments for the fallback (timeout, cache, monitor)
+
+        Returns:
+            - dict: status, method ('grid' or 'packmol'), duration and placed (grid packer) or packmol result
+        """
+        result = None
+        if self.supported():
+            packing = self.pack(source_dir)
+            result = dict(status=packing['status'], method='grid', duration=packing['duration'],
+                          placed=packing['placed'])
+            if packing['status'] == 'success':
+                os.makedirs(run_dir, exist_ok=True)
+                write_xyz(os.path.join(run_dir, self.options['output']), packing['atoms'], packing['coordinates'],
+                          header='Built with GridPacker')
+                return result
+        if not fallback:
+            return result if result is not None else dict(status='failed', method='grid', duration=0.0, placed=[])
+        packmol = Packmol(options={k: v for k, v in self.options.items() if k not in ['batch', 'max_trials']},
+                          structures=self.structures)
+        packmol_result = packmol.run(run_dir, source_dir, **kwargs)
+        packmol_result['method'] = 'packmol'
+        return packmol_result
@@ -22,11 +22,11 @@ O    O
  /  \
 O    O
 """
-import yaml
+import os
+from structure_cache import cached_structure
 
 
-with open('irmof1.yaml', 'r') as irmof1_yaml:
-    irmof1 = yaml.load(irmof1_yaml)
+IRMOF1_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'irmof1.yaml')
 
 node1 = [33, 35, 92, 115, 163]     # Zn, Zn, Zn, O, Zn
 node2 = [38, 40, 96, 125, 209]     # Zn, Zn, Zn, O, Zn
@@ -71,25 +71,39 @@ linkers = [linker1, linker2, linker3, linker4, linker5, linker6, linker7, linker
            linker11, linker12, linker13, linker14, linker15, linker16, linker17, linker18, linker19,
            linker20, linker21, linker22, linker23, linker24]
 
-# Make sure every atom is included in nodes and linkers
-all_nodes = [i for s in nodes for i in s]
-all_linkers = [i for s in linkers for i in s]
-assert set(all_nodes + all_linkers) == set(range(1, len(irmof1['atoms']) + 1))
 
-# Make sure there are no duplicates
-assert len(all_nodes + all_linkers) == 424
+def read_irmof1():
+    """
+    Read IRMOF-1 atoms and coordinates from irmof1.yaml and add linker and node indices (starting from 0).
+    """
+    import yaml
+    with open(IRMOF1_YAML, 'r') as irmof1_yaml:
+        irmof1 = yaml.safe_load(irmof1_yaml)
 
-# Make sure all linkers have same number of atoms
-assert all(len(x) == 16 for x in linkers)
+    # Make sure every atom is included in nodes and linkers
+    all_nodes = [i for s in nodes for i in s]
+    all_linkers = [i for s in linkers for i in s]
+    assert set(all_nodes + all_linkers) == set(range(1, len(irmof1['atoms']) + 1))
 
-# Make sure all nodes have same number of atoms
-assert all(len(x) == 5 for x in nodes)
+    # Make sure there are no duplicates
+    assert len(all_nodes + all_linkers) == 424
 
-irmof1['nodes'], irmof1['linkers'] = [], []
-for n in nodes:
-    irmof1['nodes'].append([i - 1 for i in n])
-for l in linkers:
-    irmof1['linkers'].append([i - 1 for i in l])
+    # Make sure all linkers have same number of atoms
+    assert all(len(x) == 16 for x in linkers)
 
-irmof1['cell'] = [25.832, 25.832, 25.832, 90, 90, 90]
-irmof1['com'] = [12.916, 12.916, 12.916]
+    # Make sure all nodes have same number of atoms
+    assert all(len(x) == 5 for x in nodes)
+
+    irmof1['nodes'], irmof1['linkers'] = [], []
+    for n in nodes:
+        irmof1['nodes'].append([i - 1 for i in n])
+    for l in linkers:
+        irmof1['linkers'].append([i - 1 for i in l])
+
+    irmof1['cell'] = [25.832, 25.832, 25.832, 90, 90, 90]
+    irmof1['com'] = [12.916, 12.916, 12.916]
+    return irmof1
+
+
+# Cached as binary arrays, rebuilt only when irmof1.yaml or this file changes
+irmof1 = cached_structure('irmof1', [IRMOF1_YAML, os.path.abspath(__file__)], {}, read_irmof1, as_list=True)
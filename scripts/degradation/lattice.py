@@ -0,0 +1,43 @@
+"""
+Unit cell (lattice) geometry for periodic structures
+"""
+import math
+import numpy as np
+
+
+def cell_vectors(cell):
+    """
+    Calculate unit cell vectors for given cell dimensions -> [a, b, c, alpha, beta, gamma]
+    """
+    a, b, c = cell[:3]
+    alpha, beta, gamma = [math.radians(i) for i in cell[3:6]]
+
+    x_v = [a, 0, 0]
+    y_v = [b * math.cos(gamma), b * math.sin(gamma), 0]
+    z_v = [0.0] * 3
+    z_v[0] = c * math.cos(beta)
+    z_v[1] = (c * b * math.cos(alpha) - y_v[0] * z_v[0]) / y_v[1]
+    z_v[2] = math.sqrt(c * c - z_v[0] * z_v[0] - z_v[1] * z_v[1])
+    return [x_v, y_v, z_v]
+
+
+def perpendicular_widths(lattice):
+    """
+    Calculate distances between opposite faces of the cell for given (3, 3) lattice matrix (rows are cell vectors).
+    """
+    lattice = np.asarray(lattice, dtype=float)
+    volume = abs(np.linalg.det(lattice))
+    areas = np.linalg.norm(np.cross(lattice[[1, 2, 0]], lattice[[2, 0, 1]]), axis=1)
+    return volume / areas
+
+
+def cell_parameters(lattice):
+    """
+    Calculate cell dimensions -> [a, b, c, alpha, beta, gamma] for given (3, 3) lattice matrix (rows are cell vectors).
+    """
+    lattice = np.asarray(lattice, dtype=float)
+    a, b, c = np.linalg.norm(lattice, axis=1)
+    alpha = math.degrees(math.acos(np.dot(lattice[1], lattice[2]) / (b * c)))
+    beta = math.degrees(math.acos(np.dot(lattice[0], lattice[2]) / (a * c)))
+    gamma = math.degrees(math.acos(np.dot(lattice[0], lattice[1]) / (a * b)))
+    return [float(a), float(b), float(c), alpha, beta, gamma]
@@ -0,0 +1,75 @@
+"""
+Neighbor search for periodic and non-periodic structures using cell lists
+"""
+import numpy as np
+from lattice import cell_vectors, perpendicular_widths
+
+
+OFFSETS = np.indices((3, 3, 3)).reshape(3, -1).T - 1
+
+
+def neighbor_pairs(coordinates, cell=None, cutoff=3.0):
+    """
+    Find all atom pairs closer than the cutoff distance in O(N) using a cell list.
+    For periodic cells distances follow the minimum image convention, pairs with different images are
+    reported separately in small cells.
+
+    Args:
+        - coordinates (list): 2D list (or (N, 3) array) of cartesian coordinates
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma] (None for non-periodic structures)
+        - cutoff (float): Cutoff distance in Angstrom
+
+    Returns:
+        - tuple: atom indices i, j (i < j), distances (M,) and distance vectors (M, 3) pointing from i to j
+    """
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 3)
+    n_atoms = len(coordinates)
+    periodic = cell is not None
+    if periodic:
+        lattice = np.array(cell_vectors(cell))
+        frac = coordinates @ np.linalg.inv(lattice)
+        frac -= np.floor(frac)
+        if np.any(perpendicular_widths(lattice) < cutoff):
+            raise ValueError('Cell is smaller than the cutoff distance (%.2f), replicate the cell first' % cutoff)
+    else:
+        # Box wide enough that wrapping around it never brings two atoms within the cutoff
+        origin = coordinates.min(axis=0) if n_atoms > 0 else np.zeros(3)
+        lattice = np.diag(np.ptp(coordinates, axis=0) + cutoff if n_atoms > 0 else np.full(3, cutoff))
+        frac = (coordinates - origin) / np.diag(lattice)
+    positions = frac @ lattice
+
+    n_bins = np.maximum((perpendicular_widths(lattice) / cutoff).astype(int), 1)
+    bins = np.minimum((frac * n_bins).astype(int), n_bins - 1)
+    bin_id = np.ravel_multi_index(bins.T, n_bins)
+    order = np.argsort(bin_id, kind='stable')
+    counts = np.bincount(bin_id, minlength=np.prod(n_bins))
+    starts = np.cumsum(counts) - counts
+
+    pair_i, pair_j, pair_v = [], [], []
+    for offset in OFFSETS:
+        neighbor_bins = bins + offset
+        shift = np.floor_divide(neighbor_bins, n_bins)
+        neighbor_id = np.ravel_multi_index((neighbor_bins - shift * n_bins).T, n_bins)
+        n_neighbors = counts[neighbor_id]
+        if not periodic:
+            n_neighbors = np.where(np.any(shift != 0, axis=1), 0, n_neighbors)
+        total = n_neighbors.sum()
+        if total == 0:
+            continue
+        i = np.repeat(np.arange(n_atoms), n_neighbors)
+        first = np.repeat(starts[neighbor_id] - (np.cumsum(n_neighbors) - n_neighbors), n_neighbors)
+        j = order[first + np.arange(total)]
+        keep = i < j
+        i, j = i[keep], j[keep]
+        vectors = positions[j] - positions[i]
+        if periodic:
+            vectors += np.repeat(shift, n_neighbors, axis=0)[keep] @ lattice
+        close = np.einsum('ij,ij->i', vectors, vectors) < cutoff ** 2
+        pair_i.append(i[close])
+        pair_j.append(j[close])
+        pair_v.append(vectors[close])
+
+    if len(pair_i) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0), np.zeros((0, 3))
+    pair_v = np.concatenate(pair_v)
+    return np.concatenate(pair_i), np.concatenate(pair_j), np.linalg.norm(pair_v, axis=1), pair_v
@@ -0,0 +1,203 @@
+"""
+Content-addressed cache for packmol runs.
+
+Files (packmol executable, structure files and packed outputs) are saved once in a shared store under the sha1 of
+their contents and hard linked (or symlinked) into run directories instead of being copied. A packing is keyed by the
+hash of the generated packmol input (options, structures, counts, constraints and seed) and the contents of all
+input files, so an identical packing is restored instantly from the store. Least recently used packings are
+evicted when the store grows beyond a size limit.
+
+ >>> cache = PackmolCache(max_size=5e9)
+ >>> result = pmol.run('pmol-temp', 'packmol', cache=cache)
+ >>> result['cached']
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from structure_cache import CACHE_DIR
+
+
+class PackmolCache:
+    """
+    Packmol input/output cache with a shared content-addressed file store.
+
+    Args:
+        - cache_dir (str): Cache directory (default: .cache/packmol next to this file)
+        - max_size (float): Maximum store size in bytes, least recently used packings are evicted (None -> no limit)
+        - link (str): How files are placed in run directories -> 'hard', 'symlink' or 'copy'
+                      (hard links fall back to symlinks across file systems)
+    """
+    def __init__(self, cache_dir=None, max_size=None, link='hard'):
+        self.cache_dir = os.path.join(CACHE_DIR, 'packmol') if cache_dir is None else cache_dir
+        self.store_dir = os.path.join(self.cache_dir, 'store')
+        self.packing_dir = os.path.join(self.cache_dir, 'packings')
+        self.max_size = max_size
+        self.link = link
+        self._hashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+        os.makedirs(self.packing_dir, exist_ok=True)
+
+    def file_hash(self, file_name):
+        """ sha1 of file contents (memoized by path, size and modification time) """
+        stat = os.stat(file_name)
+        memo_key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._hashes:
+            sha = hashlib.sha1()
+            with open(file_name, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(block)
+            self._hashes[memo_key] = sha.hexdigest()
+        return self._hashes[memo_key]
+
+    def key(self, packmol, source_dir):
+        """
+        Cache key of a packing -> hash of the packmol input and the contents of the executable and structure files.
+        """
+        sha = hashlib.sha1(packmol.input_text().encode())
+        for file_name in [packmol.options['command_line']] + [s['structure'] for s in packmol.structures]:
+            sha.update(('%s:%s\n' % (file_name, self.file_hash(os.path.join(source_dir, file_name)))).encode())
+        return sha.hexdigest()
+
+    def store(self, file_name):
+        """
+        Add a file to the content-addressed store (files are made read-only so links can not modify the store).
+
+        Returns:
+            - str: file hash
+        """
+        file_hash = self.file_hash(file_name)
+        path = os.path.join(self.store_dir, file_hash)
+        if not os.path.exists(path):
+            fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, prefix='.tmp-')
+            os.close(fd)
+            shutil.copyfile(file_name, tmp_path)
+            os.chmod(tmp_path, 0o555 if os.access(file_name, os.X_OK) else 0o444)
+            os.replace(tmp_path, path)
+        return file_hash
+
+    def _place(self, file_hash, destination):
+        """ Link (or copy) a stored file to destination """
+        source = os.path.join(self.store_dir, file_hash)
+        if os.path.lexists(destination):
+            os.remove(destination)
+        if self.link == 'hard':
+            try:
+                os.link(source, destination)
+                return
+            except OSError:
+                pass
+        if self.link in ['hard', 'symlink']:
+            os.symlink(os.path.abspath(source), destination)
+        else:
+            shutil.copyfile(source, destination)
+            shutil.copymode(source, destination)
+
+    def link_input(self, file_name, destination):
+        """ Add an input file to the store and link it to destination """
+        self._place(self.store(file_name), destination)
+
+    def get(self, key, run_dir):
+        """
+        Restore a cached packing into the run directory.
+
+        Returns:
+            - dict: packmol result (see Packmol.run) with cached=True, None if the packing is not cached
+        """
+        entry_file = os.path.join(self.packing_dir, '%s.json' % key)
+        try:
+            with open(entry_file, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.makedirs(run_dir, exist_ok=True)
+        try:
+            for file_name, file_hash in entry['files'].items():
+                self._place(file_hash, os.path.join(run_dir, file_name))
+        except OSError:
+            # Stored file evicted by another process
+            return None
+        os.utime(entry_file)
+        result = entry['result']
+        result.update(cached=True, duration=0.0)
+        return result
+
+    def put(self, key, run_dir, file_names, result):
+        """
+        Save the files of a finished packing to the store and record the packing.
+
+        Args:
+            - key (str): Cache key (see key)
+            - run_dir (str): Run directory
+            - file_names (list): Files to save from the run directory (packed output, input, log...)
+            - result (dict): Packmol result
+        """
+        files = {f: self.store(os.path.join(run_dir, f)) for f in file_names if os.path.exists(os.path.join(run_dir, f))}
+        entry = dict(files=files, created=time.time(),
+                     result={k: v for k, v in result.items() if k in ['status', 'returncode', 'output']})
+        fd, tmp_path = tempfile.mkstemp(dir=self.packing_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, os.path.join(self.packing_dir, '%s.json' % key))
+        if self.max_size is not None:
+            self.evict()
+
+    def size(self):
+        """ Total size of stored files in bytes """
+        return sum(e.stat().st_size for e in os.scandir(self.store_dir) if e.is_file())
+
+    def evict(self, max_size=None):
+        """
+        Remove least recently used packings until the store is smaller than max_size, then remove stored files
+        that no remaining packing refers to. Run directories keep their hard linked files.
+
+        Returns:
+            - int: Number of evicted packings
+        """
+        max_size = self.max_size if max_size is None else max_size
+        with self._lock:
+            if max_size is None or self.size() <= max_size:
+                return 0
+            entries = sorted((e for e in os.scandir(self.packing_dir) if e.name.endswith('.json')),
+                             key=lambda e: e.stat().st_mtime)
+            packings = {}
+            for e in entries:
+                try:
+                    with open(e.path, 'r') as f:
+                        packings[e.path] = json.load(f)['files']
+                except (OSError, ValueError):
+                    continue
+            sizes = {e.name: e.stat().st_size for e in os.scandir(self.store_dir) if e.is_file()}
+            references = {}
+            for files in packings.values():
+                for file_hash in set(files.values()):
+                    references[file_hash] = references.get(file_hash, 0) + 1
+            # Stored files not used by any packing or run directory (inputs of failed runs) go first
+            total = sum(sizes.values())
+            for file_hash in [h for h in sizes if h not in references and not h.startswith('.tmp-')]:
+                path = os.path.join(self.store_dir, file_hash)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    total -= sizes[file_hash]
+            n_evicted = 0
+            for path, files in packings.items():
+                if total <= max_size:
+                    break
+                os.remove(path)
+                n_evicted += 1
+                for file_hash in set(files.values()):
+                    references[file_hash] -= 1
+                    if references[file_hash] == 0 and file_hash in sizes:
+                        os.remove(os.path.join(self.store_dir, file_hash))
+                        total -= sizes[file_hash]
+            return n_evicted
+
+    def clear(self):
+        """ Remove all cached packings and stored files """
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.store_dir, exist_ok=True)
+        os.makedirs(self.packing_dir, exist_ok=True)
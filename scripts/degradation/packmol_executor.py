@@ -0,0 +1,164 @@
+"""
+Run many packmol jobs at once on a bounded worker pool.
+
+Every job gets its own run directory and random seed. Failed jobs are retried with a new seed, and packings that
+cannot satisfy the tolerance ('stopped') are also retried with a relaxed tolerance. With monitoring enabled, runs
+whose objective function stops improving are killed and rescheduled with a new seed ('stalled').
+
+ >>> executor = PackmolExecutor(workers=8, timeout=3600, retries=2, seed=42)
+ >>> for d_l in [0.1, 0.3, 0.5]:
+ ...     executor.submit(make_packmol(d_l), 'pmol-L%i' % (d_l * 100), 'packmol', name='L%i' % (d_l * 100))
+ >>> results = executor.results()
+"""
+import os
+import copy
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from packmol import Packmol
+from packmol_monitor import PackmolMonitor
+
+
+class PackmolExecutor:
+    """
+    Concurrent packmol job executor (packmol runs in subprocesses so a thread pool is used).
+
+    Args:
+        - workers (int): Maximum number of packmol processes running at the same time
+        - timeout (float): Time limit for a single packmol run in seconds (None -> no limit)
+        - retries (int): Number of retries for failed, stopped and timed out runs
+        - relax_tolerance (float): Tolerance multiplier for retries of stopped runs
+        - min_tolerance (float): Tolerance is not relaxed below this value
+        - seed (int): Random seed used to generate packmol seeds (reproducible job seeds)
+        - cache (PackmolCache): Restore identical packings from the cache (see packmol_cache)
+        - monitor (dict): PackmolMonitor options (patience, stall_time, min_improvement) to monitor runs (None -> off)
+        - callbacks (list): Functions called with (name, point) for every GENCAN loop of every job (enables monitor)
+    """
+    def __init__(self, workers=4, timeout=None, retries=2, relax_tolerance=0.9, min_tolerance=1.5, seed=None,
+                 cache=None, monitor=None, callbacks=[]):
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.relax_tolerance = relax_tolerance
+        self.min_tolerance = min_tolerance
+        self.seeds = np.random.SeedSequence(seed)
+        self.cache = cache
+        self.monitor = dict() if monitor is None and len(callbacks) > 0 else monitor
+        self.callbacks = list(callbacks) + [self._update_progress]
+        self.progress = {}
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, packmol, run_dir, source_dir, name=None):
+        """
+        Submit a packmol job. Options and structures are copied, so the Packmol object can be modified afterwards.
+
+        Args:
+            - packmol (Packmol): Packmol object with options and structures
+            - run_dir (str): Run directory
+            - source_dir (str): Directory with the packmol executable and structure files
+            - name (str): Job name (default: run directory name)
+
+        Returns:
+            - Future: job future (result dict, see `_run_job`)
+        """
+        job = dict(name=os.path.basename(os.path.normpath(run_dir)) if name is None else name,
+                   options=copy.deepcopy(packmol.options), structures=copy.deepcopy(packmol.structures),
+                   run_dir=run_dir, source_dir=source_dir)
+        with self._lock:
+            job['rng'] = np.random.default_rng(self.seeds.spawn(1)[0])
+            job['future'] = self._executor.submit(self._run_job, job)
+            self.jobs.append(job)
+        return job['future']
+
+    def _update_progress(self, name, point):
+        """ Keep the last GENCAN loop of every job (self.progress) """
+        self.progress[name] = point
+
+    def _attempt(self, job, seed, tolerance):
+        """ Single packmol run of a job """
+        packmol = Packmol(options=job['options'], structures=job['structures'])
+        packmol.set_options(dict(seed=seed, tolerance=tolerance))
+        monitor = None
+        if self.monitor is not None:
+            monitor = PackmolMonitor(name=job['name'], callbacks=self.callbacks, **self.monitor)
+        result = packmol.run(job['run_dir'], job['source_dir'], timeout=self.timeout, cache=self.cache, monitor=monitor)
+        result.update(seed=seed, tolerance=tolerance, progress=None if monitor is None else monitor.summary())
+        return result
+
+    def _run_job(self, job):
+        """
+        Run a packmol job with retries.
+
+        Returns:
+            - dict: name, run_dir, status, seed, tolerance, packed (packed structure file), duration, cached and
+                    attempts (list of status, returncode, seed, tolerance, duration and progress for each run,
+                    progress is the PackmolMonitor summary if monitoring is enabled)
+        """
+        seed = job['options']['seed']
+        tolerance = job['options']['tolerance']
+        attempts = []
+        for attempt in range(self.retries + 1):
+            if seed is None or attempt > 0:
+                seed = int(job['rng'].integers(1, 2 ** 31 - 1))
+            if attempt > 0 and attempts[-1]['status'] == 'stopped':
+                tolerance = max(tolerance * self.relax_tolerance, self.min_tolerance)
+            result = self._attempt(job, seed, tolerance)
+            attempts.append({k: result[k] for k in ['status', 'returncode', 'seed', 'tolerance', 'duration', 'progress']})
+            if result['status'] in ['success', 'error']:
+                # Input errors are not fixed by a new seed or tolerance
+                break
+        return dict(name=job['name'], run_dir=job['run_dir'], status=result['status'], seed=seed, tolerance=tolerance,
+                    packed=os.path.join(job['run_dir'], job['options']['output']),
+                    duration=sum(a['duration'] for a in attempts), cached=result['cached'], attempts=attempts,
+                    output=result['output'])
+
+    def results(self, verbose=True):
+        """
+        Wait for all submitted jobs to finish.
+
+        Returns:
+            - list: job results in submission order
+        """
+        with self._lock:
+            jobs = list(self.jobs)
+        results = []
+        for i, job in enumerate(jobs, start=1):
+            results.append(job['future'].result())
+            if verbose:
+                print('\rPacking... %3i / %3i' % (i, len(jobs)), end='')
+        if verbose:
+            n_success = len([r for r in results if r['status'] == 'success'])
+            print('\nDone! %i / %i packings succeeded' % (n_success, len(results)))
+            for r in results:
+                if r['status'] != 'success':
+                    print('%s -> %s after %i attempts (%s)' % (r['name'], r['status'], len(r['attempts']), r['run_dir']))
+        return results
+
+    def shutdown(self, wait=True):
+        """ Shutdown the worker pool """
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+def run_packmol_jobs(jobs, workers=4, timeout=None, retries=2, seed=None, **kwargs):
+    """
+    Run packmol jobs concurrently and wait for the results.
+
+    Args:
+        - jobs (list): (packmol, run_dir, source_dir) tuples
+        - workers, timeout, retries, seed: see PackmolExecutor
+
+    Returns:
+        - list: job results in the same order as jobs
+    """
+    with PackmolExecutor(workers=workers, timeout=timeout, retries=retries, seed=seed, **kwargs) as executor:
+        for packmol, run_dir, source_dir in jobs:
+            executor.submit(packmol, run_dir, source_dir)
+        return executor.results()
@@ -0,0 +1,116 @@
+"""
+Live progress monitor for packmol runs.
+
+Packmol standard output is parsed while it is produced into a time series of GENCAN loops (objective function value
+and maximum distance violation). A run is stalled when the objective function has not improved for a number of
+loops or seconds, and stalled runs are killed so they can be rescheduled (see PackmolExecutor).
+
+ >>> monitor = PackmolMonitor(patience=30, stall_time=600, callbacks=[lambda name, point: print(name, point['f'])])
+ >>> result = pmol.run('pmol-temp', 'packmol', monitor=monitor)
+ >>> monitor.summary()
+"""
+import re
+import time
+import numpy as np
+
+
+FLOAT = r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[EeDd][-+]?\d+)?)'
+PATTERNS = dict(loop=re.compile(r'Starting GENCAN loop:\s*(\d+)'),
+                f=re.compile(r'Function value from last GENCAN loop:\s*f\s*=\s*' + FLOAT),
+                violation=re.compile(r'Maximum violation of target distance:\s*' + FLOAT),
+                phase=re.compile(r'Packing molecules of type:\s*(\d+)|(Packing all molecules together)'))
+
+
+def _float(value):
+    """ Fortran float ('.1234D+02') to float """
+    return float(value.replace('D', 'E').replace('d', 'e'))
+
+
+class PackmolMonitor:
+    """
+    Parse packmol output lines into a time series and detect stalled runs.
+
+    Args:
+        - name (str): Run name passed to callbacks
+        - patience (int): Number of GENCAN loops without improvement before the run is stalled (None -> no limit)
+        - stall_time (float): Seconds without improvement before the run is stalled (None -> no limit)
+        - min_improvement (float): Minimum relative decrease of the objective function counted as improvement
+        - callbacks (list): Functions called with (name, point) for every completed GENCAN loop
+    """
+    def __init__(self, name='packmol', patience=50, stall_time=None, min_improvement=0.01, callbacks=[]):
+        self.name = name
+        self.patience = patience
+        self.stall_time = stall_time
+        self.min_improvement = min_improvement
+        self.callbacks = list(callbacks)
+        self.reset()
+
+    def reset(self):
+        """ Clear progress (called at the start of every run) """
+        self.start = time.time()
+        self.series = []
+        self.phase = 0
+        self.loop = 0
+        self._best = None
+        self._best_loop = 0
+        self._best_time = self.start
+
+    def feed(self, line):
+        """
+        Parse a line of packmol output.
+
+        Returns:
+            - dict: new time series point (time, phase, loop, f, violation) or None
+        """
+        match = PATTERNS['loop'].search(line)
+        if match is not None:
+            self.loop = int(match.group(1))
+            return None
+        match = PATTERNS['phase'].search(line)
+        if match is not None:
+            # Objective function restarts for every molecule type and for the final packing of all molecules
+            self.phase += 1
+            self._best, self._best_loop, self._best_time = None, len(self.series), time.time()
+            return None
+        match = PATTERNS['f'].search(line)
+        if match is not None:
+            point = dict(time=time.time() - self.start, phase=self.phase, loop=self.loop, f=_float(match.group(1)),
+                         violation=None)
+            self.series.append(point)
+            if self._best is None or point['f'] < self._best * (1 - self.min_improvement):
+                self._best, self._best_loop, self._best_time = point['f'], len(self.series), time.time()
+            return None
+        match = PATTERNS['violation'].search(line)
+        if match is not None and len(self.series) > 0 and self.series[-1]['violation'] is None:
+            point = self.series[-1]
+            point['violation'] = _float(match.group(1))
+            for callback in self.callbacks:
+                callback(self.name, point)
+            return point
+        return None
+
+    def stalled(self):
+        """ Check if the objective function stopped improving within the loop or time budget """
+        if self._best is None or self._best == 0:
+            return False
+        if self.patience is not None and len(self.series) - self._best_loop >= self.patience:
+            return True
+        if self.stall_time is not None and time.time() - self._best_time >= self.stall_time:
+            return True
+        return False
+
+    def summary(self):
+        """
+        Convergence metrics of the run.
+
+        Returns:
+            - dict: n_loops, duration, best_f, last_f, last_violation, rate (decrease of log10(f) per loop in the
+                    last phase) and stalled
+        """
+        f = np.array([p['f'] for p in self.series if p['phase'] == self.phase], dtype=float)
+        rate = None
+        if len(f) > 1 and np.all(f > 0):
+            rate = float(-np.polyfit(np.arange(len(f)), np.log10(f), 1)[0])
+        last = self.series[-1] if len(self.series) > 0 else dict(f=None, violation=None)
+        return dict(n_loops=len(self.series), duration=time.time() - self.start, best_f=self._best,
+                    last_f=last['f'], last_violation=last['violation'], rate=rate, stalled=self.stalled())
@@ -0,0 +1,128 @@
+"""
+Binary cache for MOF structures (elements, coordinates, cell, fragment indices...).
+
+Every structure is saved as a directory of .npy files that are memory mapped when loaded, so no text parsing
+is needed. Cache entries are keyed by a hash of the source files and the parameters used to build the
+structure; when a source file or a parameter changes a new entry is built and the stale one is removed.
+
+ >>> structure = cached_structure('packed-IRMOF1-888', ['irmof1.yaml'], {'packing': [8, 8, 8]}, build_function)
+"""
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+# Keys holding list of atom index lists (saved flat with offsets)
+FRAGMENT_KEYS = ['nodes', 'linkers']
+
+
+def structure_hash(sources=[], params={}):
+    """
+    Calculate cache key for given source files and build parameters.
+
+    Args:
+        - sources (list): Source file paths (contents are hashed)
+        - params (dict): Build parameters (must be json serializable, numpy arrays are hashed by content)
+    """
+    sha = hashlib.sha1()
+    for source in sources:
+        with open(source, 'rb') as f:
+            sha.update(f.read())
+    for key in sorted(params):
+        value = params[key]
+        if isinstance(value, np.ndarray):
+            sha.update(key.encode() + value.dtype.str.encode() + str(value.shape).encode() + value.tobytes())
+        else:
+            sha.update(json.dumps([key, value], sort_keys=True).encode())
+    return sha.hexdigest()[:16]
+
+
+def save_structure(path, structure):
+    """
+    Save structure dict as a directory of .npy files (written to a temporary directory and moved in place).
+    """
+    tmp_path = '%s.tmp-%i' % (path, os.getpid())
+    os.makedirs(tmp_path, exist_ok=True)
+    meta = dict(fragments=[], none=[])
+    for key, value in structure.items():
+        if value is None:
+            meta['none'].append(key)
+        elif key in FRAGMENT_KEYS:
+            meta['fragments'].append(key)
+            lengths = np.array([len(f) for f in value], dtype=np.int64)
+            flat = np.fromiter((i for f in value for i in f), dtype=np.int64, count=lengths.sum())
+            np.save(os.path.join(tmp_path, '%s.npy' % key), flat)
+            np.save(os.path.join(tmp_path, '%s.offsets.npy' % key), np.concatenate([[0], np.cumsum(lengths)]))
+        else:
+            np.save(os.path.join(tmp_path, '%s.npy' % key), np.asarray(value))
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another process saved the same entry first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_structure(path, as_list=False):
+    """
+    Load structure saved with save_structure. Arrays are memory mapped (read-only).
+
+    Args:
+        - path (str): Cache entry directory
+        - as_list (bool): Convert arrays to (nested) lists
+
+    Returns:
+        - dict: structure, fragment keys are always list of atom index lists
+    """
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    structure = {key: None for key in meta['none']}
+    for file_name in os.listdir(path):
+        key, ext = os.path.splitext(file_name)
+        if ext != '.npy' or key.endswith('.offsets'):
+            continue
+        array = np.load(os.path.join(path, file_name), mmap_mode='r')
+        if key in meta['fragments']:
+            offsets = np.load(os.path.join(path, '%s.offsets.npy' % key))
+            structure[key] = [f.tolist() for f in np.split(np.asarray(array), offsets[1:-1])]
+        else:
+            structure[key] = array.tolist() if as_list else array
+    return structure
+
+
+def cached_structure(name, sources, params, builder, as_list=False, cache_dir=None):
+    """
+    Load structure from the cache or build and save it.
+
+    Args:
+        - name (str): Structure name (entries with the same name and a different key are stale and removed)
+        - sources (list): Source file paths the structure is built from
+        - params (dict): Build parameters
+        - builder (function): Function returning the structure dict (called without arguments on cache miss)
+        - as_list (bool): Return (nested) lists instead of memory mapped arrays
+        - cache_dir (str): Cache directory (default: CACHE_DIR)
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    key = structure_hash(sources, params)
+    path = os.path.join(cache_dir, '%s-%s' % (name, key))
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return load_structure(path, as_list=as_list)
+    structure = builder()
+    os.makedirs(cache_dir, exist_ok=True)
+    for entry in os.listdir(cache_dir):
+        if entry.rsplit('-', 1)[0] == name and entry != os.path.basename(path) and '.tmp-' not in entry:
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+    save_structure(path, structure)
+    return load_structure(path, as_list=as_list)
+
+
+def clear_cache(cache_dir=None):
+    """ Remove all cached structures """
+    shutil.rmtree(CACHE_DIR if cache_dir is None else cache_dir, ignore_errors=True)
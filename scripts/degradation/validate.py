@@ -0,0 +1,210 @@
+"""
+Validate packed and degraded structures before submitting simulations:
+    - close contacts: atoms of different molecules closer than the tolerance (or any atoms closer than min_distance)
+    - overbonded atoms: atoms bonded to more non-metal atoms than their valence (overlapping molecules that are
+      merged into one molecule by bond perception when molecule counts are not given)
+    - orphaned atoms: atoms without any bond (except monatomic ions)
+    - partial fragments: framework nodes/linkers that do not match a whole node or linker of the reference MOF
+
+ >>> python validate.py pmol-temp/packed.xyz --tolerance 2.0 --counts 1x3392 3000x3 --reference irmof1
+ >>> python validate.py IRMOF1-222-L50-N50.xyz --cell 51.664 51.664 51.664 90 90 90 --reference irmof1
+
+Exits with a nonzero status if any structure fails, so it can be used as a pre-submit gate.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from collections import Counter
+from neighbors import neighbor_pairs
+from decomposition import read_structure, perceive_bonds, decompose, decompose_mof, _components, METALS
+from file_io import read_xyz
+
+
+# Atoms that are allowed to have no bonds
+IONS = {'Li', 'Na', 'K', 'Rb', 'Cs', 'Mg', 'Ca', 'Sr', 'Ba', 'F', 'Cl', 'Br', 'I', 'He', 'Ne', 'Ar', 'Kr', 'Xe'}
+# Maximum number of bonds to non-metal atoms (bonds to metals are not counted, e.g. oxide or carboxylate oxygens)
+VALENCES = dict(H=1, F=1, Cl=1, Br=1, I=1, O=2, B=4, C=4, N=4, Si=4, Ge=4, P=5, As=5, S=6, Se=6)
+
+
+def molecule_ids(n_atoms, counts):
+    """
+    Molecule index of every atom for structures written molecule by molecule (packmol output).
+
+    Args:
+        - n_atoms (int): Number of atoms
+        - counts (list): (number of molecules, atoms per molecule) for each structure -> [(1, 3392), (3000, 3)]
+
+    Returns:
+        - ndarray: (n_atoms,) molecule indices
+    """
+    sizes = np.concatenate([np.full(int(n), int(size)) for n, size in counts]) if len(counts) > 0 else np.zeros(0)
+    if sizes.sum() != n_atoms:
+        raise ValueError('Molecule counts add up to %i atoms, structure has %i atoms' % (sizes.sum(), n_atoms))
+    return np.repeat(np.arange(len(sizes)), sizes.astype(int))
+
+
+def structure_counts(structures, source_dir):
+    """
+    Molecule counts for Packmol / GridPacker structure dicts -> [(number, atoms per molecule), ...]
+    """
+    return [(int(s['number']), len(read_xyz(os.path.join(source_dir, s['structure']))[0]['atoms']))
+            for s in structures]
+
+
+def close_contacts(coordinates, molecules, cell=None, tolerance=2.0, min_distance=0.7):
+    """
+    Find atom pairs of different molecules closer than the tolerance and any atom pairs closer than min_distance.
+
+    Args:
+        - coordinates (list): 2D list (or (N, 3) array) of cartesian coordinates
+        - molecules (ndarray): (N,) molecule index of every atom
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma] (None for non-periodic structures)
+        - tolerance (float): Minimum distance between atoms of different molecules
+        - min_distance (float): Minimum distance between any atoms (shorter than any bond)
+
+    Returns:
+        - tuple: atom indices i, j and distances sorted by distance
+    """
+    i, j, distances, _ = neighbor_pairs(coordinates, cell=cell, cutoff=max(tolerance, min_distance))
+    different = ((molecules[i] != molecules[j]) & (distances < tolerance)) | (distances < min_distance)
+    i, j, distances = i[different], j[different], distances[different]
+    order = np.argsort(distances, kind='stable')
+    return i[order], j[order], distances[order]
+
+
+def fragment_formulas(atoms, fragments):
+    """ Chemical formula (sorted element counts) of every fragment """
+    atoms = np.asarray(atoms)
+    return [tuple(sorted(Counter(atoms[f].tolist()).items())) for f in fragments]
+
+
+def _formula(formula):
+    return ''.join('%s%i' % (element, count) for element, count in formula)
+
+
+def overbonded_atoms(atoms, bond_i, bond_j):
+    """
+    Atoms bonded to more non-metal atoms than their valence (see VALENCES, other elements are not checked).
+    Molecules closer than bond lengths are perceived as bonded, so their atoms exceed the valence.
+    """
+    atoms = np.asarray(atoms)
+    metal = np.isin(atoms, list(METALS))
+    covalent = ~metal[bond_i] & ~metal[bond_j]
+    n_bonds = np.bincount(np.concatenate([bond_i[covalent], bond_j[covalent]]), minlength=len(atoms))
+    valences = np.array([VALENCES.get(a, np.iinfo(int).max) for a in atoms.tolist()])
+    return np.flatnonzero(n_bonds > valences)
+
+
+def validate(atoms, coordinates, cell=None, tolerance=2.0, counts=None, reference=None, framework=None,
+             bond_tolerance=0.45, min_distance=0.7, n_report=10):
+    """
+    Validate a packed or degraded structure.
+
+    Args:
+        - atoms (list): list of elements -> ['O', 'C', 'H', ...]
+        - coordinates (list): 2D list (or (N, 3) array) of cartesian coordinates
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma] (None for non-periodic structures)
+        - tolerance (float): Minimum distance between atoms of different molecules
+        - counts (list): (number of molecules, atoms per molecule) for each structure (default: bonded components,
+                         overlapping molecules are found as overbonded atoms)
+        - reference (dict): MOF with 'atoms', 'nodes' and 'linkers' (irmof1, decompose_mof) to find partial fragments
+        - framework (int): Number of framework atoms at the start of the structure (default: first molecule if counts
+                           are given, otherwise all atoms)
+        - bond_tolerance (float): Bond length tolerance in Angstrom (see perceive_bonds)
+        - min_distance (float): Minimum distance between any atoms
+        - n_report (int): Number of closest contacts listed in the report
+
+    Returns:
+        - dict: passed, n_atoms, n_contacts, min_distance, contacts (closest pairs), orphans and overbonded
+                (atom indices), partial (list of partial fragment atom index lists with their formulas) and duration
+    """
+    start = time.time()
+    atoms = np.asarray(atoms)
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 3)
+    n_atoms = len(atoms)
+    bond_i, bond_j = perceive_bonds(atoms.tolist(), coordinates, cell=cell, tolerance=bond_tolerance)
+
+    if counts is not None:
+        molecules = molecule_ids(n_atoms, counts)
+    else:
+        molecules = np.zeros(n_atoms, dtype=int)
+        for index, component in enumerate(_components(n_atoms, bond_i, bond_j, np.ones(n_atoms, dtype=bool))):
+            molecules[component] = index
+    i, j, distances = close_contacts(coordinates, molecules, cell=cell, tolerance=tolerance, min_distance=min_distance)
+    overbonded = overbonded_atoms(atoms, bond_i, bond_j)
+
+    n_bonds = np.bincount(np.concatenate([bond_i, bond_j]), minlength=n_atoms)
+    orphans = np.flatnonzero((n_bonds == 0) & ~np.isin(atoms, list(IONS)))
+
+    partial = []
+    if reference is not None:
+        if framework is None:
+            framework = int(counts[0][1]) if counts is not None else n_atoms
+        known = set(fragment_formulas(reference['atoms'], reference['nodes'] + reference['linkers']))
+        fragments = decompose(atoms[:framework].tolist(), coordinates[:framework], cell=cell, tolerance=bond_tolerance)
+        fragments = fragments['nodes'] + fragments['linkers']
+        for fragment, formula in zip(fragments, fragment_formulas(atoms[:framework], fragments)):
+            # Single orphaned atoms are reported separately
+            if formula not in known and len(fragment) > 1:
+                partial.append(dict(atoms=fragment, formula=_formula(formula)))
+
+    return dict(passed=len(i) == 0 and len(orphans) == 0 and len(overbonded) == 0 and len(partial) == 0,
+                n_atoms=n_atoms,
+                n_contacts=len(i), min_distance=float(distances[0]) if len(i) > 0 else None,
+                contacts=[(int(a), int(b), float(d)) for a, b, d in zip(i[:n_report], j[:n_report], distances[:n_report])],
+                orphans=orphans.tolist(), overbonded=overbonded.tolist(), partial=partial, duration=time.time() - start)
+
+
+def print_report(file_name, report, tolerance):
+    """ Print validation report """
+    print('%s -> %s (%i atoms, %.2f s)' % (file_name, 'PASSED' if report['passed'] else 'FAILED',
+                                            report['n_atoms'], report['duration']))
+    if report['n_contacts'] > 0:
+        print('  %i close contacts below %.2f A (closest %.3f A)'
+              % (report['n_contacts'], tolerance, report['min_distance']))
+        for i, j, d in report['contacts']:
+            print('    %7i %7i %.3f' % (i, j, d))
+    if len(report['orphans']) > 0:
+        print('  %i orphaned atoms: %s' % (len(report['orphans']), ' '.join(str(i) for i in report['orphans'][:20])))
+    if len(report['overbonded']) > 0:
+        print('  %i overbonded atoms (overlapping molecules): %s' % (
+            len(report['overbonded']), ' '.join(str(i) for i in report['overbonded'][:20])))
+    if len(report['partial']) > 0:
+        formulas = Counter(p['formula'] for p in report['partial'])
+        print('  %i partial fragments: %s' % (len(report['partial']),
+                                              ', '.join('%s x%i' % (f, n) for f, n in formulas.items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check packed / degraded structures before running simulations",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('structures', nargs='+', type=str, help='Structure files (xyz or cif)')
+    parser.add_argument('--tolerance', '-t', type=float, default=2.0, metavar='',
+                        help="Minimum distance between atoms of different molecules (default: 2.0)")
+    parser.add_argument('--cell', '-c', nargs=6, type=float, default=None, metavar='',
+                        help="Periodic cell for xyz files -> a b c alpha beta gamma (default: non-periodic)")
+    parser.add_argument('--min-distance', type=float, default=0.7, metavar='',
+                        help="Minimum distance between any atoms (default: 0.7)")
+    parser.add_argument('--counts', '-n', nargs='+', type=str, default=None, metavar='',
+                        help="Molecule counts in file order -> 1x3392 3000x3 (default: bonded components)")
+    parser.add_argument('--reference', '-r', type=str, default=None, metavar='',
+                        help="Reference MOF (irmof1 or a cif file) to find partial nodes/linkers (default: off)")
+    args = parser.parse_args()
+
+    reference = None
+    if args.reference == 'irmof1':
+        from irmof1 import irmof1 as reference
+    elif args.reference is not None:
+        reference = decompose_mof(args.reference)
+    counts = None if args.counts is None else [[int(i) for i in c.split('x')] for c in args.counts]
+
+    failed = 0
+    for structure_file in args.structures:
+        structure = read_structure(structure_file, cell=args.cell)
+        report = validate(structure['atoms'], structure['coordinates'], cell=structure['cell'],
+                          tolerance=args.tolerance, counts=counts, reference=reference, min_distance=args.min_distance)
+        print_report(structure_file, report, args.tolerance)
+        failed += not report['passed']
+    sys.exit(1 if failed > 0 else 0)
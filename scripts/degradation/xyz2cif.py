@@ -1,79 +1,198 @@
 """
-Convert xyz file to cif file with a defined cell:
- >>> python xyz2cif.py mymolecule.xyz
+Convert xyz files to cif files with a defined cell:
+ >>> python xyz2cif.py mymolecule.xyz --cell 25.832 25.832 25.832 90 90 90
+ >>> python xyz2cif.py degraded/ packed/*.xyz --manifest cells.yaml --output-dir cif --workers 8
+
+The cell of each xyz file is taken from (in order of priority):
+    1. --cell argument (same cell for all files)
+    2. Manifest file (yaml/json) mapping xyz file names (or names without extension) to cells
+    3. Sidecar cell file next to the xyz file (mymolecule.cell) with 6 cell dimensions (or 9 lattice vector components)
+    4. Comment line of the xyz file with 6 cell dimensions or an extended xyz 'Lattice="..."' entry
+Outputs that are newer than their xyz (and cell) source are skipped unless --force is used.
 """
 import os
+import re
 import sys
 import glob
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from file_io import iter_xyz, write_cif
+from lattice import cell_parameters
+
+
+def _parse_cell(values):
+    """ Cell dimensions (6 values) or lattice vectors (9 values) -> [a, b, c, alpha, beta, gamma] or (3, 3) list """
+    values = [float(i) for i in values]
+    if len(values) == 6:
+        return values
+    elif len(values) == 9:
+        return np.reshape(values, (3, 3)).tolist()
+    raise ValueError('Cell needs 6 dimensions or 9 lattice vector components, got %i values' % len(values))
+
+
+def read_manifest(manifest_file):
+    """ Read manifest (yaml or json) mapping xyz file names to cells -> {'IRMOF1-222.xyz': [a, b, c, alpha, beta, gamma]} """
+    with open(manifest_file, 'r') as f:
+        if os.path.splitext(manifest_file)[1].lower() == '.json':
+            manifest = json.load(f)
+        else:
+            import yaml
+            manifest = yaml.safe_load(f)
+    return {str(name): _parse_cell(cell) for name, cell in manifest.items()}
+
+
+def read_cell(xyz_file, manifest={}):
+    """
+    Find the cell of an xyz file from the manifest, a sidecar cell file or the xyz comment line.
+
+    Args:
+        - xyz_file (str): Path to the xyz file
+        - manifest (dict): Cells by xyz file name or name without extension (see read_manifest)
+
+    Returns:
+        - tuple: cell (6 dimensions or (3, 3) lattice vectors) and cell source (file path or None)
+    """
+    name = os.path.basename(xyz_file)
+    for key in [name, os.path.splitext(name)[0]]:
+        if key in manifest:
+            return manifest[key], None
+    sidecar = '%s.cell' % os.path.splitext(xyz_file)[0]
+    if os.path.exists(sidecar):
+        with open(sidecar, 'r') as f:
+            return _parse_cell(f.read().split()), sidecar
+    with open(xyz_file, 'r') as f:
+        f.readline()
+        header = f.readline()
+    lattice = re.search(r'Lattice="([^"]*)"', header)
+    if lattice is not None:
+        return _parse_cell(lattice.group(1).split()), None
+    try:
+        return _parse_cell(header.split()), None
+    except ValueError:
+        raise ValueError('No cell found for %s (use --cell, a manifest, a .cell file or the xyz comment line)' % xyz_file)
+
+
+def convert_xyz(xyz_file, cif_file, cell):
+    """
+    Convert (the first frame of) an xyz file to a cif file with fractional coordinates.
 
+    Args:
+        - xyz_file (str): Path to the xyz file
+        - cif_file (str): Path to the cif file
+        - cell (list): Cell dimensions -> [a, b, c, alpha, beta, gamma] or (3, 3) lattice vectors
+
+    Returns:
+        - dict: xyz, cif and n_atoms
+    """
+    molecule = next(iter_xyz(xyz_file))
+    if len(cell) == 3:
+        # Lattice vectors can have any orientation -> use them directly for the fractional conversion
+        coordinates = molecule['coordinates'] @ np.linalg.inv(np.array(cell, dtype=float))
+        cell, fractional = cell_parameters(cell), False
+    else:
+        coordinates, fractional = molecule['coordinates'], True
+    header = os.path.splitext(os.path.basename(cif_file))[0]
+    write_cif(cif_file, molecule['atoms'], coordinates, header=header, cell=cell, fractional=fractional)
+    return dict(xyz=xyz_file, cif=cif_file, n_atoms=len(molecule['atoms']))
+
+
+def find_xyz_files(paths):
+    """ Expand directories (all .xyz files) and glob patterns into a sorted list of xyz files """
+    xyz_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            xyz_files += glob.glob(os.path.join(path, '*.xyz'))
+        else:
+            xyz_files += glob.glob(path) if glob.has_magic(path) else [path]
+    return sorted(set(os.path.abspath(i) for i in xyz_files))
+
+
+def up_to_date(cif_file, sources):
+    """ Check if cif file exists and is newer than all of its sources """
+    if not os.path.exists(cif_file):
+        return False
+    cif_mtime = os.path.getmtime(cif_file)
+    return all(os.path.getmtime(s) <= cif_mtime for s in sources if s is not None)
 
-def read_xyz(file_name):
-    """ Read single or multiple xyz formatted molecules
+
+def batch_convert(paths, output_dir=None, cell=None, manifest=None, workers=None, force=False):
+    """
+    Convert xyz files to cif files in a process pool.
 
     Args:
-        - file_name (str): Path to the xyz file
+        - paths (list): xyz files, directories or glob patterns
+        - output_dir (str): Directory for the cif files (default: next to the xyz files)
+        - cell (list): Cell dimensions used for all files (default: read for each file, see read_cell)
+        - manifest (str): Manifest file with the cells of the xyz files
+        - workers (int): Number of worker processes (default: number of cpus)
+        - force (bool): Convert files even if the cif file is up to date
 
     Returns:
-        - list: list of dictionaries with 'atoms' and 'coordinates' keys for each molecule in xyz file
-     """
-    with open(file_name, 'r') as f:
-        xyz_lines = f.readlines()
-    mol_start = []
-    mol_idx = 0
-    for line_idx, line in enumerate(xyz_lines):
-        if len(line.split()) == 1 and line.split()[0].isdigit() and line_idx != mol_idx + 1:
-            mol_idx = line_idx
-            mol_start.append(mol_idx)
-    mol_start.append(len(xyz_lines))
-    molecules = []
-    for i in range(len(mol_start) - 1):
-        mol_lines = xyz_lines[mol_start[i] + 2:mol_start[i + 1]]
-        molecule = dict(atoms=[], coordinates=[])
-        for line in mol_lines:
-            molecule['atoms'].append(line.split()[0])
-            molecule['coordinates'].append([float(i) for i in line.split()[1:4]])
-        molecules.append(molecule)
-    return molecules
-
-
-def write_cif(file_name, atoms, coordinates, header='mol', cell=[1, 1, 1, 90, 90, 90], fractional=False):
-    """ Write given atomic coordinates to file in cif format """
-    with open(file_name, 'w') as cif_file:
-        cif_file.write('data_%s\n' % header)
-        cif_file.write('_cell_length_a                  %7.4f\n' % cell[0])
-        cif_file.write('_cell_length_b                  %7.4f\n' % cell[1])
-        cif_file.write('_cell_length_c                  %7.4f\n' % cell[2])
-        cif_file.write('_cell_angle_alpha               %7.4f\n' % cell[3])
-        cif_file.write('_cell_angle_beta                %7.4f\n' % cell[4])
-        cif_file.write('_cell_angle_gamma               %7.4f\n' % cell[5])
-        cif_file.write('loop_\n')
-        cif_file.write('_atom_site_label\n')
-        cif_file.write('_atom_site_type_symbol\n')
-        cif_file.write('_atom_site_fract_x\n')
-        cif_file.write('_atom_site_fract_y\n')
-        cif_file.write('_atom_site_fract_z\n')
-        cif_format = '%s%-4i %2s %7.4f %7.4f %7.4f\n'
-        if fractional:
-            coordinates = fractional_coordinates(coordinates, cell=cell[:3])
-        for i, (atom, coor) in enumerate(zip(atoms, coordinates)):
-            cif_file.write(cif_format % (atom, i, atom, coor[0], coor[1], coor[2]))
-
-
-def fractional_coordinates(coordinates, cell=[1, 1, 1]):
-    """ Convert cartesian coordinates to fractional coordinates (ONLY ORTHOGONAL CELLS!) """
-    frac_coor = []
-    for coor in coordinates:
-        frac_coor.append([cr / cl for (cr, cl) in zip(coor, cell)])
-    return frac_coor
-
-
-####################################################################################################
-xyz_file = os.path.abspath(sys.argv[1])
-cell = input('Please enter cell [a b c alpha beta gamma]: ')
-cif_file = input('Please enter output cif file name: ')
-
-
-cell = [float(i) for i in cell.split()]
-packed_xyz = read_xyz(xyz_file)[0]
-write_cif(cif_file, packed_xyz['atoms'], packed_xyz['coordinates'], cell=cell, fractional=True)
-print('Saved -> %s' % cif_file)
+        - list: results (xyz, cif, n_atoms, status) with status 'converted', 'skipped' or 'failed'
+    """
+    cells = read_manifest(manifest) if manifest is not None else {}
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    results, jobs = [], []
+    for xyz_file in find_xyz_files(paths):
+        name = '%s.cif' % os.path.splitext(os.path.basename(xyz_file))[0]
+        cif_file = os.path.join(os.path.dirname(xyz_file) if output_dir is None else output_dir, name)
+        try:
+            xyz_cell, cell_source = (_parse_cell(cell), None) if cell is not None else read_cell(xyz_file, cells)
+        except ValueError as error:
+            results.append(dict(xyz=xyz_file, cif=cif_file, n_atoms=0, status='failed', error=str(error)))
+            continue
+        if not force and up_to_date(cif_file, [xyz_file, cell_source, manifest]):
+            results.append(dict(xyz=xyz_file, cif=cif_file, n_atoms=0, status='skipped'))
+        else:
+            jobs.append((xyz_file, cif_file, xyz_cell))
+
+    start = time.time()
+    n_atoms = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert_xyz, *job): job for job in jobs}
+        for i, future in enumerate(as_completed(futures), start=1):
+            xyz_file, cif_file, _ = futures[future]
+            try:
+                result = future.result()
+                result['status'] = 'converted'
+                n_atoms += result['n_atoms']
+            except Exception as error:
+                result = dict(xyz=xyz_file, cif=cif_file, n_atoms=0, status='failed', error=str(error))
+            results.append(result)
+            print('\rConverting... %3i / %3i' % (i, len(jobs)), end='')
+    duration = max(time.time() - start, 1e-9)
+
+    n_converted = len([r for r in results if r['status'] == 'converted'])
+    n_skipped = len([r for r in results if r['status'] == 'skipped'])
+    failed = [r for r in results if r['status'] == 'failed']
+    print('\nDone! %i converted, %i skipped, %i failed in %.2f s (%.1f files/s, %.0f atoms/s)'
+          % (n_converted, n_skipped, len(failed), duration, n_converted / duration, n_atoms / duration))
+    for result in failed:
+        print('Failed: %s -> %s' % (result['xyz'], result['error']))
+    return sorted(results, key=lambda r: r['xyz'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Convert xyz files to cif files (P1, fractional coordinates)",
+        epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', type=str, help='xyz files, directories or glob patterns')
+    parser.add_argument('--cell', '-c', nargs=6, type=float, default=None, metavar='',
+                        help="Cell for all files -> a b c alpha beta gamma (default: read for each file)")
+    parser.add_argument('--manifest', '-m', type=str, default=None, metavar='',
+                        help="Manifest file (yaml/json) with cells for each xyz file")
+    parser.add_argument('--output-dir', '-o', type=str, default=None, metavar='',
+                        help="Output directory for cif files (default: next to xyz files)")
+    parser.add_argument('--workers', '-w', type=int, default=None, metavar='',
+                        help="Number of worker processes (default: number of cpus)")
+    parser.add_argument('--force', '-f', action='store_true', default=False,
+                        help="Convert files even if cif files are up to date (default: False)")
+    args = parser.parse_args()
+
+    results = batch_convert(args.paths, output_dir=args.output_dir, cell=args.cell, manifest=args.manifest,
+                            workers=args.workers, force=args.force)
+    sys.exit(1 if any(r['status'] == 'failed' for r in results) else 0)
@@ -2,22 +2,126 @@
 Generate packmol input file and run packmol.
 """
 import os
+import time
+import queue
 import shutil
+import threading
 import subprocess
 
 
+def packmol_status(output, returncode=0, packed_file=None):
+    """
+    Determine the status of a finished packmol run from its output.
+
+    Args:
+        - output (str): Packmol standard output
+        - returncode (int): Packmol exit code
+        - packed_file (str): Path to the packed structure file (checked if the output has no 'Success!' marker)
+
+    Returns:
+        - str: 'success', 'stopped' (packing could not satisfy tolerance), 'error' (bad input) or 'failed'
+    """
+    if 'ERROR' in output:
+        return 'error'
+    if 'STOP' in output or 'WITHOUT PERFECT PACKING' in output:
+        return 'stopped'
+    if returncode != 0:
+        return 'failed'
+    if 'Success!' not in output and packed_file is not None and not os.path.exists(packed_file):
+        return 'failed'
+    return 'success'
+
+
+def _stream_packmol(command, inp, out, run_dir, monitor, timeout=None):
+    """
+    Run packmol and feed its output to the monitor line by line while it is running.
+
+    Returns:
+        - tuple: exit code and status ('timeout', 'stalled' or None if packmol finished)
+    """
+    # gfortran buffers standard output when it is not a terminal
+    env = dict(os.environ, GFORTRAN_UNBUFFERED_PRECONNECTED='y')
+    process = subprocess.Popen(command, stdin=inp, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=run_dir,
+                               env=env, universal_newlines=True, bufsize=1)
+    lines = queue.Queue()
+
+    def read():
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+    monitor.reset()
+    status = None
+    while status is None:
+        try:
+            line = lines.get(timeout=0.5)
+        except queue.Empty:
+            line = ''
+        if line is None:
+            break
+        out.write(line)
+        monitor.feed(line)
+        if timeout is not None and time.time() - monitor.start > timeout:
+            status = 'timeout'
+        elif monitor.stalled():
+            status = 'stalled'
+    if status is not None:
+        process.kill()
+    returncode = process.wait()
+    process.stdout.close()
+    return returncode, status
+
+
+def execute_packmol(run_dir, input_file, command, output_file='packmol.out', packed_file=None, timeout=None,
+                    monitor=None):
+    """
+    Run packmol in a directory and check its output.
+
+    Args:
+        - run_dir (str): Run directory
+        - input_file (str): Packmol input file name (in run directory)
+        - command (str): Packmol executable
+        - output_file (str): File name to save packmol standard output (in run directory)
+        - packed_file (str): Packed structure file name (in run directory)
+        - timeout (float): Time limit in seconds (the process is killed when exceeded)
+        - monitor (PackmolMonitor): Parse output while packmol runs and kill stalled runs (see packmol_monitor)
+
+    Returns:
+        - dict: status, returncode, duration and output (standard output)
+    """
+    start = time.time()
+    status = None
+    with open(os.path.join(run_dir, input_file), 'r') as inp, open(os.path.join(run_dir, output_file), 'w') as out:
+        if monitor is not None:
+            returncode, status = _stream_packmol(command, inp, out, run_dir, monitor, timeout=timeout)
+        else:
+            try:
+                returncode = subprocess.run(command, stdin=inp, stdout=out, stderr=subprocess.STDOUT, cwd=run_dir,
+                                            timeout=timeout).returncode
+            except subprocess.TimeoutExpired:
+                returncode, status = None, 'timeout'
+    with open(os.path.join(run_dir, output_file), 'r') as out:
+        output = out.read()
+    if status is None:
+        status = packmol_status(output, returncode, None if packed_file is None else os.path.join(run_dir, packed_file))
+    return dict(status=status, returncode=returncode, duration=time.time() - start, output=output)
+
+
 class Packmol:
     """
     Wrapper class for the packmol molecule packer program
     """
-    def __init__(self):
+    def __init__(self, options={}, structures=[]):
         """
         packmol
 
         Args:
         - options (dict): Options to be used in input file
+        - structure (list): List of structures (dict)
         """
         self.clear()
+        self.structures = list(structures)
         # Default options
         self.options = {'command_line': 'packmol',
                         'seed': None,
@@ -26,11 +130,19 @@ class Packmol:
                         'output': 'packed.xyz',
                         'input': 'packmol.inp'
                         }
+        self.set_options(options)
 
     def clear(self):
         self.structures = []
         self.options = {}
 
+    def set_options(self, options):
+        """Update packmol option values.
+
+        Use keyword list to change the value of packmol options."""
+        for key, value in options.items():
+            self.options[key] = value
+
     def add_structure(self, structure):
         """Add one or more structure group to be packed by packmol.
 
@@ -39,44 +151,84 @@ class Packmol:
         """
         self.structures.append(structure)
 
+    def input_text(self):
+        """
+        Packmol input file contents for the current options and structures.
+        """
+        lines = ['tolerance      %.2f\n' % self.options['tolerance']]
+        if self.options['seed'] is not None:
+            lines.append('seed           %i\n' % self.options['seed'])
+        lines.append('filetype       %s\n' % self.options['filetype'])
+        lines.append('output         %s\n' % self.options['output'])
+        lines.append('\n########################################################################\n')
+        for s in self.structures:
+            lines.append('structure      %s\n' % s['structure'])
+            lines.append('number         %s\n' % str(s['number']))
+            for key, value in s['position'].items():
+                lines.append('  %-15s %15s\n' % (key, value))
+            lines.append('end structure\n\n')
+        return ''.join(lines)
+
     def _get_input_file(self):
         """
         Create input file for Packmol run.
         """
         self.input_file = os.path.join(self.run_dir, self.options['input'])
         with open(self.input_file, 'w') as inp:
-            inp.write('tolerance      %.2f\n' % self.options['tolerance'])
-            inp.write('filetype       %s\n' % self.options['filetype'])
-            inp.write('output         %s\n' % self.options['output'])
-            inp.write('\n########################################################################\n')
-            for s in self.structures:
-                inp.write('structure      %s\n' % s['structure'])
-                inp.write('number         %s\n' % str(s['number']))
-                for key, value in s['position'].items():
-                    inp.write('  %-15s %15s\n' % (key, value))
-                inp.write('end structure\n\n')
-
-    def _set_run(self, run_dir, source_dir):
+            inp.write(self.input_text())
+
+    def _set_run(self, run_dir, source_dir, cache=None):
         """
-        Setup packmol run.
+        Setup packmol run (executable and structure files are linked from the cache store if a cache is given).
         """
         self.run_dir = run_dir
         os.makedirs(run_dir, exist_ok=True)
-        shutil.copy(os.path.join(source_dir, self.options['command_line']), os.path.join(run_dir, self.options['command_line']))
-        for s in self.structures:
-            shutil.copy(os.path.join(source_dir, s['structure']), os.path.join(run_dir, s['structure']))
+        for file_name in [self.options['command_line']] + [s['structure'] for s in self.structures]:
+            if cache is None:
+                # Files linked from the cache store by an earlier run are read-only -> replace instead of writing through
+                if os.path.lexists(os.path.join(run_dir, file_name)):
+                    os.remove(os.path.join(run_dir, file_name))
+                shutil.copy(os.path.join(source_dir, file_name), os.path.join(run_dir, file_name))
+            else:
+                cache.link_input(os.path.join(source_dir, file_name), os.path.join(run_dir, file_name))
 
-    def run(self, run_dir, source_dir):
+    def run(self, run_dir, source_dir, timeout=None, cache=None, monitor=None):
         """
         Run packmol.
+
+        Args:
+            - run_dir (str): Run directory
+            - source_dir (str): Directory with the packmol executable and structure files
+            - timeout (float): Time limit in seconds
+            - cache (PackmolCache): Reuse the output of an identical packing (see packmol_cache)
+            - monitor (PackmolMonitor): Track progress and kill the run if it stalls (see packmol_monitor)
+
+        Returns:
+            - dict: status ('success', 'stopped', 'error', 'failed', 'timeout' or 'stalled'), returncode, duration, output
+                    and cached (True if the packing was restored from the cache)
         """
-        self._set_run(run_dir, source_dir)
+        key = None
+        if cache is not None:
+            key = cache.key(self, source_dir)
+            result = cache.get(key, run_dir)
+            if result is not None:
+                self.clear()
+                return result
+        self._set_run(run_dir, source_dir, cache=cache)
+        # Files of a packing restored from the cache are links to the store -> remove them instead of writing through
+        for file_name in [self.options['input'], self.options['output'], 'packmol.out']:
+            if os.path.lexists(os.path.join(run_dir, file_name)):
+                os.remove(os.path.join(run_dir, file_name))
         self._get_input_file()
-        input_file = open(self.input_file, 'r')
-        self.output_file = open(os.path.join(self.run_dir, 'packmol.out'), 'w')
-        subprocess.call('./%s' % self.options['command_line'], stdin=input_file, stdout=self.output_file, cwd=run_dir)
-        self.output_file.close()
-        input_file.close()
+        result = execute_packmol(self.run_dir, self.options['input'], './%s' % self.options['command_line'],
+                                 packed_file=self.options['output'], timeout=timeout, monitor=monitor)
+        result['cached'] = False
+        if key is not None and result['status'] == 'success':
+            inputs = [self.options['command_line']] + [s['structure'] for s in self.structures]
+            cache.put(key, run_dir, inputs + [self.options['input'], self.options['output'], 'packmol.out'], result)
+        self.clear()
+        return result
+
 ####################################################################################################
 
     # def _prepare_input_file (self) :
@@ -1,31 +1,43 @@
 """
-Read RASPA simulations
+Read RASPA simulations of a campaign and report how many are finished.
+Outputs are parsed in parallel and saved to a results store (<run_dir>_results.npz), reruns only parse outputs
+that changed since the last run (see raspa_harvest).
+
+ >>> python check_finished.py ipmof-runs --workers 8
+ >>> python check_finished.py ipmof-runs --yaml
 """
 import os
-import sys
-import glob
-import yaml
-from raspa_output import parse_output
+import argparse
+import numpy as np
+from raspa_harvest import harvest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harvest RASPA results of a simulation campaign",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', type=str, help='Campaign directory')
+    parser.add_argument('--store', '-s', type=str, default=None, metavar='',
+                        help="Results store (default: <run_dir>_results.npz)")
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(), metavar='',
+                        help="Number of parser processes (default: number of cpus)")
+    parser.add_argument('--force', '-f', action='store_true', default=False,
+                        help="Parse all outputs even if they did not change")
+    parser.add_argument('--yaml', action='store_true', default=False,
+                        help="Also save results to <run_dir>_results.yaml (one dict per output and component)")
+    args = parser.parse_args()
 
-run_dir = sys.argv[1]
-results_file = '%s_results.yaml' % os.path.basename(os.path.abspath(run_dir))
-finished, warnings = 0, 0
-all_results = []
-n_mofs = len(os.listdir(run_dir))
-for i, mof in enumerate(os.listdir(run_dir)):
-    print('\rReading results... %3i / %3i' % (i + 1, n_mofs), end='')
-    mof_dir = os.path.join(run_dir, mof)
-    ads_path = glob.glob(os.path.join(mof_dir, 'Output', 'System_0', '*.data'))[0]
-    results = parse_output(ads_path, verbose=False, save=False)
-    all_results.append(results)
-    if results['finished'] == True:
-        finished += 1
-    if len(results['warnings']) > 0:
-        warnings += 1
+    name = os.path.basename(os.path.abspath(args.run_dir))
+    store_file = '%s_results.npz' % name if args.store is None else args.store
+    results = harvest(args.run_dir, store_file, workers=args.workers, force=args.force)
 
-print('%i / %i finished' % (finished, n_mofs))
-print('%i / %i warnings' % (warnings, n_mofs))
+    paths, first = np.unique(results['path'], return_index=True)
+    n_outputs = len(paths)
+    print('%i / %i finished' % (np.sum(results['finished'][first]), n_outputs))
+    print('%i / %i warnings' % (np.sum(results['n_warnings'][first] > 0), n_outputs))
 
-with open(results_file, 'w') as resfile:
-    yaml.dump(all_results, resfile)
-print('Results saved -> %s' % (results_file))
+    if args.yaml:
+        import yaml
+        results_file = '%s_results.yaml' % name
+        with open(results_file, 'w') as resfile:
+            yaml.dump([{c: v[i].item() for c, v in results.items()} for i in range(len(results['path']))], resfile)
+        print('Results saved -> %s' % (results_file))
@@ -0,0 +1,373 @@
+"""
+Statistical analysis of RASPA loading and energy time series.
+
+The loadings and energies printed every PrintEvery cycles are read from output files (finished or running) into
+arrays. Uncertainties of the means are estimated from the series themselves, so unfinished simulations get error
+bars too. All statistics work on (n_series, n_samples) arrays, i.e. on all components of all simulations at once:
+    - equilibration: number of initial samples to discard (marginal standard error rule, MSER)
+    - autocorrelation: normalized autocorrelation functions (FFT)
+    - autocorrelation_time: integrated autocorrelation times with automatic windowing (Sokal)
+    - statistical_inefficiency: g = 1 + 2 * tau (number of samples per independent sample)
+    - block_error: standard error of the mean from block averaging (Flyvbjerg-Petersen)
+    - uncertainty: all of the above for the equilibrated part of every series
+
+ >>> trace = read_series('Output/System_0/output_IRMOF-1_1.1.1_298.000000_1e+07.data')
+ >>> components, loadings = trace.array('mol/kg')        # (n_components, n_cycles)
+ >>> uncertainty(loadings)['err']
+
+ >>> python raspa_analysis.py ipmof-runs --unit mol/kg --workers 8
+"""
+import os
+import glob
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from raspa_output import RaspaOutput
+from raspa_harvest import find_outputs
+
+
+# Last word before 'energy:' in the 'Current ... energy:' lines of a cycle -> energy name
+ENERGY_KEYS = {'potential': 'total', 'Host-Host': 'host_host', 'Host-Adsorbate': 'host_ads',
+               'Adsorbate-Adsorbate': 'ads_ads'}
+
+
+class LoadingTrace(RaspaOutput):
+    """
+    RASPA output parser that keeps the loadings and energies of every production cycle.
+
+    The output file is followed with update, which only parses the complete lines appended since the last update.
+    Outputs of earlier runs of a restarted simulation (<output>.data.1, .2, ...) are read first.
+    RASPA prints the energies of a cycle after its loadings, so a cycle is recorded when the next cycle header or
+    'Simulation finished' is read (the last cycle of a running simulation is recorded with the next print).
+    """
+    def reset(self):
+        """ Clear all parsed data """
+        super().reset()
+        self.cycles = []
+        self.samples = dict(absolute={}, excess={})
+        self.energies = {key: [] for key in ENERGY_KEYS.values()}
+        self._energy_block = {}
+        self._offset = 0
+        self._inode = None
+        self._cycle_offset = 0
+        self._handlers.update({'Current t': self._current_energy, '\tCurrent ': self._current_energy})
+
+    def _current_energy(self, line):
+        """ 'Current total potential energy' and 'Current Host-Adsorbate energy' lines of a cycle """
+        name, _, value = line.partition(' energy:')
+        key = ENERGY_KEYS.get(name[name.rfind(' ') + 1:])
+        if key is not None and len(value) > 0:
+            self._energy_block[key] = float(value.split(None, 1)[0])
+
+    def _production_cycle(self, line):
+        if line.startswith('Current cycle:'):
+            self._record()
+            self._energy_block = {}
+        super()._production_cycle(line)
+
+    def _init_cycle(self, line):
+        if line.startswith('[Init] Current cycle:'):
+            self._energy_block = {}
+        super()._init_cycle(line)
+
+    def _finished(self, line):
+        if line.startswith('Simulation finished'):
+            self._record()
+        super()._finished(line)
+
+    def _record(self):
+        """ Keep the loadings and energies of the last completely parsed production cycle """
+        absolute = self.block['absolute']
+        if not self.initialization or len(absolute) == 0 or any(len(v) < 5 for v in absolute.values()):
+            return
+        self.cycles.append(self.cycle + self._cycle_offset)
+        for kind in self.samples:
+            for component, loadings in self.block[kind].items():
+                self.samples[kind].setdefault(component, []).append(loadings)
+        for key in self.energies:
+            self.energies[key].append(self._energy_block.get(key, np.nan))
+        self.block = dict(absolute={}, excess={})
+        self._energy_block = {}
+
+    def _read(self, data_file, offset=0):
+        """ Parse complete lines of a file from offset -> offset after the last complete line """
+        with open(data_file, 'rb') as f:
+            f.seek(offset)
+            text = f.read()
+        end = text.rfind(b'\n') + 1
+        self.feed_lines(text[:end].decode(errors='replace').splitlines(True))
+        return offset + end
+
+    def update(self, data_file):
+        """
+        Parse new lines of a (running) RASPA output file.
+
+        Returns:
+            - int: number of new cycles
+        """
+        n_cycles = len(self.cycles)
+        stat = os.stat(data_file)
+        if self._inode is not None and (stat.st_ino != self._inode or stat.st_size < self._offset):
+            # Output was replaced by a restarted run
+            self.reset()
+        if self._inode is None:
+            self._inode = stat.st_ino
+            parts = [p for p in glob.glob('%s.*' % data_file) if p.rsplit('.', 1)[1].isdigit()]
+            for part in sorted(parts, key=lambda p: int(p.rsplit('.', 1)[1])):
+                self._read(part)
+                # Last cycle of a run stopped before 'Simulation finished'
+                self._record()
+                # Cycles of restarted runs (counted from 0) continue one print interval after the last cycle
+                if len(self.cycles) > 0:
+                    interval = self.cycles[-1] - self.cycles[-2] if len(self.cycles) > 1 else 1
+                    self._cycle_offset = self.cycles[-1] + interval
+                self.finished, self.initialization, self.cycle = False, False, 0
+        self._offset = self._read(data_file, self._offset)
+        return len(self.cycles) - n_cycles
+
+    def series(self, component, unit='mol/kg', kind='absolute'):
+        """ Production loadings of a component -> ndarray """
+        return np.array([loadings[unit] for loadings in self.samples[kind].get(component, [])])
+
+    def array(self, unit='mol/kg', kind='absolute'):
+        """ Production loadings of all components -> component names (list), (n_components, n_cycles) ndarray """
+        components = list(self.samples[kind])
+        loadings = np.array([self.series(c, unit, kind) for c in components], dtype=float)
+        return components, loadings.reshape(len(components), len(self.cycles))
+
+    def energy_array(self):
+        """ Production energies -> energy names (list), (n_energies, n_cycles) ndarray (K, nan if not printed) """
+        keys = list(self.energies)
+        return keys, np.array([self.energies[key] for key in keys], dtype=float).reshape(len(keys), len(self.cycles))
+
+
+def read_series(data_file):
+    """ Read loading and energy series of a RASPA output file (and of earlier runs if restarted) -> LoadingTrace """
+    trace = LoadingTrace()
+    trace.update(data_file)
+    return trace
+
+
+def _rows(x):
+    """ Time series as 2D float array (one series per row) and whether the input was a single series """
+    x = np.asarray(x, dtype=float)
+    return np.atleast_2d(x), x.ndim == 1
+
+
+def _result(values, single):
+    return values[0] if single else values
+
+
+def equilibration(x):
+    """
+    Equilibration index of time series with the marginal standard error rule (MSER):
+    the number of initial samples d (d <= n / 2) that minimizes var(x[d:]) / (n - d)
+
+    Args:
+        - x (ndarray): time series (n_samples) or (n_series, n_samples)
+
+    Returns:
+        - int or ndarray: equilibration index of every series
+    """
+    x, single = _rows(x)
+    n = x.shape[1]
+    if n < 4:
+        return _result(np.zeros(len(x), dtype=int), single)
+    tail_sum = np.cumsum(x[:, ::-1], axis=1)[:, ::-1][:, :n // 2 + 1]
+    tail_sq = np.cumsum((x * x)[:, ::-1], axis=1)[:, ::-1][:, :n // 2 + 1]
+    m = n - np.arange(n // 2 + 1)
+    mser = (tail_sq - tail_sum ** 2 / m) / m ** 2
+    return _result(np.argmin(mser, axis=1), single)
+
+
+def autocorrelation(x):
+    """
+    Normalized autocorrelation functions of time series (FFT, zero padded).
+
+    Args:
+        - x (ndarray): time series (n_samples) or (n_series, n_samples)
+
+    Returns:
+        - ndarray: autocorrelation of every series for lags 0 ... n_samples - 1 (constant series -> 1, 0, 0, ...)
+    """
+    x, single = _rows(x)
+    n = x.shape[1]
+    dx = x - x.mean(axis=1, keepdims=True)
+    size = 1 << (2 * n - 1).bit_length()
+    f = np.fft.rfft(dx, size, axis=1)
+    acf = np.fft.irfft(f * f.conj(), size, axis=1)[:, :n] / (n - np.arange(n))
+    variance = acf[:, :1].copy()
+    acf = np.divide(acf, variance, out=np.zeros_like(acf), where=variance > 0)
+    acf[:, 0] = 1
+    return _result(acf, single)
+
+
+def autocorrelation_time(x, window=5):
+    """
+    Integrated autocorrelation times of time series (in samples) -> tau = sum of autocorrelations for lags 1 ... W
+    The window W is the first lag with W >= window * (1 + 2 * tau) (Sokal), so noise at long lags is not summed.
+
+    Args:
+        - x (ndarray): time series (n_samples) or (n_series, n_samples)
+        - window (float): Window constant
+
+    Returns:
+        - float or ndarray: autocorrelation time of every series (>= 0)
+    """
+    x, single = _rows(x)
+    acf = autocorrelation(x)
+    g = 2 * np.cumsum(acf, axis=1) - 1
+    inside = np.arange(acf.shape[1]) >= window * g
+    lag = np.where(inside.any(axis=1), inside.argmax(axis=1), acf.shape[1] - 1)
+    tau = (g[np.arange(len(x)), lag] - 1) / 2
+    return _result(np.maximum(tau, 0), single)
+
+
+def statistical_inefficiency(x, window=5):
+    """ Statistical inefficiency g = 1 + 2 * tau of time series (number of samples per independent sample) """
+    return 1 + 2 * autocorrelation_time(x, window)
+
+
+def block_averages(x, n_blocks):
+    """ Averages of n_blocks consecutive blocks of time series (remaining samples at the end are not used) """
+    x, single = _rows(x)
+    size = x.shape[1] // n_blocks
+    blocks = x[:, :size * n_blocks].reshape(len(x), n_blocks, size).mean(axis=2)
+    return _result(blocks, single)
+
+
+def block_error(x, min_blocks=4):
+    """
+    Standard error of the mean of correlated time series with block averaging (Flyvbjerg-Petersen).
+    Neighbouring blocks are averaged until fewer than min_blocks are left, the largest estimate is returned.
+
+    Args:
+        - x (ndarray): time series (n_samples) or (n_series, n_samples)
+        - min_blocks (int): Minimum number of blocks
+
+    Returns:
+        - float or ndarray: standard error of every series (nan if n_samples < min_blocks)
+    """
+    x, single = _rows(x)
+    errors = []
+    while x.shape[1] >= max(min_blocks, 2):
+        errors.append(x.std(axis=1, ddof=1) / np.sqrt(x.shape[1]))
+        n = x.shape[1] // 2 * 2
+        x = (x[:, 0:n:2] + x[:, 1:n:2]) / 2
+    errors = np.max(errors, axis=0) if len(errors) > 0 else np.full(len(x), np.nan)
+    return _result(errors, single)
+
+
+def uncertainty(x, equilibrate=True, min_blocks=4, window=5):
+    """
+    Mean and uncertainty of the equilibrated part of time series.
+
+    Args:
+        - x (ndarray): time series (n_samples) or (n_series, n_samples) with the same number of samples
+        - equilibrate (bool): Discard initial samples (see equilibration)
+        - min_blocks (int): Minimum number of blocks for block averaging
+        - window (float): Window constant for autocorrelation times
+
+    Returns:
+        - dict of ndarrays (floats for a single series): mean, err (from the statistical inefficiency),
+          block_err (block averaging), tau (autocorrelation time in samples), g (statistical inefficiency),
+          n_eff (number of independent samples), equilibration (index of the first sample used) and samples
+    """
+    x, single = _rows(x)
+    n_series, n = x.shape
+    start = equilibration(x) if equilibrate else np.zeros(n_series, dtype=int)
+    keys = ['mean', 'err', 'block_err', 'tau', 'g', 'n_eff']
+    stats = {key: np.full(n_series, np.nan) for key in keys}
+    # Series with the same equilibration index are analyzed together
+    for t0 in np.unique(start):
+        rows = np.where(start == t0)[0]
+        production = x[rows, t0:]
+        if production.shape[1] == 0:
+            continue
+        tau = autocorrelation_time(production, window)
+        g = 1 + 2 * tau
+        variance = production.var(axis=1, ddof=1) if production.shape[1] > 1 else np.full(len(rows), np.nan)
+        stats['mean'][rows] = production.mean(axis=1)
+        stats['err'][rows] = np.sqrt(variance * g / production.shape[1])
+        stats['block_err'][rows] = block_error(production, min_blocks)
+        stats['tau'][rows] = tau
+        stats['g'][rows] = g
+        stats['n_eff'][rows] = production.shape[1] / g
+    stats['equilibration'] = start
+    stats['samples'] = n - start
+    return {key: _result(v, single) for key, v in stats.items()}
+
+
+def _read_arrays(data_file, unit):
+    """ Read series of an output file in a worker process -> (phase, cycles, names, (n_names, n_cycles) array) """
+    try:
+        trace = read_series(data_file)
+    except Exception:
+        return 'error', np.zeros(0, dtype=int), [], np.zeros((0, 0))
+    components, loadings = trace.array(unit)
+    energies, energy = trace.energy_array()
+    return trace.phase(), np.array(trace.cycles), components + energies, np.concatenate([loadings, energy])
+
+
+def analyze_outputs(data_files, unit='mol/kg', workers=4, **kwargs):
+    """
+    Uncertainties of loadings and energies of many RASPA outputs (finished or running).
+
+    Output files are read in a process pool and series with the same number of cycles are analyzed together.
+
+    Args:
+        - data_files (list): RASPA output files
+        - unit (str): Loading unit -> 'mol/uc', 'mol/kg', 'mg/g', 'cc/g' or 'cc/cc'
+        - workers (int): Number of reader processes
+        - kwargs: see uncertainty
+
+    Returns:
+        - list: one row per output file and quantity (component or energy) -> {path, phase, quantity, cycles,
+                equilibration (cycle), tau (cycles) and uncertainty results}
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        outputs = list(executor.map(_read_arrays, data_files, [unit] * len(data_files)))
+    rows, groups = [], {}
+    for data_file, (phase, cycles, names, series) in zip(data_files, outputs):
+        for name, x in zip(names, series):
+            if len(x) > 0 and not np.isnan(x).all():
+                groups.setdefault(len(x), []).append((len(rows), x))
+            rows.append(dict(path=data_file, phase=phase, quantity=name, cycles=len(x), _cycles=cycles))
+    for n, members in groups.items():
+        stats = uncertainty(np.array([x for _, x in members]), **kwargs)
+        for j, (i, _) in enumerate(members):
+            row = rows[i]
+            row.update({key: v[j].item() for key, v in stats.items()})
+            cycles = row['_cycles']
+            row['equilibration'] = int(cycles[row['equilibration']])
+            row['tau'] = row['tau'] * (cycles[1] - cycles[0] if len(cycles) > 1 else 1)
+    for row in rows:
+        del row['_cycles']
+    return rows
+
+
+def print_analysis(rows, unit='mol/kg'):
+    """ Print means and uncertainties of all quantities """
+    print('%-60s %-13s %-10s %7s %12s %10s %10s %9s %8s' % ('output', 'phase', 'quantity', 'cycles', 'mean', 'err',
+                                                         'block_err', 'tau', 'eq.'))
+    for r in rows:
+        if 'mean' not in r:
+            continue
+        print('%-60s %-13s %-10s %7i %12.4f %10.4f %10.4f %9.1f %8i' % (
+            r['path'][-60:], r['phase'], r['quantity'], r['cycles'], r['mean'], r['err'], r['block_err'], r['tau'],
+            r['equilibration']))
+    print('Loadings in %s, energies in K, tau and equilibration in cycles' % unit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Uncertainties of RASPA loading and energy time series",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', type=str, help='RASPA output file or campaign directory')
+    parser.add_argument('--unit', '-u', type=str, default='mol/kg', metavar='',
+                        help="Loading unit (default: mol/kg)")
+    parser.add_argument('--workers', '-w', type=int, default=4, metavar='',
+                        help="Number of reader processes (default: 4)")
+    args = parser.parse_args()
+
+    data_files = [args.path] if os.path.isfile(args.path) else find_outputs(args.path)
+    print_analysis(analyze_outputs(data_files, unit=args.unit, workers=args.workers), unit=args.unit)
@@ -0,0 +1,232 @@
+"""
+Run many RASPA simulations in one allocation.
+
+Simulation directories are run concurrently on a worker pool with one worker per available core, and a worker starts
+the next simulation as soon as its current run finishes. Simulations that already finished are skipped, so a bundle
+can simply be resubmitted after a time limit. For Slurm, the simulations of a campaign are split into bundles that
+are run by the tasks of one job array instead of submitting one job per simulation.
+
+ >>> results = RaspaBundle(workers=28).run(['ipmof-runs/IRMOF-1/NIZ/298K_1bar', ...])
+
+ >>> python raspa_bundle.py ipmof-runs                              # all simulations on the cores of this machine
+ >>> python raspa_bundle.py ipmof-runs --slurm --size 112 --cores 28  # write job array script (bundles of 112 runs)
+ >>> python raspa_bundle.py ipmof-runs --converge 0.02               # stop simulations when converged (2% error)
+ >>> python raspa_bundle.py ipmof-runs --command "python fake_simulate.py"  # test without RASPA
+"""
+import os
+import glob
+import time
+import shlex
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from raspa_harvest import find_outputs, read_convergence
+from raspa_status import probe
+from raspa_slurm import write_raspa_array
+from raspa_convergence import ConvergenceController
+
+
+COMMAND = 'simulate simulation.input'
+SIM_LIST = 'simulations.txt'
+
+
+def available_cores():
+    """ Number of cores this process may run on (Slurm allocation or cpu affinity, otherwise cpu count) """
+    if 'SLURM_CPUS_PER_TASK' in os.environ:
+        return int(os.environ['SLURM_CPUS_PER_TASK'])
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def find_simulations(run_dir):
+    """ Simulation directories (with simulation.input) of a campaign relative to run_dir in sorted order """
+    inputs = glob.glob(os.path.join(run_dir, '**', 'simulation.input'), recursive=True)
+    return sorted(os.path.relpath(os.path.dirname(f), run_dir) for f in inputs)
+
+
+def is_finished(sim_dir):
+    """
+    Check if all RASPA outputs of a simulation directory are finished or converged (stopped by the convergence
+    controller), False if there are no outputs
+    """
+    outputs = find_outputs(sim_dir)
+    return len(outputs) > 0 and all(read_convergence(data_file) is not None or probe(data_file)['phase'] == 'finished'
+                                    for data_file in outputs)
+
+
+def bundle(simulations, index, size):
+    """ Simulations of the bundle with the given index (bundles of given size in order) """
+    return simulations[index * size:(index + 1) * size]
+
+
+class RaspaBundle:
+    """
+    Concurrent RASPA simulation runner (simulations run in subprocesses so a thread pool is used).
+
+    Args:
+        - workers (int): Maximum number of simulations running at the same time (default: available cores)
+        - command (str): Command run in every simulation directory (stdout and stderr -> out.raspa)
+        - timeout (float): Time limit for a single simulation in seconds (None -> no limit)
+        - skip_finished (bool): Do not run simulations with finished outputs again
+        - monitor (callable): Called with the simulation directory every poll seconds while a simulation runs, the
+                              simulation is stopped if it returns True (e.g. ConvergenceController.stop)
+        - poll (float): Monitoring interval in seconds
+    """
+    def __init__(self, workers=None, command=COMMAND, timeout=None, skip_finished=True, monitor=None, poll=60):
+        self.workers = available_cores() if workers is None else workers
+        self.command = shlex.split(command)
+        self.timeout = timeout
+        self.skip_finished = skip_finished
+        self.monitor = monitor
+        self.poll = poll
+
+    def _run(self, sim_dir):
+        """
+        Run a simulation.
+
+        Returns:
+            - dict: sim_dir, status ('finished', 'stopped' (by monitor), 'skipped', 'failed' or 'timeout'),
+                    returncode and duration
+        """
+        if self.skip_finished and (is_finished(sim_dir) or (self.monitor is not None and self.monitor(sim_dir))):
+            return dict(sim_dir=sim_dir, status='skipped', returncode=None, duration=0.0)
+        start = time.time()
+        with open(os.path.join(sim_dir, 'out.raspa'), 'w') as out:
+            try:
+                process = subprocess.Popen(self.command, cwd=sim_dir, stdout=out, stderr=subprocess.STDOUT)
+            except OSError as e:
+                out.write('%s\n' % e)
+                return dict(sim_dir=sim_dir, status='failed', returncode=None, duration=time.time() - start)
+            status = None
+            while status is None:
+                wait = self.poll if self.monitor is not None else None
+                if self.timeout is not None:
+                    remaining = max(start + self.timeout - time.time(), 0)
+                    wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    status = 'finished' if process.wait(timeout=wait) == 0 else 'failed'
+                except subprocess.TimeoutExpired:
+                    if self.timeout is not None and time.time() - start >= self.timeout:
+                        status = 'timeout'
+                    elif self.monitor is not None and self.monitor(sim_dir):
+                        status = 'stopped'
+                    if status is not None:
+                        process.terminate()
+                        try:
+                            process.wait(timeout=30)
+                        except subprocess.TimeoutExpired:
+                            process.kill()
+                            process.wait()
+            returncode = process.returncode
+        return dict(sim_dir=sim_dir, status=status, returncode=returncode, duration=time.time() - start)
+
+    def run(self, sim_dirs, verbose=True):
+        """
+        Run simulations on the worker pool and wait for all of them to finish.
+
+        Args:
+            - sim_dirs (list): Simulation directories
+            - verbose (bool): Print progress and number of simulations with each status
+
+        Returns:
+            - list: simulation results (see _run) in the same order as sim_dirs
+        """
+        start = time.time()
+        counts = {}
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._run, sim_dir): sim_dir for sim_dir in sim_dirs}
+            for i, future in enumerate(as_completed(futures)):
+                result = future.result()
+                results[futures[future]] = result
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+                if verbose:
+                    print('\rRunning simulations... %3i / %3i | %s' % (i + 1, len(sim_dirs), ' '.join(
+                        '%s: %i' % (s, n) for s, n in counts.items())), end='')
+        if verbose:
+            print('\nDone! %i simulations on %i workers (%.1f s)' % (len(sim_dirs), self.workers, time.time() - start))
+            for sim_dir in sim_dirs:
+                if results[sim_dir]['status'] in ['failed', 'timeout']:
+                    print('%s -> %s' % (sim_dir, results[sim_dir]['status']))
+        return [results[sim_dir] for sim_dir in sim_dirs]
+
+
+def write_bundle_array(run_dir, size, cores=28, walltime='24:00:00', command=COMMAND, jobname=None, converge=None):
+    """
+    Write a Slurm job array that runs the simulations of a campaign in bundles (one array task per bundle).
+
+    The simulation list is written to <run_dir>/simulations.txt so new directories do not change the bundles.
+
+    Args:
+        - run_dir (str): Campaign directory
+        - size (int): Number of simulations in each bundle
+        - cores (int): Number of cores (concurrent simulations) of each array task
+        - walltime (str): Slurm job max. wall time
+        - command (str): Command run in every simulation directory
+        - jobname (str): Slurm job name (default: campaign directory name)
+        - converge (float): Stop simulations when the relative error of the loadings is below this target
+
+    Returns:
+        - str: job array script (<run_dir>/job_bundles.sh)
+    """
+    simulations = find_simulations(run_dir)
+    with open(os.path.join(run_dir, SIM_LIST), 'w') as f:
+        f.write(''.join('%s\n' % sim for sim in simulations))
+    n_bundles = (len(simulations) + size - 1) // size
+    task = 'python %s %s --list %s --bundle $SLURM_ARRAY_TASK_ID --size %i --command %s' % (
+        os.path.abspath(__file__), os.path.abspath(run_dir), SIM_LIST, size, shlex.quote(command))
+    if converge is not None:
+        task += ' --converge %g' % converge
+    slurm_file = os.path.join(run_dir, 'job_bundles.sh')
+    jobname = os.path.basename(os.path.abspath(run_dir)) if jobname is None else jobname
+    write_raspa_array(slurm_file, jobname, task, n_bundles, cores=cores, walltime=walltime)
+    print('%i simulations in %i bundles -> %s' % (len(simulations), n_bundles, slurm_file))
+    return slurm_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many RASPA simulations in one allocation",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', type=str, help='Campaign directory')
+    parser.add_argument('--workers', '-w', type=int, default=None, metavar='',
+                        help="Number of concurrent simulations (default: available cores)")
+    parser.add_argument('--command', '-c', type=str, default=COMMAND, metavar='',
+                        help="Command run in every simulation directory (default: %s)" % COMMAND)
+    parser.add_argument('--timeout', '-t', type=float, default=None, metavar='',
+                        help="Time limit for a single simulation in seconds")
+    parser.add_argument('--converge', type=float, default=None, metavar='',
+                        help="Stop simulations when the relative error of the loadings is below this target")
+    parser.add_argument('--poll', type=float, default=60, metavar='',
+                        help="Convergence check interval in seconds (default: 60)")
+    parser.add_argument('--rerun', action='store_true', default=False,
+                        help="Run finished simulations again")
+    parser.add_argument('--list', '-l', type=str, default=None, metavar='',
+                        help="File with simulation directories relative to run_dir (default: find simulation.input)")
+    parser.add_argument('--bundle', '-b', type=int, default=None, metavar='',
+                        help="Only run the bundle with this index")
+    parser.add_argument('--size', '-n', type=int, default=28, metavar='',
+                        help="Number of simulations in each bundle (default: 28)")
+    parser.add_argument('--slurm', '-s', action='store_true', default=False,
+                        help="Write Slurm job array script for the bundles instead of running simulations")
+    parser.add_argument('--cores', type=int, default=28, metavar='',
+                        help="Number of cores of each array task (default: 28)")
+    parser.add_argument('--walltime', type=str, default='24:00:00', metavar='',
+                        help="Slurm job max. wall time (default: 24:00:00)")
+    args = parser.parse_args()
+
+    if args.slurm:
+        write_bundle_array(args.run_dir, args.size, cores=args.cores, walltime=args.walltime, command=args.command,
+                           converge=args.converge)
+    else:
+        if args.list is None:
+            simulations = find_simulations(args.run_dir)
+        else:
+            with open(os.path.join(args.run_dir, args.list), 'r') as f:
+                simulations = [line.strip() for line in f if len(line.strip()) > 0]
+        if args.bundle is not None:
+            simulations = bundle(simulations, args.bundle, args.size)
+        sim_dirs = [os.path.join(args.run_dir, sim) for sim in simulations]
+        monitor = None if args.converge is None else ConvergenceController(target=args.converge).stop
+        RaspaBundle(workers=args.workers, command=args.command, timeout=args.timeout, skip_finished=not args.rerun,
+                    monitor=monitor, poll=args.poll).run(sim_dirs)
@@ -0,0 +1,226 @@
+"""
+Generate a RASPA simulation campaign from a sweep config.
+
+Every combination of the values in the 'sweep' section of the config is one simulation directory:
+    <run_dir>/<framework>/<component(s)>/<temperature>K_<pressure>bar
+(only swept axes are used for the directory names). The input file is pre-compiled once with the fields that do not
+change between simulations, the cif, molecule definition and force field files are hard linked (or symlinked) to
+every simulation directory instead of copied and the list of simulations is written to <run_dir>/campaign.json.
+
+Config (see raspa_config.yaml):
+    sweep:
+      framework: [IRMOF-1, ZIF-8]
+      components: [NIZ, PZA, [NIZ, PZA]]   # component names (list -> mixture), other settings from components[0]
+      temperature: [298, 310]
+      pressure: [1, 100]
+    files:                                 # relative to the config file
+      cif_dir: cif                         # <framework>.cif
+      molecule_dir: ../../drugs/raspa      # <component name>.def
+      shared: [../../raspa/UFF/force_field.def, ...]
+    unitcell: auto                         # minimal replication for the cut-off from the cif cell (raspa_cell.py)
+
+ >>> python raspa_campaign.py campaign.yaml ipmof-runs
+ >>> python raspa_campaign.py campaign.yaml ipmof-runs --slurm --walltime 48:00:00
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import itertools
+import yaml
+from raspa_input import compile_template, input_fields, FIELDS, CONFIG_FIELDS
+from raspa_slurm import SLURM_TEMPLATE
+from raspa_cell import read_cells, unit_cells
+
+
+MANIFEST = 'campaign.json'
+
+
+def _names(components):
+    """ Component names of a components sweep value (name or list of names for mixtures) """
+    return [components] if isinstance(components, str) else list(components)
+
+
+def _label(key, value):
+    """ Directory name of a swept value """
+    if key == 'framework':
+        return str(value)
+    if key == 'components':
+        return '-'.join(_names(value))
+    if key == 'temperature':
+        return '%gK' % value
+    if key == 'pressure':
+        return '%gbar' % value
+    if isinstance(value, (list, tuple)):
+        value = 'x'.join(str(v) for v in value)
+    return '%s-%s' % (key, value)
+
+
+def job_path(values):
+    """ Simulation directory (relative to run_dir) of the swept values -> framework/components/T_P """
+    path = [_label(key, values[key]) for key in ['framework', 'components'] if key in values]
+    keys = [k for k in ['temperature', 'pressure'] if k in values]
+    keys += [k for k in values if k not in ['framework', 'components', 'temperature', 'pressure']]
+    leaf = [_label(key, values[key]) for key in keys]
+    return os.path.join(*(path + (['_'.join(leaf)] if len(leaf) > 0 else [])))
+
+
+def job_config(config, values):
+    """ Simulation config of swept values (components are copied from the first component of the config) """
+    job = dict(config, **values)
+    if 'components' in values:
+        job['components'] = [dict(config['components'][0], name=name) for name in _names(values['components'])]
+    return job
+
+
+def expand_sweep(config):
+    """
+    Expand the sweep section of a config to all combinations of the swept values.
+
+    Args:
+        - config (dict): RASPA simulation config with a sweep section -> {config key: [values]}
+
+    Returns:
+        - list: one dict per simulation -> {path: directory relative to run_dir, values: {key: value}}
+    """
+    sweep = config.get('sweep', {})
+    for key in sweep:
+        if key not in FIELDS and key not in CONFIG_FIELDS:
+            raise ValueError('Unknown sweep key: %s (options: %s)' % (key, ', '.join(list(FIELDS) + list(CONFIG_FIELDS))))
+    keys = list(sweep)
+    jobs = []
+    for combination in itertools.product(*[sweep[key] for key in keys]):
+        values = dict(zip(keys, combination))
+        jobs.append(dict(path=job_path(values), values=values))
+    return jobs
+
+
+def auto_unitcell(config, jobs, base_dir='.'):
+    """ Set minimal unit cell replication (see raspa_cell.unit_cells) of each simulation for unitcell: auto """
+    cif_dir = config.get('files', {}).get('cif_dir')
+    if cif_dir is None:
+        raise ValueError('unitcell: auto needs the cif directory of the frameworks (files: cif_dir)')
+    frameworks = [job['values'].get('framework', config['framework']) for job in jobs]
+    names, cells = read_cells(os.path.join(base_dir, cif_dir), sorted(set(frameworks)))
+    index = {name: i for i, name in enumerate(names)}
+    cutoffs = [job['values'].get('cutoff', config['cutoff']) for job in jobs]
+    n_cells = unit_cells(cells[[index[f] for f in frameworks]], cutoffs)
+    for job, n in zip(jobs, n_cells.tolist()):
+        job['values']['unitcell'] = n
+
+
+def job_files(config, job, base_dir='.'):
+    """ Files linked to a simulation directory -> {file name: source path} """
+    files = config.get('files', {})
+    source = lambda path: os.path.normpath(os.path.join(base_dir, path))
+    linked = {}
+    for path in files.get('shared', []):
+        linked[os.path.basename(path)] = source(path)
+    if 'cif_dir' in files:
+        linked['%s.cif' % job['framework']] = source(os.path.join(files['cif_dir'], '%s.cif' % job['framework']))
+    if 'molecule_dir' in files:
+        for component in job['components']:
+            linked['%s.def' % component['name']] = source(os.path.join(files['molecule_dir'],
+                                                                      '%s.def' % component['name']))
+    return linked
+
+
+def link_file(source, destination, link='hard'):
+    """ Link (or copy) a file to destination (hard links fall back to symlinks across file systems) """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if link == 'hard':
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            pass
+    if link in ['hard', 'symlink']:
+        os.symlink(os.path.abspath(source), destination)
+    else:
+        shutil.copyfile(source, destination)
+
+
+def generate_campaign(config, run_dir, base_dir='.', link='hard', slurm=False, walltime='24:00:00', verbose=True):
+    """
+    Generate simulation directories for all combinations of the swept values of a config.
+
+    Args:
+        - config (dict): RASPA simulation config with sweep and files sections
+        - run_dir (str): Campaign directory
+        - base_dir (str): Directory the paths of the files section are relative to
+        - link (str): How files are placed in simulation directories -> 'hard', 'symlink' or 'copy'
+        - slurm (bool): Write a slurm job file (job_raspa.sh) to every simulation directory
+        - walltime (str): Slurm job max. wall time
+        - verbose (bool): Print progress
+
+    Returns:
+        - list: simulations (see expand_sweep) with simulation directories relative to run_dir
+    """
+    start = time.time()
+    jobs = expand_sweep(config)
+    keys = list(config.get('sweep', {}))
+    if config.get('unitcell') == 'auto':
+        auto_unitcell(config, jobs, base_dir)
+        keys.append('unitcell')
+    template, fields = compile_template(config, keys)
+    if slurm:
+        slurm_template = SLURM_TEMPLATE % dict(jobname='%(jobname)s', walltime=walltime.replace('%', '%%'))
+
+    # Check all linked files before creating any directory
+    configs = [job_config(config, job['values']) for job in jobs]
+    sources = set()
+    for job in configs:
+        sources.update(job_files(config, job, base_dir).values())
+    missing = sorted(s for s in sources if not os.path.isfile(s))
+    if len(missing) > 0:
+        raise FileNotFoundError('Campaign files not found:\n%s' % '\n'.join(missing))
+
+    n_jobs = len(jobs)
+    for i, (job, job_conf) in enumerate(zip(jobs, configs)):
+        sim_dir = os.path.join(run_dir, job['path'])
+        os.makedirs(sim_dir, exist_ok=True)
+        with open(os.path.join(sim_dir, 'simulation.input'), 'w') as f:
+            f.write(template % input_fields(job_conf, fields))
+        for file_name, source in job_files(config, job_conf, base_dir).items():
+            link_file(source, os.path.join(sim_dir, file_name), link=link)
+        if slurm:
+            with open(os.path.join(sim_dir, 'job_raspa.sh'), 'w') as f:
+                f.write(slurm_template % dict(jobname=job['path'].replace(os.sep, '_')))
+        if verbose and ((i + 1) % 100 == 0 or i + 1 == n_jobs):
+            print('\rGenerating simulations... %3i / %3i' % (i + 1, n_jobs), end='')
+
+    base = {k: v for k, v in config.items() if k not in ['sweep', 'files']}
+    manifest = dict(created=time.strftime('%Y-%m-%d %H:%M:%S'), config=base, sweep=config.get('sweep', {}),
+                    files=config.get('files', {}), jobs=jobs)
+    with open(os.path.join(run_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if verbose:
+        print('\n%i simulations (%.2f s) -> %s' % (n_jobs, time.time() - start, run_dir))
+    return jobs
+
+
+def load_campaign(run_dir):
+    """ Read campaign manifest -> {created, config, sweep, files, jobs} """
+    with open(os.path.join(run_dir, MANIFEST), 'r') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a RASPA simulation campaign from a sweep config",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config', type=str, help='RASPA config file (yaml) with a sweep section')
+    parser.add_argument('run_dir', type=str, help='Campaign directory')
+    parser.add_argument('--link', '-l', type=str, default='hard', choices=['hard', 'symlink', 'copy'],
+                        help="How shared files are placed in simulation directories (default: hard)")
+    parser.add_argument('--slurm', '-s', action='store_true', default=False,
+                        help="Write a slurm job file to every simulation directory")
+    parser.add_argument('--walltime', '-w', type=str, default='24:00:00', metavar='',
+                        help="Slurm job max. wall time (default: 24:00:00)")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    generate_campaign(config, args.run_dir, base_dir=os.path.dirname(os.path.abspath(args.config)),
+                      link=args.link, slurm=args.slurm, walltime=args.walltime)
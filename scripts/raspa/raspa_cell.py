@@ -0,0 +1,125 @@
+"""
+Minimal unit cell replication of frameworks for RASPA simulations.
+
+RASPA needs the perpendicular widths of the simulation box to be at least twice the cut-off radius. The widths
+of a triclinic cell are the distances between its opposite faces (not the cell lengths), so the minimal number of
+unit cells in each direction is ceil(2 * cutoff / width). Only the cell parameters of the cif files are read.
+
+ >>> names, cells = read_cells('cif')
+ >>> unit_cells(cells, cutoff=12)        # -> (n_frameworks, 3) array of unit cell replications
+
+ >>> python raspa_cell.py cif --cutoff 12
+"""
+import os
+import re
+import glob
+import argparse
+import numpy as np
+
+
+CELL_TAGS = ['_cell_length_a', '_cell_length_b', '_cell_length_c',
+             '_cell_angle_alpha', '_cell_angle_beta', '_cell_angle_gamma']
+
+
+def read_cell(cif_file):
+    """
+    Read cell parameters of a cif file (the file is read until all cell parameters are found).
+
+    Returns:
+        - list: [a, b, c, alpha, beta, gamma]
+    """
+    cell = {}
+    with open(cif_file, 'r') as cif:
+        for line in cif:
+            tokens = line.split()
+            if len(tokens) > 1 and tokens[0] in CELL_TAGS:
+                cell[tokens[0]] = float(re.sub(r'\(.*\)', '', tokens[1]))
+                if len(cell) == len(CELL_TAGS):
+                    break
+    missing = [tag for tag in CELL_TAGS if tag not in cell]
+    if len(missing) > 0:
+        raise ValueError('Cell parameters not found in %s: %s' % (cif_file, ', '.join(missing)))
+    return [cell[tag] for tag in CELL_TAGS]
+
+
+def read_cells(cif_dir, names=None):
+    """
+    Read cell parameters of the cif files in a directory.
+
+    Args:
+        - cif_dir (str): Directory of cif files
+        - names (list): Framework names -> <cif_dir>/<name>.cif (default: all cif files in cif_dir)
+
+    Returns:
+        - tuple: framework names (list) and cell parameters ((n_frameworks, 6) ndarray)
+    """
+    if names is None:
+        names = sorted(os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(cif_dir, '*.cif')))
+    cells = np.array([read_cell(os.path.join(cif_dir, '%s.cif' % name)) for name in names], dtype=float)
+    return list(names), cells.reshape(-1, 6)
+
+
+def cell_widths(cells):
+    """
+    Calculate distances between opposite faces of cells from cell parameters (batch version of
+    degradation/lattice.py perpendicular_widths, which takes a lattice matrix).
+
+    Args:
+        - cells (ndarray): (n, 6) cell parameters -> [a, b, c, alpha, beta, gamma]
+
+    Returns:
+        - ndarray: (n, 3) perpendicular widths
+    """
+    cells = np.asarray(cells, dtype=float).reshape(-1, 6)
+    lengths = cells[:, :3]
+    angles = np.radians(cells[:, 3:])
+    cos, sin = np.cos(angles), np.sin(angles)
+    volume = lengths.prod(axis=1) * np.sqrt(1 - (cos ** 2).sum(axis=1) + 2 * cos.prod(axis=1))
+    # Area of the face spanned by the other two cell vectors (b x c, c x a, a x b)
+    areas = lengths[:, [1, 2, 0]] * lengths[:, [2, 0, 1]] * sin
+    return volume[:, None] / areas
+
+
+def unit_cells(cells, cutoff=12, tolerance=1e-6):
+    """
+    Minimal unit cell replication for a cut-off radius (perpendicular widths of the box >= 2 * cutoff).
+
+    Args:
+        - cells (ndarray): (n, 6) cell parameters -> [a, b, c, alpha, beta, gamma]
+        - cutoff (float or ndarray): Cut-off radius (Angstrom), one value or one per cell
+        - tolerance (float): Widths within tolerance of 2 * cutoff are not replicated again
+
+    Returns:
+        - ndarray: (n, 3) number of unit cells in each direction
+    """
+    cutoff = np.asarray(cutoff, dtype=float).reshape(-1, 1)
+    n_cells = np.ceil(2 * cutoff / cell_widths(cells) - tolerance).astype(int)
+    return np.maximum(n_cells, 1)
+
+
+def replication_table(cif_dir, cutoff=12, names=None):
+    """
+    Minimal unit cell replication of the frameworks in a cif directory.
+
+    Returns:
+        - dict: framework name -> [na, nb, nc]
+    """
+    names, cells = read_cells(cif_dir, names)
+    return {name: n.tolist() for name, n in zip(names, unit_cells(cells, cutoff))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minimal unit cell replication of frameworks for RASPA",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cif_dir', type=str, help='Directory of cif files')
+    parser.add_argument('--cutoff', '-c', type=float, default=12, metavar='',
+                        help="Cut-off radius in Angstrom (default: 12)")
+    args = parser.parse_args()
+
+    names, cells = read_cells(args.cif_dir)
+    widths = cell_widths(cells)
+    n_cells = unit_cells(cells, args.cutoff)
+    print('%-30s %8s %8s %8s %7s %7s %7s   %s' % ('framework', 'a', 'b', 'c', 'w_a', 'w_b', 'w_c', 'unit cells'))
+    for name, cell, width, n in zip(names, cells, widths, n_cells):
+        print('%-30s %8.3f %8.3f %8.3f %7.3f %7.3f %7.3f   %i %i %i' % ((name,) + tuple(cell[:3]) + tuple(width) + tuple(n)))
+    print('%i frameworks | %i unit cells in total (cut-off: %.1f A)' % (len(names), n_cells.prod(axis=1).sum(), args.cutoff))
@@ -0,0 +1,192 @@
+"""
+Convergence control of RASPA adsorption simulations.
+
+The loadings printed every PrintEvery cycles are streamed from the output file (only the bytes appended since the
+last check are read). The equilibration cycle of the production loadings and the uncertainty of the equilibrated
+mean are calculated for all components at once with raspa_analysis (MSER, autocorrelation and block averaging,
+the larger error estimate is used). A simulation is converged when the standard error of every component is below
+the target:
+
+    error <= max(target * |mean|, abs_target)
+
+Converged simulations can be stopped early (see raspa_bundle.py --converge) and their results are saved to
+convergence.json (harvested as phase 'converged' by raspa_harvest). Finished simulations that did not converge are
+extended from their restart files. Block statistics need many samples, so print_every should be much smaller than
+cycles (e.g. 100 for 10000 cycles).
+
+ >>> controller = ConvergenceController(target=0.02, unit='mol/kg')
+ >>> controller.check('ipmof-runs/IRMOF-1/NIZ/298K_1bar')['status']
+
+ >>> python raspa_convergence.py ipmof-runs                   # convergence of all simulations
+ >>> python raspa_convergence.py ipmof-runs --extend 10000    # restart unconverged finished simulations
+"""
+import os
+import re
+import glob
+import json
+import shutil
+import argparse
+import numpy as np
+from raspa_harvest import find_outputs, CONVERGENCE
+from raspa_analysis import LoadingTrace, uncertainty
+
+
+RESULTS = CONVERGENCE
+
+
+class ConvergenceController:
+    """
+    Convergence of RASPA adsorption simulations from block statistics of the printed loadings.
+
+    Args:
+        - target (float): Relative standard error target of every component
+        - abs_target (float): Absolute standard error target (for loadings close to zero)
+        - unit (str): Loading unit -> 'mol/uc', 'mol/kg', 'mg/g', 'cc/g' or 'cc/cc'
+        - kind (str): Loading type -> 'absolute' or 'excess'
+        - min_samples (int): Minimum number of equilibrated samples
+        - min_blocks (int): Minimum number of blocks for block averaging
+    """
+    def __init__(self, target=0.02, abs_target=0.01, unit='mol/kg', kind='absolute', min_samples=20, min_blocks=4):
+        self.target = target
+        self.abs_target = abs_target
+        self.unit = unit
+        self.kind = kind
+        self.min_samples = min_samples
+        self.min_blocks = min_blocks
+        self.traces = {}
+
+    def statistics(self, x, cycles):
+        """
+        Equilibrated mean, standard error, equilibration cycle and number of samples of loading series
+        (see raspa_analysis.uncertainty, the larger of the autocorrelation and block averaging errors is used)
+
+        Args:
+            - x (ndarray): (n_components, n_cycles) loadings
+            - cycles (ndarray): cycle of every sample
+        """
+        stats = uncertainty(x, min_blocks=self.min_blocks)
+        results = []
+        for i in range(len(x)):
+            n = int(stats['samples'][i])
+            err = float(max(stats['err'][i], stats['block_err'][i])) if n >= self.min_samples else np.nan
+            converged = n >= self.min_samples and bool(err <= max(self.target * abs(stats['mean'][i]), self.abs_target))
+            results.append(dict(mean=float(stats['mean'][i]), err=err, tau=float(stats['tau'][i]),
+                                equilibration=int(cycles[stats['equilibration'][i]]) if len(cycles) > 0 else 0,
+                                samples=n, converged=converged))
+        return results
+
+    def check(self, sim_dir):
+        """
+        Check convergence of a simulation (outputs are followed, only new lines are read on every check).
+
+        Returns:
+            - dict: status ('converged', 'running', 'unconverged' (finished without converging) or 'no output'),
+                    finished, cycle (last production cycle) and components ({component: mean, err,
+                    equilibration (cycle), samples and converged})
+        """
+        outputs = find_outputs(sim_dir)
+        if len(outputs) == 0:
+            return dict(status='no output', finished=False, cycle=0, components={})
+        data_file = outputs[0]
+        trace = self.traces.setdefault(data_file, LoadingTrace())
+        trace.update(data_file)
+        cycles = np.array(trace.cycles)
+        names, loadings = trace.array(self.unit, self.kind)
+        components = dict(zip(names, self.statistics(loadings, cycles))) if len(cycles) > 0 else {}
+        converged = len(components) > 0 and all(c['converged'] for c in components.values())
+        if converged:
+            status = 'converged'
+        else:
+            status = 'unconverged' if trace.finished else 'running'
+        return dict(status=status, finished=trace.finished, cycle=int(cycles[-1]) if len(cycles) > 0 else 0,
+                    components=components)
+
+    def stop(self, sim_dir):
+        """ Check if a simulation can be stopped (convergence results are saved to <sim_dir>/convergence.json) """
+        result = self.check(sim_dir)
+        if result['status'] == 'converged':
+            result.update(target=self.target, abs_target=self.abs_target, unit=self.unit, kind=self.kind)
+            with open(os.path.join(sim_dir, RESULTS), 'w') as f:
+                json.dump(result, f, indent=1)
+            return True
+        return False
+
+
+def set_input(input_file, values):
+    """ Set keyword values of a RASPA input file (missing keywords are added after the first line) """
+    with open(input_file, 'r') as f:
+        text = f.read()
+    for keyword, value in values.items():
+        pattern = re.compile(r'^(%s[ \t]+)\S.*$' % re.escape(keyword), re.M)
+        if pattern.search(text) is None:
+            first = text.find('\n') + 1
+            text = text[:first] + '%-31s%s\n' % (keyword, value) + text[first:]
+        else:
+            text = pattern.sub(lambda m: '%s%s' % (m.group(1), value), text, count=1)
+    with open(input_file, 'w') as f:
+        f.write(text)
+
+
+def extend_simulation(sim_dir, cycles):
+    """
+    Write restart input of a simulation to run more production cycles.
+
+    The restart files of the last run are copied to RestartInitial, outputs of the last run are kept as
+    <output>.data.<n> (read by LoadingTrace) and simulation.input is changed to continue from the restart file
+    without initialization cycles.
+
+    Args:
+        - sim_dir (str): Simulation directory
+        - cycles (int): Number of additional production cycles
+    """
+    restart_dir = os.path.join(sim_dir, 'Restart', 'System_0')
+    if not os.path.isdir(restart_dir) or len(os.listdir(restart_dir)) == 0:
+        raise FileNotFoundError('Restart files not found: %s' % restart_dir)
+    initial_dir = os.path.join(sim_dir, 'RestartInitial', 'System_0')
+    os.makedirs(initial_dir, exist_ok=True)
+    for restart_file in os.listdir(restart_dir):
+        shutil.copyfile(os.path.join(restart_dir, restart_file), os.path.join(initial_dir, restart_file))
+    for data_file in find_outputs(sim_dir):
+        n_parts = len([p for p in glob.glob('%s.*' % data_file) if p.rsplit('.', 1)[1].isdigit()])
+        os.rename(data_file, '%s.%i' % (data_file, n_parts + 1))
+    set_input(os.path.join(sim_dir, 'simulation.input'),
+              {'NumberOfCycles': cycles, 'NumberOfInitializationCycles': 0, 'RestartFile': 'yes'})
+    if os.path.exists(os.path.join(sim_dir, RESULTS)):
+        os.remove(os.path.join(sim_dir, RESULTS))
+
+
+def print_convergence(results, unit='mol/kg'):
+    """ Print convergence table and number of simulations with each status """
+    counts = {}
+    for sim_dir in sorted(results):
+        r = results[sim_dir]
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+        loadings = ' '.join('%s: %.3f +/- %.3f (eq. %i, n %i)' % (c, v['mean'], v['err'], v['equilibration'], v['samples'])
+                            for c, v in r['components'].items())
+        print('%-50s %-12s %9i  %s' % (sim_dir, r['status'], r['cycle'], loadings))
+    print('%s | loadings in %s' % (' '.join('%s: %i' % (s, n) for s, n in counts.items()), unit))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convergence control of RASPA adsorption simulations",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', type=str, help='Campaign directory (or a simulation directory)')
+    parser.add_argument('--target', '-t', type=float, default=0.02, metavar='',
+                        help="Relative standard error target (default: 0.02)")
+    parser.add_argument('--abs-target', type=float, default=0.01, metavar='',
+                        help="Absolute standard error target (default: 0.01)")
+    parser.add_argument('--unit', '-u', type=str, default='mol/kg', metavar='',
+                        help="Loading unit (default: mol/kg)")
+    parser.add_argument('--extend', '-e', type=int, default=None, metavar='',
+                        help="Write restart inputs with this many cycles for finished unconverged simulations")
+    args = parser.parse_args()
+
+    controller = ConvergenceController(target=args.target, abs_target=args.abs_target, unit=args.unit)
+    sim_dirs = sorted(set(os.path.dirname(os.path.dirname(os.path.dirname(f))) for f in find_outputs(args.run_dir)))
+    results = {os.path.relpath(d, args.run_dir): controller.check(d) for d in sim_dirs}
+    print_convergence(results, unit=args.unit)
+    if args.extend is not None:
+        extend = [d for d in sim_dirs if results[os.path.relpath(d, args.run_dir)]['status'] == 'unconverged']
+        for sim_dir in extend:
+            extend_simulation(sim_dir, args.extend)
+        print('%i simulations extended by %i cycles' % (len(extend), args.extend))
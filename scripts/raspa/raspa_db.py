@@ -0,0 +1,349 @@
+"""
+SQLite database of RASPA screening results.
+
+Tables:
+    - simulations: one row per RASPA output -> campaign, path, framework, conditions, status and energies
+    - loadings: one row per simulation and component -> absolute and excess loadings in all units with errors
+    - warnings: RASPA warning messages of each simulation
+
+Outputs are ingested in bulk (parsed in a process pool, only new or modified outputs) and queries return
+dictionaries of numpy arrays. Rankings are made for each temperature and pressure, simulations of the same framework,
+component and conditions (e.g. in several campaigns) are averaged first.
+
+ >>> db = ResultsDB('screening.db')
+ >>> db.ingest_campaign('ipmof-runs', workers=8)
+ >>> top = db.top_frameworks(n=50, unit='mol/kg', temperature=310)   # top 50 frameworks for each drug and pressure
+ >>> ranking = db.average_loadings(n=50, min_components=5)            # top 50 frameworks averaged over drugs
+ >>> db.unfinished()['path'], db.with_warnings()['warning']
+
+ >>> python raspa_db.py screening.db --ingest ipmof-runs --workers 8
+ >>> python raspa_db.py screening.db --average 50
+ >>> python raspa_db.py screening.db --top 10 --temperature 310 --pressure 1e5
+"""
+import os
+import time
+import sqlite3
+import argparse
+import numpy as np
+from raspa_harvest import COLUMNS, UNIT_KEYS, changed_outputs, parse_outputs, load_results
+
+
+LOADING_COLUMNS = [c for c in COLUMNS if c.startswith('absolute_') or c.startswith('excess_')]
+SIMULATION_COLUMNS = [c for c in COLUMNS if c not in LOADING_COLUMNS + ['component']]
+SQL_TYPES = {str: 'TEXT', bool: 'INTEGER', np.int64: 'INTEGER', float: 'REAL'}
+
+
+def _array(values):
+    """ Column values -> ndarray (int, float with NULL as nan, or str) """
+    types = set(type(v) for v in values)
+    if len(values) == 0 or types <= {float, type(None)} or types == {int, float} or types == {int, float, type(None)}:
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    if types == {int}:
+        return np.array(values, dtype=np.int64)
+    if types == {int, type(None)}:
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    return np.array(['' if v is None else str(v) for v in values], dtype=str)
+
+
+def loading_column(unit='mol/kg', loading='absolute'):
+    """ Loadings table column of a unit -> 'absolute_mol_kg' """
+    if unit not in UNIT_KEYS or loading not in ['absolute', 'excess']:
+        raise ValueError('Unknown loading %s %s (units: %s)' % (loading, unit, ', '.join(UNIT_KEYS)))
+    return '%s_%s' % (loading, UNIT_KEYS[unit])
+
+
+class ResultsDB:
+    """
+    SQLite database of RASPA screening results.
+
+    Args:
+        - db_file (str): Database file (created if it does not exist)
+    """
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.create()
+
+    def create(self):
+        """ Create tables and indexes """
+        simulation_columns = ', '.join('%s %s' % (c, SQL_TYPES[COLUMNS[c]]) for c in SIMULATION_COLUMNS if c != 'path')
+        loading_columns = ', '.join('%s REAL' % c for c in LOADING_COLUMNS)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS simulations (
+                    id INTEGER PRIMARY KEY, campaign TEXT NOT NULL, path TEXT NOT NULL, %s,
+                    UNIQUE (campaign, path));
+                CREATE TABLE IF NOT EXISTS loadings (
+                    simulation_id INTEGER NOT NULL REFERENCES simulations (id) ON DELETE CASCADE,
+                    component TEXT NOT NULL, %s,
+                    PRIMARY KEY (simulation_id, component));
+                CREATE TABLE IF NOT EXISTS warnings (
+                    simulation_id INTEGER NOT NULL REFERENCES simulations (id) ON DELETE CASCADE,
+                    message TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS loadings_component ON loadings (component, absolute_mol_kg);
+                CREATE INDEX IF NOT EXISTS simulations_framework ON simulations (framework, temperature, pressure);
+                CREATE INDEX IF NOT EXISTS simulations_status ON simulations (finished, phase);
+                CREATE INDEX IF NOT EXISTS simulations_warnings ON simulations (n_warnings);
+                CREATE INDEX IF NOT EXISTS warnings_simulation ON warnings (simulation_id);
+                """ % (simulation_columns, loading_columns))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def ingest(self, rows, campaign='', warnings={}):
+        """
+        Add results to the database in a single transaction (existing results of the same outputs are replaced).
+
+        Args:
+            - rows (list): Table rows (see raspa_harvest.result_rows, with path, size and mtime)
+            - campaign (str): Campaign name
+            - warnings (dict): Warning messages of each output -> {path: [messages]}
+
+        Returns:
+            - int: Number of ingested simulations
+        """
+        simulations = {}
+        for row in rows:
+            simulations.setdefault(row['path'], []).append(row)
+        insert_simulation = 'INSERT INTO simulations (campaign, %s) VALUES (?, %s)' % (
+            ', '.join(SIMULATION_COLUMNS), ', '.join('?' * len(SIMULATION_COLUMNS)))
+        insert_loading = 'INSERT INTO loadings (simulation_id, component, %s) VALUES (?, ?, %s)' % (
+            ', '.join(LOADING_COLUMNS), ', '.join('?' * len(LOADING_COLUMNS)))
+        with self.connection:
+            self.connection.executemany('DELETE FROM simulations WHERE campaign = ? AND path = ?',
+                                        [(campaign, path) for path in simulations])
+            for path, path_rows in simulations.items():
+                row = path_rows[0]
+                cursor = self.connection.execute(insert_simulation,
+                                                 [campaign] + [_value(row.get(c)) for c in SIMULATION_COLUMNS])
+                simulation_id = cursor.lastrowid
+                self.connection.executemany(insert_loading, [
+                    [simulation_id, r['component']] + [_value(r.get(c)) for c in LOADING_COLUMNS]
+                    for r in path_rows if r.get('component', '') != ''])
+                self.connection.executemany('INSERT INTO warnings (simulation_id, message) VALUES (?, ?)',
+                                            [(simulation_id, w) for w in warnings.get(path, [])])
+        return len(simulations)
+
+    def manifest(self, campaign=''):
+        """ Outputs in the database -> {path: (size, mtime)} """
+        cursor = self.connection.execute('SELECT path, size, mtime FROM simulations WHERE campaign = ?', (campaign,))
+        return {path: (size, mtime) for path, size, mtime in cursor}
+
+    def ingest_campaign(self, run_dir, campaign=None, workers=4, force=False, verbose=True):
+        """
+        Parse new and modified RASPA outputs of a campaign directory and add them to the database.
+
+        Args:
+            - run_dir (str): Campaign directory (outputs are found with raspa_harvest.find_outputs)
+            - campaign (str): Campaign name (default: name of the campaign directory)
+            - workers (int): Number of parser processes
+            - force (bool): Parse all outputs even if they did not change
+
+        Returns:
+            - int: Number of ingested simulations
+        """
+        start = time.time()
+        campaign = os.path.basename(os.path.abspath(run_dir)) if campaign is None else campaign
+        paths, unchanged = changed_outputs(run_dir, {} if force else self.manifest(campaign))
+        rows, warnings = parse_outputs(run_dir, paths, workers=workers, verbose=verbose)
+        n_ingested = self.ingest(rows, campaign=campaign, warnings=warnings)
+        if verbose:
+            print('%i outputs ingested, %i unchanged (%.2f s) -> %s' % (n_ingested, len(unchanged),
+                                                                        time.time() - start, self.db_file))
+        return n_ingested
+
+    def ingest_store(self, store_file, campaign=''):
+        """ Add results of a raspa_harvest store (.npz) to the database (warning messages are not available) """
+        columns = load_results(store_file)
+        rows = [{c: columns[c][i].item() for c in COLUMNS} for i in range(len(columns['path']))]
+        return self.ingest(rows, campaign=campaign)
+
+    def query(self, sql, parameters=()):
+        """
+        Run an SQL query.
+
+        Returns:
+            - dict: column name -> ndarray
+        """
+        cursor = self.connection.execute(sql, parameters)
+        names = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+        columns = list(zip(*rows)) if len(rows) > 0 else [[] for name in names]
+        return {name: _array(list(values)) for name, values in zip(names, columns)}
+
+    def top_frameworks(self, component=None, n=50, unit='mol/kg', loading='absolute', **conditions):
+        """
+        Frameworks with the highest loading for each component and simulation conditions (finished simulations).
+        Simulations of the same framework, component, temperature and pressure (campaigns, conformers) are averaged
+        before ranking (see condition_loadings).
+
+        Args:
+            - component (str): Component name (None -> all components)
+            - n (int): Number of frameworks for each component, temperature and pressure
+            - unit (str): Loading unit -> 'mol/uc', 'mol/kg', 'mg/g', 'cc/g' or 'cc/cc'
+            - loading (str): 'absolute' or 'excess'
+            - conditions: campaign, temperature and pressure filters
+
+        Returns:
+            - dict: component, temperature, pressure, rank, framework, loading, error and n_simulations arrays
+        """
+        where, parameters = _filters(conditions)
+        if component is not None:
+            where, parameters = where + ' AND l.component = ?', parameters + [component]
+        return _errors(self.query("""
+            SELECT component, temperature, pressure, rank, framework, loading, variance, n_simulations FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY component, temperature, pressure ORDER BY loading DESC) AS rank
+                FROM ({0}))
+            WHERE rank <= ? ORDER BY component, temperature, pressure, rank""".format(
+            condition_loadings(loading_column(unit, loading), where)), parameters + [n]))
+
+    def average_loadings(self, n=None, unit='mol/kg', loading='absolute', components=None, min_components=1,
+                         **conditions):
+        """
+        Rank frameworks by their average loading over components for each temperature and pressure (finished
+        simulations). Every component has the same weight: simulations of the same framework, component and conditions
+        are averaged first (see condition_loadings).
+
+        Args:
+            - n (int): Number of frameworks for each temperature and pressure (None -> all)
+            - unit (str): Loading unit -> 'mol/uc', 'mol/kg', 'mg/g', 'cc/g' or 'cc/cc'
+            - loading (str): 'absolute' or 'excess'
+            - components (list): Components to average (None -> all)
+            - min_components (int): Minimum number of components with results for a framework to be ranked
+            - conditions: campaign, temperature and pressure filters
+
+        Returns:
+            - dict: temperature, pressure, rank, framework, average, minimum, maximum and n_components arrays
+        """
+        where, parameters = _filters(conditions)
+        if components is not None:
+            where += ' AND l.component IN (%s)' % ', '.join('?' * len(components))
+            parameters += list(components)
+        return self.query("""
+            SELECT temperature, pressure, rank, framework, average, minimum, maximum, n_components FROM (
+                SELECT framework, temperature, pressure, AVG(loading) AS average, MIN(loading) AS minimum,
+                       MAX(loading) AS maximum, COUNT(*) AS n_components,
+                       ROW_NUMBER() OVER (PARTITION BY temperature, pressure ORDER BY AVG(loading) DESC) AS rank
+                FROM ({0})
+                GROUP BY framework, temperature, pressure HAVING n_components >= ?)
+            WHERE ? IS NULL OR rank <= ? ORDER BY temperature, pressure, rank""".format(
+            condition_loadings(loading_column(unit, loading), where)), parameters + [min_components, n, n])
+
+    def unfinished(self, **conditions):
+        """ Simulations that are not finished -> campaign, path, framework, phase and cycle arrays """
+        where, parameters = _filters(conditions)
+        return self.query("""
+            SELECT campaign, path, framework, phase, cycle FROM simulations s
+            WHERE s.finished = 0 {0} ORDER BY campaign, path""".format(where), parameters)
+
+    def with_warnings(self, **conditions):
+        """ Simulations with warnings -> campaign, path, framework, n_warnings and warning (first message) arrays """
+        where, parameters = _filters(conditions)
+        return self.query("""
+            SELECT campaign, path, framework, n_warnings,
+                   (SELECT message FROM warnings w WHERE w.simulation_id = s.id LIMIT 1) AS warning
+            FROM simulations s WHERE s.n_warnings > 0 {0} ORDER BY campaign, path""".format(where), parameters)
+
+
+def _value(value):
+    """ Row value -> SQLite value (nan -> NULL) """
+    if isinstance(value, float) and value != value:
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def condition_loadings(column, where=''):
+    """
+    SQL subquery with one loading per framework, component, temperature and pressure (finished simulations): mean
+    loading over simulations (campaigns, conformers...), variance of the mean from the errors and n_simulations
+
+    Args:
+        - column (str): Loadings column (see loading_column)
+        - where (str): Additional SQL conditions on simulations s and loadings l (see _filters)
+    """
+    return """
+        SELECT s.framework, l.component, s.temperature, s.pressure, AVG(l.{0}) AS loading,
+               SUM(l.{0}_err * l.{0}_err) / (COUNT(*) * COUNT(*)) AS variance, COUNT(*) AS n_simulations
+        FROM loadings l JOIN simulations s ON s.id = l.simulation_id
+        WHERE s.finished = 1 AND l.{0} IS NOT NULL {1}
+        GROUP BY s.framework, l.component, s.temperature, s.pressure""".format(column, where)
+
+
+def _errors(table):
+    """ Replace variance column of a query result with error (standard error) """
+    return {('error' if c == 'variance' else c): (np.sqrt(v) if c == 'variance' else v) for c, v in table.items()}
+
+
+def _filters(conditions):
+    """ campaign, temperature and pressure filters -> SQL condition and parameters """
+    where, parameters = '', []
+    for key in ['campaign', 'temperature', 'pressure']:
+        if conditions.get(key) is not None:
+            where += ' AND s.%s = ?' % key
+            parameters.append(conditions[key])
+    unknown = set(conditions) - {'campaign', 'temperature', 'pressure'}
+    if len(unknown) > 0:
+        raise ValueError('Unknown conditions: %s' % ', '.join(unknown))
+    return where, parameters
+
+
+def print_table(table, n_rows=None):
+    """ Print query results """
+    names = list(table)
+    print('  '.join('%-14s' % name for name in names))
+    for i in range(len(table[names[0]]) if n_rows is None else min(n_rows, len(table[names[0]]))):
+        print('  '.join('%-14.4g' % table[name][i] if table[name].dtype.kind == 'f' else '%-14s' % table[name][i]
+                        for name in names))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite database of RASPA screening results",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db', type=str, help='Database file')
+    parser.add_argument('--ingest', '-i', nargs='+', type=str, default=[], metavar='',
+                        help="Campaign directories or raspa_harvest stores (.npz) to add to the database")
+    parser.add_argument('--campaign', '-c', type=str, default=None, metavar='',
+                        help="Campaign name for ingestion and queries (default: directory name / all campaigns)")
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(), metavar='',
+                        help="Number of parser processes (default: number of cpus)")
+    parser.add_argument('--top', '-t', type=int, default=None, metavar='',
+                        help="Print top N frameworks for each component")
+    parser.add_argument('--average', '-a', type=int, default=None, metavar='',
+                        help="Print top N frameworks by average loading over components")
+    parser.add_argument('--unit', '-u', type=str, default='mol/kg', metavar='',
+                        help="Loading unit for rankings (default: mol/kg)")
+    parser.add_argument('--temperature', '-T', type=float, default=None, metavar='',
+                        help="Temperature of rankings (default: all, ranked for each temperature)")
+    parser.add_argument('--pressure', '-P', type=float, default=None, metavar='',
+                        help="Pressure of rankings (default: all, ranked for each pressure)")
+    parser.add_argument('--unfinished', action='store_true', default=False, help="Print unfinished simulations")
+    parser.add_argument('--warnings', action='store_true', default=False, help="Print simulations with warnings")
+    args = parser.parse_args()
+
+    with ResultsDB(args.db) as db:
+        for path in args.ingest:
+            if path.endswith('.npz'):
+                name = os.path.splitext(os.path.basename(path))[0]
+                campaign = name[:-len('_results')] if name.endswith('_results') else name
+                campaign = campaign if args.campaign is None else args.campaign
+                print('%i simulations ingested from %s' % (db.ingest_store(path, campaign=campaign), path))
+            else:
+                db.ingest_campaign(path, campaign=args.campaign, workers=args.workers)
+        if args.top is not None:
+            print_table(db.top_frameworks(n=args.top, unit=args.unit, campaign=args.campaign,
+                                          temperature=args.temperature, pressure=args.pressure))
+        if args.average is not None:
+            print_table(db.average_loadings(n=args.average, unit=args.unit, campaign=args.campaign,
+                                            temperature=args.temperature, pressure=args.pressure))
+        if args.unfinished:
+            print_table(db.unfinished(campaign=args.campaign))
+        if args.warnings:
+            print_table(db.with_warnings(campaign=args.campaign))
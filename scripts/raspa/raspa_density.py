@@ -0,0 +1,290 @@
+"""
+Density maps of adsorbed molecules from RASPA component movies.
+
+Component movie frames are streamed and the positions of atoms or molecule centers of mass are wrapped into the
+unit cell with the (triclinic) lattice of the simulation box. A 3D occupancy histogram on a grid of fractional
+coordinates is accumulated with one bincount per frame and can be exported as a Gaussian cube file (number
+density in molecules or atoms / Angstrom^3, averaged over frames and unit cells).
+
+Movies are read in chunks of frames (byte ranges starting at MODEL records) that are binned in parallel with
+workers > 1, so memory is bounded by the chunk size and not by the length of the movie.
+
+ >>> density = density_map('Movie_IRMOF-1_2.2.2_298.000000_100000.000000_component_NIZ_0.pdb', grid=[50, 50, 50],
+ ...                       mode='com', molecule_atoms=17)
+ >>> write_cube('NIZ.cube', density)
+
+ >>> python raspa_density.py Movie_..._component_NIZ_0.pdb --molecule NIZ.def --cube NIZ.cube --workers 4
+"""
+import os
+import re
+import sys
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from raspa_movies import read_frames, iter_frames, cell_parameters
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'degradation'))
+from lattice import cell_vectors
+
+
+ELEMENTS = ['H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne', 'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar',
+            'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr',
+            'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn', 'Sb', 'Te', 'I']
+MASSES = {'H': 1.008, 'C': 12.011, 'N': 14.007, 'O': 15.999, 'F': 18.998, 'P': 30.974, 'S': 32.06, 'Cl': 35.45,
+          'Br': 79.904, 'I': 126.904}
+BOHR = 0.52917721067
+CHUNK_SIZE = 1 << 26
+
+
+def molecule_atoms(def_file):
+    """ Number of atoms of a RASPA molecule definition file (line after '# Number of Atoms') """
+    with open(def_file, 'r') as molecule:
+        lines = molecule.readlines()
+    for i, line in enumerate(lines):
+        if line.strip().lower() == '# number of atoms':
+            return int(lines[i + 1].split()[0])
+    raise ValueError('Number of atoms not found in %s' % def_file)
+
+
+def movie_unitcell(movie_file):
+    """ Unit cell replication from RASPA movie file name -> Movie_<framework>_<a>.<b>.<c>_<T>_<P>_... ([1, 1, 1]) """
+    match = re.search(r'_(\d+)\.(\d+)\.(\d+)_', os.path.basename(movie_file))
+    return [int(i) for i in match.groups()] if match is not None else [1, 1, 1]
+
+
+def frame_chunks(movie_file, n_chunks, block_size=1 << 24):
+    """ Split a movie into n_chunks byte ranges that start at MODEL records -> [(start, end), ...] """
+    starts = []
+    with open(movie_file, 'rb') as movie:
+        position, previous = 0, b'\n'
+        for block in iter(lambda: movie.read(block_size), b''):
+            text = previous + block
+            index = text.find(b'\nMODEL')
+            while index >= 0:
+                starts.append(position - len(previous) + index + 1)
+                index = text.find(b'\nMODEL', index + 1)
+            position += len(block)
+            previous = text[-6:]
+    size = position
+    if len(starts) == 0 or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = [starts[int(i)] for i in np.linspace(0, len(starts), n_chunks, endpoint=False)] + [size]
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _coordinates(atoms):
+    """ Cartesian coordinates of ATOM/HETATM lines -> (n_atoms, 3) ndarray """
+    return np.array([(line[30:38], line[38:46], line[46:54]) for line in atoms], dtype=float).reshape(-1, 3)
+
+
+def _fixed_point(fields):
+    """ Parse (..., 8) byte fields of %8.3f numbers (coordinates of pdb files) -> float ndarray """
+    codes = fields.view(np.uint8)
+    if np.all(codes[..., 4] == ord('.')):
+        digits = codes - ord('0')
+        values = np.where(digits < 10, digits, 0) @ np.array([1e3, 1e2, 1e1, 1, 0, 1e-1, 1e-2, 1e-3])
+        return np.where((codes == ord('-')).any(axis=-1), -values, values)
+    return np.ascontiguousarray(fields).view('S8')[..., 0].astype(float)
+
+
+def _frame_atoms(block, n_lines=None):
+    """
+    Coordinates and first n_lines ATOM/HETATM lines of a frame (bytes) -> (n_atoms, 3) ndarray, list of str.
+    Atom lines of RASPA movies have the same width, so the block of atom lines is parsed as one fixed width array
+    (other frames are parsed line by line).
+    """
+    n_atoms = block.count(b'\nATOM  ') + block.count(b'\nHETATM') + block.startswith((b'ATOM  ', b'HETATM'))
+    starts = [i for i in (block.find(b'ATOM  '), block.find(b'HETATM')) if i >= 0]
+    if n_atoms > 0 and len(starts) > 0:
+        start = min(starts)
+        width = block.find(b'\n', start) + 1 - start
+        rows = np.frombuffer(block, dtype='S1', offset=start, count=n_atoms * width) \
+            if width > 54 and start + n_atoms * width <= len(block) else np.zeros(0, dtype='S1')
+        rows = rows.reshape(-1, width)
+        if len(rows) == n_atoms and np.all(rows[:, -1] == b'\n') and \
+                np.all((rows[:, :4] == np.frombuffer(b'ATOM', 'S1')).all(axis=1) |
+                       (rows[:, :4] == np.frombuffer(b'HETA', 'S1')).all(axis=1)):
+            coordinates = _fixed_point(rows[:, 30:54].reshape(-1, 3, 8))
+            n_lines = n_atoms if n_lines is None else min(n_lines, n_atoms)
+            return coordinates, block[start:start + n_lines * width].decode().splitlines(True)
+    frame = next(read_frames(block.decode(errors='replace').splitlines(True)), dict(atoms=[]))
+    return _coordinates(frame['atoms']), frame['atoms'][:n_lines]
+
+
+def _elements(atoms):
+    """ Element symbols of ATOM/HETATM lines """
+    return [line[76:78].strip() or line[12:16].strip().rstrip('0123456789') for line in atoms]
+
+
+def wrap_positions(coordinates, box, unitcell, molecule_atoms=None, masses=None):
+    """
+    Fractional coordinates of positions in the unit cell.
+
+    Args:
+        - coordinates (ndarray): (n_atoms, 3) cartesian coordinates
+        - box (ndarray): (3, 3) simulation box vectors (rows)
+        - unitcell (list): Unit cell replication of the box
+        - molecule_atoms (int): Number of atoms of every molecule -> centers of mass of molecules (None -> atoms)
+        - masses (ndarray): Atomic masses of a molecule for centers of mass (None -> geometric centers)
+
+    Returns:
+        - ndarray: (n_positions, 3) fractional coordinates in [0, 1) of the unit cell
+    """
+    fractional = coordinates @ np.linalg.inv(box)
+    if molecule_atoms is not None and len(fractional) > 0:
+        if len(fractional) % molecule_atoms != 0:
+            raise ValueError('%i atoms are not a multiple of %i atoms per molecule' % (len(fractional), molecule_atoms))
+        molecules = fractional.reshape(-1, molecule_atoms, 3)
+        # Atoms of molecules crossing the box boundary are unwrapped to the image closest to the first atom
+        shift = molecules - molecules[:, :1]
+        molecules = molecules - np.round(shift)
+        if masses is None:
+            fractional = molecules.mean(axis=1)
+        else:
+            weights = np.asarray(masses, dtype=float).reshape(-1, molecule_atoms, 1)[:1]
+            fractional = (molecules * weights).sum(axis=1) / weights.sum()
+    return np.mod(fractional * np.asarray(unitcell), 1.0)
+
+
+def _bin_chunk(movie_file, start, end, grid, unitcell, mode, molecule_atoms):
+    """ Occupancy histogram of the frames in a byte range of a movie -> (counts, n_frames, n_positions, cell) """
+    grid = np.asarray(grid)
+    counts = np.zeros(grid.prod(), dtype=np.int64)
+    n_frames, n_positions, cell = 0, 0, None
+    with open(movie_file, 'rb') as movie:
+        movie.seek(start)
+        data = movie.read(end - start)
+    box = None
+    for block in data.split(b'ENDMDL'):
+        index = block.find(b'CRYST1')
+        if index >= 0 and block[index:block.find(b'\n', index)].decode() != cell:
+            cell = block[index:block.find(b'\n', index)].decode()
+            box = np.array(cell_vectors(cell_parameters(cell)))
+        coordinates, atoms = _frame_atoms(block, molecule_atoms if mode == 'com' else 0)
+        if len(coordinates) == 0:
+            # Frames without molecules are counted for the average density
+            n_frames += index >= 0 or b'MODEL' in block
+            continue
+        n_frames += 1
+        if box is None:
+            raise ValueError('CRYST1 record not found in %s' % movie_file)
+        if mode == 'com':
+            # All molecules of a component movie are the same, masses are read from the first molecule
+            masses = [MASSES.get(e, 12.0) for e in _elements(atoms)]
+            positions = wrap_positions(coordinates, box, unitcell, molecule_atoms, masses)
+        else:
+            positions = wrap_positions(coordinates, box, unitcell)
+        bins = np.minimum((positions * grid).astype(np.int64), grid - 1)
+        counts += np.bincount(np.ravel_multi_index(bins.T, grid), minlength=len(counts))
+        n_positions += len(positions)
+    return counts, n_frames, n_positions, cell
+
+
+def density_map(movie_file, grid=[50, 50, 50], unitcell=None, mode='com', molecule_atoms=None, workers=1):
+    """
+    Density map of a component movie in the unit cell.
+
+    Args:
+        - movie_file (str): RASPA component movie (pdb with MODEL records and CRYST1 of the simulation box)
+        - grid (list): Number of grid points along the unit cell vectors
+        - unitcell (list): Unit cell replication of the box (default: from movie file name)
+        - mode (str): 'com' -> molecule centers of mass, 'atoms' -> all atoms
+        - molecule_atoms (int): Number of atoms of every molecule (required for mode='com')
+        - workers (int): Number of processes binning chunks of frames in parallel
+
+    Returns:
+        - dict: counts (grid histogram), density (number / Angstrom^3 per unit cell, averaged over frames), grid,
+                unitcell, cell (unit cell vectors), frames and positions (per frame on average)
+    """
+    if mode == 'com' and molecule_atoms is None:
+        raise ValueError('Number of atoms of the molecule is needed for centers of mass (or use mode="atoms")')
+    unitcell = movie_unitcell(movie_file) if unitcell is None else unitcell
+    # Chunks of at most ~CHUNK_SIZE bytes are read at once (memory is bounded for long movies)
+    chunks = frame_chunks(movie_file, max(workers, -(-os.path.getsize(movie_file) // CHUNK_SIZE)))
+    args = [(movie_file, start, end, grid, unitcell, mode, molecule_atoms) for start, end in chunks]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_bin_chunk, *zip(*args)))
+    else:
+        results = [_bin_chunk(*a) for a in args]
+    counts = sum(r[0] for r in results).reshape(grid)
+    n_frames = sum(r[1] for r in results)
+    n_positions = sum(r[2] for r in results)
+    cell = next(r[3] for r in results if r[3] is not None)
+    cell = np.array(cell_vectors(cell_parameters(cell))) / np.asarray(unitcell)[:, None]
+    voxel = abs(np.linalg.det(cell)) / np.prod(grid)
+    density = counts / (max(n_frames, 1) * np.prod(unitcell) * voxel)
+    return dict(counts=counts, density=density, grid=list(grid), unitcell=list(unitcell), cell=cell, frames=n_frames,
+                positions=n_positions / max(n_frames, 1))
+
+
+def framework_atoms(framework_file, unitcell):
+    """ Framework atoms in the first unit cell of a framework pdb -> element symbols, (n_atoms, 3) coordinates """
+    frame = next(iter_frames(framework_file))
+    box = np.array(cell_vectors(cell_parameters(frame['cell'])))
+    coordinates = _coordinates(frame['atoms'])
+    fractional = coordinates @ np.linalg.inv(box) * np.asarray(unitcell)
+    inside = np.all((fractional >= 0) & (fractional < 1), axis=1)
+    elements = _elements(frame['atoms'])
+    return [e for e, i in zip(elements, inside) if i], coordinates[inside]
+
+
+def write_cube(cube_file, density, atoms=None, comment='RASPA density map'):
+    """
+    Write density map to a Gaussian cube file (lengths in Bohr, density in number / Angstrom^3).
+
+    Args:
+        - cube_file (str): Cube file
+        - density (dict): Density map (see density_map)
+        - atoms (tuple): Element symbols and cartesian coordinates of framework atoms (see framework_atoms)
+    """
+    elements, coordinates = atoms if atoms is not None else ([], np.zeros((0, 3)))
+    grid, values = density['grid'], density['density']
+    voxel = density['cell'] / np.asarray(grid)[:, None] / BOHR
+    with open(cube_file, 'w') as cube:
+        cube.write('%s\n%i frames, %.2f positions per frame, number density [1/A^3]\n' % (
+            comment, density['frames'], density['positions']))
+        cube.write('%5i %12.6f %12.6f %12.6f\n' % (len(elements), 0, 0, 0))
+        for n, v in zip(grid, voxel):
+            cube.write('%5i %12.6f %12.6f %12.6f\n' % (n, v[0], v[1], v[2]))
+        for e, xyz in zip(elements, coordinates / BOHR):
+            z = ELEMENTS.index(e) + 1 if e in ELEMENTS else 0
+            cube.write('%5i %12.6f %12.6f %12.6f %12.6f\n' % (z, z, xyz[0], xyz[1], xyz[2]))
+        # Values are written along z for every (x, y), 6 values per line
+        rows = values.reshape(-1, grid[2])
+        full, rest = divmod(grid[2], 6)
+        line_format = ' %12.5E' * 6 + '\n'
+        row_format = line_format * full + (' %12.5E' * rest + '\n' if rest > 0 else '')
+        for i in range(0, len(rows), 1024):
+            cube.write(''.join(row_format % tuple(row) for row in rows[i:i + 1024]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Density maps of adsorbed molecules from RASPA component movies",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('movie', type=str, help='RASPA component movie (pdb)')
+    parser.add_argument('--grid', '-g', type=int, nargs=3, default=[50, 50, 50], metavar='',
+                        help="Number of grid points along the unit cell vectors (default: 50 50 50)")
+    parser.add_argument('--unitcell', '-u', type=int, nargs=3, default=None, metavar='',
+                        help="Unit cell replication of the simulation box (default: from movie file name)")
+    parser.add_argument('--mode', '-m', type=str, default='com', choices=['com', 'atoms'],
+                        help="Bin molecule centers of mass or all atoms (default: com)")
+    parser.add_argument('--molecule', type=str, default=None, metavar='',
+                        help="RASPA molecule definition (.def) for the number of atoms of the molecule")
+    parser.add_argument('--atoms', '-n', type=int, default=None, metavar='',
+                        help="Number of atoms of the molecule (instead of --molecule)")
+    parser.add_argument('--framework', '-f', type=str, default=None, metavar='',
+                        help="Framework pdb, atoms in the first unit cell are written to the cube file")
+    parser.add_argument('--cube', '-c', type=str, default='density.cube', metavar='',
+                        help="Cube file (default: density.cube)")
+    parser.add_argument('--workers', '-w', type=int, default=1, metavar='',
+                        help="Number of processes (default: 1)")
+    args = parser.parse_args()
+
+    n_atoms = molecule_atoms(args.molecule) if args.molecule is not None else args.atoms
+    density = density_map(args.movie, grid=args.grid, unitcell=args.unitcell, mode=args.mode, molecule_atoms=n_atoms,
+                          workers=args.workers)
+    atoms = framework_atoms(args.framework, density['unitcell']) if args.framework is not None else None
+    write_cube(args.cube, density, atoms=atoms)
+    print('%i frames | %.2f %s per frame | max. density: %.4f 1/A^3 -> %s' % (
+        density['frames'], density['positions'], 'molecules' if args.mode == 'com' else 'atoms',
+        density['density'].max(), args.cube))
@@ -0,0 +1,264 @@
+"""
+Harvest RASPA results of a simulation campaign into a tabular store.
+
+Output files are parsed in a process pool and saved as columns (one row per output file and component) in a numpy
+.npz store. The store keeps the size and modification time of every output file so a rerun only parses outputs
+that changed since the last harvest. Simulations stopped early by the convergence controller (<sim_dir>/convergence.json,
+see raspa_convergence) are stored with phase 'converged', finished=True and the loadings and errors of the controller.
+
+ >>> results = harvest('ipmof-runs', 'ipmof-runs_results.npz', workers=8)
+ >>> results = load_results('ipmof-runs_results.npz')
+ >>> results['absolute_mol_kg'][results['finished']]
+"""
+import os
+import glob
+import json
+import time
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from raspa_output import parse_output, UNITS
+
+
+PHASES = ['finished', 'converged', 'production', 'initialization', 'started', 'error']
+CONVERGENCE = 'convergence.json'
+ENERGY_KEYS = ['%s_%s' % (e, t) for e in ['host_host', 'ads_ads', 'host_ads'] for t in ['avg', 'vdw', 'cou']]
+UNIT_KEYS = {u: u.replace('/', '_') for u in UNITS}
+# Column name -> dtype (strings are saved as unicode arrays so the store loads without pickle)
+COLUMNS = dict([('path', str), ('size', np.int64), ('mtime', np.int64), ('framework', str), ('component', str),
+                ('phase', str), ('finished', bool), ('cycle', np.int64), ('init_cycle', np.int64),
+                ('n_warnings', np.int64), ('unitcell', str), ('temperature', float), ('pressure', float)] +
+               [('%s_%s%s' % (kind, UNIT_KEYS[u], err), float)
+                for kind in ['absolute', 'excess'] for u in UNITS for err in ['', '_err']] +
+               [('%s%s' % (key, err), float) for key in ENERGY_KEYS for err in ['', '_err']])
+
+
+def find_outputs(run_dir):
+    """ Find RASPA output files (<simulation>/Output/System_0/*.data) in a campaign directory """
+    return sorted(glob.glob(os.path.join(run_dir, '**', 'Output', 'System_0', '*.data'), recursive=True))
+
+
+def convergence_file(data_file):
+    """ Convergence results of the simulation of an output file -> <sim_dir>/convergence.json """
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(data_file)))), CONVERGENCE)
+
+
+def output_stat(data_file):
+    """ Size and modification time (ns) of an output file (the later of the output and its convergence results) """
+    stat = os.stat(data_file)
+    try:
+        mtime = max(stat.st_mtime_ns, os.stat(convergence_file(data_file)).st_mtime_ns)
+    except OSError:
+        mtime = stat.st_mtime_ns
+    return stat.st_size, mtime
+
+
+def read_convergence(data_file):
+    """ Convergence results of a simulation stopped by the convergence controller (None if not converged) """
+    try:
+        with open(convergence_file(data_file), 'r') as f:
+            convergence = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return convergence if convergence.get('status') == 'converged' else None
+
+
+def _converged_loadings(row, convergence):
+    """
+    Set loadings of a row to the mean and error of the convergence controller. Other units are converted with the
+    ratio of the loadings of the last cycle, the other loading type is not known (nan).
+    """
+    components = convergence['components']
+    if row['component'] not in components:
+        return
+    kind, unit = convergence.get('kind', 'absolute'), convergence.get('unit', 'mol/kg')
+    mean, err = components[row['component']]['mean'], components[row['component']]['err']
+    last = row['%s_%s' % (kind, UNIT_KEYS[unit])]
+    for k in ['absolute', 'excess']:
+        for u in UNITS:
+            factor = row['%s_%s' % (k, UNIT_KEYS[u])] / last if k == kind and last != 0 else np.nan
+            row['%s_%s' % (k, UNIT_KEYS[u])] = mean if u == unit and k == kind else mean * factor
+            row['%s_%s_err' % (k, UNIT_KEYS[u])] = err if u == unit and k == kind else err * factor
+
+
+def result_rows(results, convergence=None):
+    """
+    Convert parsed RASPA results (see raspa_output.parse_output) to table rows (one row per component).
+
+    Args:
+        - results (dict): Parsed RASPA results
+        - convergence (dict): Convergence results of a simulation stopped early (see read_convergence) -> phase
+                              'converged', finished and loadings of the convergence controller
+
+    Returns:
+        - list: row dicts with COLUMNS keys (except path, size and mtime)
+    """
+    converged = convergence is not None and not results['finished']
+    conditions = results['conditions']
+    row = dict(framework=results['framework'], phase='converged' if converged else results['phase'],
+               finished=results['finished'] or converged,
+               cycle=results['cycle'], init_cycle=results['init_cycle'], n_warnings=len(results['warnings']),
+               unitcell='' if conditions['unitcell'] is None else '.'.join(str(i) for i in conditions['unitcell']),
+               temperature=np.nan if conditions['temperature'] is None else conditions['temperature'],
+               pressure=np.nan if conditions['pressure'] is None else conditions['pressure'])
+    for key in ENERGY_KEYS:
+        row[key] = results['energy'].get(key, np.nan)
+        row['%s_err' % key] = results['energy_err'].get(key, np.nan)
+    components = list(results['components'])
+    components += [c for c in results['loadings']['absolute'] if c not in components]
+    rows = []
+    for component in components if len(components) > 0 else ['']:
+        component_row = dict(row, component=component)
+        for kind in ['absolute', 'excess']:
+            loadings = results['loadings'][kind].get(component, {})
+            errors = results['errors'][kind].get(component, {})
+            for u in UNITS:
+                component_row['%s_%s' % (kind, UNIT_KEYS[u])] = loadings.get(u, np.nan)
+                component_row['%s_%s_err' % (kind, UNIT_KEYS[u])] = errors.get(u, np.nan)
+        if converged:
+            _converged_loadings(component_row, convergence)
+        rows.append(component_row)
+    return rows
+
+
+def _harvest_file(data_file, path):
+    """ Parse an output file in a worker process -> (path, size, mtime, rows, warnings) """
+    size, mtime = output_stat(data_file)
+    try:
+        results = parse_output(data_file)
+        rows, warnings = result_rows(results, read_convergence(data_file)), [w.strip() for w in results['warnings']]
+    except Exception:
+        rows, warnings = [dict(framework='', component='', phase='error', finished=False)], []
+    return path, size, mtime, rows, warnings
+
+
+def changed_outputs(run_dir, manifest={}):
+    """
+    Find new and modified RASPA outputs of a campaign.
+
+    Args:
+        - run_dir (str): Campaign directory (outputs are found with find_outputs)
+        - manifest (dict): Outputs read before -> {path relative to run_dir: (size, mtime in ns)} (see output_stat)
+
+    Returns:
+        - tuple: paths of new or modified outputs (list) and unchanged outputs (set)
+    """
+    paths, unchanged = [], set()
+    for data_file in find_outputs(run_dir):
+        path = os.path.relpath(data_file, run_dir)
+        if manifest.get(path) == output_stat(data_file):
+            unchanged.add(path)
+        else:
+            paths.append(path)
+    return paths, unchanged
+
+
+def parse_outputs(run_dir, paths, workers=4, counts=None, verbose=True):
+    """
+    Parse RASPA outputs in a process pool.
+
+    Args:
+        - run_dir (str): Campaign directory
+        - paths (list): Output paths relative to run_dir
+        - workers (int): Number of parser processes
+        - counts (dict): Number of outputs in each phase, updated while parsing (default: start from zero)
+        - verbose (bool): Print progress and number of outputs in each phase
+
+    Returns:
+        - tuple: table rows (see result_rows, with path, size and mtime) and warnings ({path: [messages]})
+    """
+    counts = {p: 0 for p in PHASES} if counts is None else counts
+    rows, warnings = [], {}
+    n_files = len(paths)
+    if n_files == 0:
+        return rows, warnings
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_harvest_file, os.path.join(run_dir, p), p) for p in paths]
+        for i, future in enumerate(as_completed(futures)):
+            path, size, mtime, file_rows, warnings[path] = future.result()
+            for row in file_rows:
+                row.update(path=path, size=size, mtime=mtime)
+            counts[file_rows[0]['phase']] += 1
+            rows += file_rows
+            if verbose:
+                print('\rReading results... %3i / %3i | %s' % (i + 1, n_files, ' '.join(
+                    '%s: %i' % (p, n) for p, n in counts.items() if n > 0)), end='')
+    print('') if verbose else None
+    return rows, warnings
+
+
+def _empty_columns():
+    return {c: np.zeros(0, dtype=dtype) for c, dtype in COLUMNS.items()}
+
+
+def _rows_to_columns(rows):
+    """ List of row dicts -> dict of column arrays (missing values: nan, 0, False or '') """
+    columns = {}
+    for c, dtype in COLUMNS.items():
+        default = np.nan if dtype is float else ('' if dtype is str else 0)
+        columns[c] = np.array([r.get(c, default) for r in rows], dtype=dtype)
+    return columns
+
+
+def load_results(store_file):
+    """
+    Load a results store.
+
+    Returns:
+        - dict: column name -> ndarray (empty columns if the store does not exist)
+    """
+    if not os.path.exists(store_file):
+        return _empty_columns()
+    with np.load(store_file) as store:
+        columns = {c: store[c] for c in store.files}
+    for c in COLUMNS:
+        if c not in columns:
+            columns[c] = np.zeros(len(columns['path']), dtype=COLUMNS[c])
+    return columns
+
+
+def save_results(store_file, columns):
+    """ Save results store (written to a temporary file first so readers never see a partial store) """
+    directory = os.path.dirname(os.path.abspath(store_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.npz')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **columns)
+    os.replace(tmp_path, store_file)
+
+
+def harvest(run_dir, store_file, workers=4, force=False, verbose=True):
+    """
+    Parse new and modified RASPA outputs of a campaign and update the results store.
+
+    Args:
+        - run_dir (str): Campaign directory (outputs are found with find_outputs)
+        - store_file (str): Results store (.npz)
+        - workers (int): Number of parser processes
+        - force (bool): Parse all outputs even if they did not change
+        - verbose (bool): Print progress and number of simulations in each phase while parsing
+
+    Returns:
+        - dict: column name -> ndarray for all outputs found in run_dir
+    """
+    start = time.time()
+    previous = _empty_columns() if force else load_results(store_file)
+    manifest = {p: (s, m) for p, s, m in zip(previous['path'].tolist(), previous['size'].tolist(),
+                                             previous['mtime'].tolist())}
+    paths, keep = changed_outputs(run_dir, manifest)
+
+    # Number of outputs in each phase
+    counts = {p: 0 for p in PHASES}
+    kept = np.isin(previous['path'], list(keep))
+    _, first = np.unique(previous['path'][kept], return_index=True)
+    for phase in previous['phase'][kept][first].tolist():
+        counts[phase] = counts.get(phase, 0) + 1
+
+    rows, _ = parse_outputs(run_dir, paths, workers=workers, counts=counts, verbose=verbose)
+    new = _rows_to_columns(rows)
+    columns = {c: np.concatenate([previous[c][kept], new[c]]) for c in COLUMNS}
+    order = np.argsort(columns['path'], kind='stable')
+    columns = {c: v[order] for c, v in columns.items()}
+    save_results(store_file, columns)
+    if verbose:
+        print('%i outputs parsed, %i unchanged (%.2f s) -> %s' % (len(paths), len(keep), time.time() - start, store_file))
+    return columns
@@ -5,6 +5,106 @@ Generates RASPA input file for given cif file and simulation parameters to calcu
 # Author: Kutay B. Sezginel
 # Date: July 2017
 
+INPUT_TEMPLATE = (
+    "SimulationType                 MonteCarlo\n" +
+    "NumberOfCycles                 %(cycles)s\n" +
+    "NumberOfInitializationCycles   %(init_cycles)s\n" +
+    "PrintEvery                     %(print_every)s\n" +
+    "RestartFile                    %(restart)s\n" +
+    "\n" +
+    "Forcefield                     %(forcefield)s\n" +
+    "CutOff                         %(cutoff)s\n" +
+    "\n" +
+    "Framework                      0\n" +
+    "FrameworkName                  %(framework)s\n" +
+    "UnitCells                      %(unitcell)s\n" +
+    "ExternalTemperature            %(temperature)s\n" +
+    "ExternalPressure               %(pressure)s\n" +
+    "\n" +
+    "%(charge)s%(void_fraction)s%(movies)s%(components)s"
+)
+
+COMPONENT_TEMPLATE = (
+    "\n" +
+    "Component %-4iMoleculeName               %s\n" +
+    "              MoleculeDefinition         %s\n" +
+    "              TranslationProbability     %.2f\n" +
+    "              RotationProbability        %.2f\n" +
+    "              ReinsertionProbability     %.2f\n" +
+    "              SwapProbability            %.2f\n" +
+    "              CreateNumberOfMolecules    %i\n"
+)
+
+
+def is_yes(value):
+    """ Config switch to bool (YAML reads yes/no as True/False, quoted 'yes'/'no' stay strings) """
+    if isinstance(value, str):
+        return value.lower() in ['yes', 'true', 'on']
+    return value is True
+
+
+def _components(config):
+    text = ''
+    for comp_idx, component in enumerate(config['components']):
+        # TODO: Handle mixture adsorption!!!!!!!!!!!!!!!!!!
+        text += COMPONENT_TEMPLATE % (comp_idx, component['name'], component['definition'],
+                                      component['p_translation'], component['p_rotation'],
+                                      component['p_reinsertion'], component['p_swap'], component['create_molecules'])
+    return text
+
+
+# Input field -> function of the config returning the formatted field
+FIELDS = {
+    'cycles': lambda config: '%s' % config['cycles'],
+    'init_cycles': lambda config: '%s' % config['init_cycles'],
+    'print_every': lambda config: '%i' % config['print_every'],
+    'restart': lambda config: 'yes' if is_yes(config.get('restart', False)) else 'no',
+    'forcefield': lambda config: '%s' % config['forcefield'],
+    'cutoff': lambda config: '%.2f' % config['cutoff'],
+    'framework': lambda config: '%s' % config['framework'],
+    'unitcell': lambda config: '%i %i %i' % tuple(config['unitcell']),
+    'temperature': lambda config: '%.1f' % config['temperature'],
+    'pressure': lambda config: '%.1f' % (float(config['pressure']) * 100000),  # bar -> Pa
+    'charge': lambda config: ("Charge Method                  Ewald\n" +
+                              "Ewald Precision                1e-6\n" +
+                              "UseChargesFromCIFFile          yes\n") if is_yes(config['charge']) else '',
+    'void_fraction': lambda config: ("HeliumVoidFraction             %s\n" % str(config['void_fraction'])
+                                     if config['void_fraction'] not in [False, None] else ''),
+    'movies': lambda config: ("\n" +
+                              "Movies                         yes\n" +
+                              "WriteMoviesEvery               %i\n" % config['movies_every']) if is_yes(config['movies']) else '',
+    'components': _components,
+}
+# Config keys that change an input field with a different name
+CONFIG_FIELDS = {'movies_every': 'movies'}
+
+
+def input_fields(config, fields=None):
+    """
+    Format RASPA input fields of a config.
+
+    Arguments:
+        - config (dict)        : RASPA simulation config dictionary
+        - fields (list)        : fields to format (default: all)
+    """
+    return {field: FIELDS[field](config) for field in (FIELDS if fields is None else fields)}
+
+
+def compile_template(config, keys=[]):
+    """
+    Pre-compile a RASPA input template: all fields are filled in from config except the fields of the given config
+    keys, which are left as placeholders -> template % input_fields(config, fields)
+    Arguments:
+        - config (dict)        : RASPA simulation config dictionary
+        - keys (list)          : config keys that change between simulations
+    Returns:
+        - template (str), fields (list of placeholder field names)
+    """
+    fields = sorted(set(CONFIG_FIELDS.get(key, key) for key in keys))
+    values = {f: v.replace('%', '%%') for f, v in input_fields(config, [f for f in FIELDS if f not in fields]).items()}
+    values.update({f: '%%(%s)s' % f for f in fields})
+    return INPUT_TEMPLATE % values, fields
+
 
 def write_raspa_file(input_file, config):
     """
@@ -13,50 +113,5 @@ def write_raspa_file(input_file, config):
         - input_file (str)     : path to input file.
         - config (dict)        : RASPA simulation config dictionary
     """
-    external_pressure = float(config['pressure']) * 100000  # bar -> torr
-
     with open(input_file, "w") as raspa_input_file:
-        raspa_input_file.write(
-            "SimulationType                 MonteCarlo\n" +
-            "NumberOfCycles                 %s\n" % config['cycles'] +
-            "NumberOfInitializationCycles   %s\n" % config['init_cycles'] +
-            "PrintEvery                     %i\n" % config['print_every'] +
-            "RestartFile                    no\n" +
-            "\n" +
-            "Forcefield                     %s\n" % config['forcefield'] +
-            "CutOff                         %.2f\n" % config['cutoff'] +
-            "\n" +
-            "Framework                      0\n" +
-            "FrameworkName                  %s\n" % config['framework'] +
-            "UnitCells                      %i %i %i\n" % tuple(config['unitcell']) +
-            "ExternalTemperature            %.1f\n" % config['temperature'] +
-            "ExternalPressure               %.1f\n" % external_pressure +
-            "\n"
-        )
-        if config['charge'] == 'yes':
-            raspa_input_file.write(
-                "Charge Method                  Ewald\n" +
-                "Ewald Precision                1e-6\n" +
-                "UseChargesFromCIFFile          yes\n"
-            )
-
-        if config['void_fraction'] is not False:
-            raspa_input_file.write("HeliumVoidFraction             %s\n" % str(vf))
-        if config['movies'] == 'yes':
-            raspa_input_file.write(
-                "\n" +
-                "Movies                         yes\n" +
-                "WriteMoviesEvery               %i\n" % movies
-            )
-        for comp_idx, component in enumerate(config['components']):
-            # TODO: Handle mixture adsorption!!!!!!!!!!!!!!!!!!
-            raspa_input_file.write(
-                "\n" +
-                "Component %-4iMoleculeName               %s\n" % (comp_idx, component['name']) +
-                "              MoleculeDefinition         %s\n" % component['definition'] +
-                "              TranslationProbability     %.2f\n" % component['p_translation'] +
-                "              RotationProbability        %.2f\n" % component['p_rotation'] +
-                "              ReinsertionProbability     %.2f\n" % component['p_reinsertion'] +
-                "              SwapProbability            %.2f\n" % component['p_swap'] +
-                "              CreateNumberOfMolecules    %i\n" % component['create_molecules']
-            )
+        raspa_input_file.write(INPUT_TEMPLATE % input_fields(config))
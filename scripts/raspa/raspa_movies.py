@@ -0,0 +1,242 @@
+"""
+Join RASPA movie pdb files of the framework and adsorbate components frame by frame.
+
+The movies are streamed, so only the current frame of every file is kept in memory. A framework movie with a single
+frame (e.g. Framework_0_final.pdb) is used for every component frame. Atoms are renumbered in every frame
+(framework atoms first), serial numbers above 99999 are written in hybrid-36 (A0000, A0001, ...) or wrapped
+around (CONECT records are not written). Frames can also be written to a compact binary trajectory (.npz):
+    - coordinates (n_atoms_total, 3) float32 and elements (n_atoms_total) codes of all frames
+    - frames (n_frames + 1) offsets of the first atom of every frame, cells (n_frames, 6) float32
+    - element_names: element symbol of every element code
+
+Typical RASPA movie output names:
+- framework: Framework_0_final.pdb or Movie_IRMOF-1_2.2.2_298.000000_10.000000_frameworks.pdb
+- adsorbate: Movie_IRMOF-1_2.2.2_298.000000_10.000000_component_CH4_0.pdb
+
+ >>> python raspa_movies.py framework.pdb component_0.pdb [component_1.pdb ...] -o movies_joined.pdb --binary movie.npz
+"""
+import os
+import shutil
+import tempfile
+import argparse
+import numpy as np
+
+
+DIGITS_UPPER = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+DIGITS_LOWER = '0123456789abcdefghijklmnopqrstuvwxyz'
+ATOM_RECORDS = ('ATOM  ', 'HETATM')
+
+
+def _encode_pure(digits, value):
+    """ Encode a non-negative integer in the base of the given digits """
+    if value == 0:
+        return digits[0]
+    encoded = []
+    while value > 0:
+        value, rest = divmod(value, len(digits))
+        encoded.append(digits[rest])
+    return ''.join(reversed(encoded))
+
+
+def hy36encode(width, value):
+    """
+    Hybrid-36 encoding of a pdb serial number (decimal up to 10 ** width - 1, then A000... to zzz...).
+
+    Args:
+        - width (int): Field width (5 for atom serials, 4 for residue numbers)
+        - value (int): Serial number
+
+    Returns:
+        - str: encoded serial with given width
+    """
+    if 1 - 10 ** (width - 1) <= value < 10 ** width:
+        return '%*i' % (width, value)
+    value -= 10 ** width
+    block = 26 * 36 ** (width - 1)
+    if 0 <= value < block:
+        return _encode_pure(DIGITS_UPPER, value + 10 * 36 ** (width - 1))
+    value -= block
+    if 0 <= value < block:
+        return _encode_pure(DIGITS_LOWER, value + 10 * 36 ** (width - 1))
+    raise ValueError('Serial number out of range for hybrid-36 with width %i: %i' % (width, value))
+
+
+def read_frames(lines):
+    """
+    Iterate over the frames of pdb lines (MODEL ... ENDMDL blocks, lines without MODEL records are one frame).
+
+    Yields:
+        - dict: cell (CRYST1 line or None), header (REMARK lines) and atoms (ATOM/HETATM lines)
+    """
+    frame = dict(cell=None, header=[], atoms=[])
+    for line in lines:
+        record = line[:6]
+        if record in ATOM_RECORDS:
+            frame['atoms'].append(line if line.endswith('\n') else line + '\n')
+        elif record == 'CRYST1':
+            frame['cell'] = line
+        elif record.startswith('REMARK'):
+            frame['header'].append(line)
+        elif record.startswith('ENDMDL') or (record.startswith('END') and len(frame['atoms']) > 0):
+            yield frame
+            frame = dict(cell=None, header=[], atoms=[])
+    if len(frame['atoms']) > 0 or frame['cell'] is not None:
+        yield frame
+
+
+def iter_frames(pdb_file):
+    """ Iterate over the frames of a pdb file (see read_frames) """
+    with open(pdb_file, 'r') as pdb:
+        for frame in read_frames(pdb):
+            yield frame
+
+
+def serial_format(serials='hybrid36'):
+    """ Function formatting an atom serial number -> 'hybrid36' or 'wrap' (modulo 100000) """
+    if serials == 'hybrid36':
+        return lambda i: hy36encode(5, i)
+    if serials == 'wrap':
+        return lambda i: '%5i' % (i % 100000)
+    raise ValueError('Unknown serial number format: %s (options: hybrid36, wrap)' % serials)
+
+
+def renumber(atoms, start=1, serials='hybrid36'):
+    """ Renumber ATOM/HETATM lines from start (serial number columns 7-11) """
+    serial = serial_format(serials)
+    return [line[:6] + serial(i) + line[11:] for i, line in enumerate(atoms, start=start)]
+
+
+def cell_parameters(cell_line):
+    """ CRYST1 line -> [a, b, c, alpha, beta, gamma] """
+    if cell_line is None:
+        return [np.nan] * 6
+    return [float(cell_line[i:j]) for i, j in [(6, 15), (15, 24), (24, 33), (33, 40), (40, 47), (47, 54)]]
+
+
+def atom_columns(atoms):
+    """ Coordinates ((n_atoms, 3) float32) and element symbols of ATOM/HETATM lines """
+    coordinates = np.array([(line[30:38], line[38:46], line[46:54]) for line in atoms], dtype=float).reshape(-1, 3)
+    elements = [line[76:78].strip() or line[12:16].strip().rstrip('0123456789') for line in atoms]
+    return coordinates.astype(np.float32), elements
+
+
+class BinaryTrajectory:
+    """
+    Write frames to a compact binary trajectory (.npz) with bounded memory.
+    Coordinates and element codes are appended to temporary files and packed into the .npz file when closed.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(file_name)), prefix='.tmp-')
+        self._coordinates = open(os.path.join(self.directory, 'coordinates'), 'wb')
+        self._elements = open(os.path.join(self.directory, 'elements'), 'wb')
+        self.element_names = {}
+        self.frames = [0]
+        self.cells = []
+
+    def add_frame(self, coordinates, elements, cell):
+        """ Append a frame -> coordinates (n_atoms, 3), element symbols (n_atoms) and cell parameters """
+        codes = [self.element_names.setdefault(e, len(self.element_names)) for e in elements]
+        np.asarray(coordinates, dtype=np.float32).tofile(self._coordinates)
+        np.array(codes, dtype=np.uint16).tofile(self._elements)
+        self.frames.append(self.frames[-1] + len(coordinates))
+        self.cells.append(cell)
+
+    def close(self):
+        """ Pack the trajectory into the .npz file """
+        self._coordinates.close()
+        self._elements.close()
+        n_atoms = self.frames[-1]
+        coordinates = np.memmap(self._coordinates.name, dtype=np.float32, mode='r', shape=(n_atoms, 3)) \
+            if n_atoms > 0 else np.zeros((0, 3), dtype=np.float32)
+        elements = np.memmap(self._elements.name, dtype=np.uint16, mode='r', shape=(n_atoms,)) \
+            if n_atoms > 0 else np.zeros(0, dtype=np.uint16)
+        names = sorted(self.element_names, key=self.element_names.get)
+        with open(self.file_name, 'wb') as f:
+            np.savez(f, coordinates=coordinates, elements=elements, frames=np.array(self.frames, dtype=np.int64),
+                     cells=np.array(self.cells, dtype=np.float32).reshape(-1, 6), element_names=np.array(names, dtype=str))
+        del coordinates, elements
+        shutil.rmtree(self.directory)
+
+
+def read_trajectory(npz_file):
+    """
+    Read a binary trajectory written by join_movies.
+
+    Returns:
+        - list: frames -> dict(elements (list), coordinates ((n_atoms, 3) ndarray), cell)
+    """
+    with np.load(npz_file) as trajectory:
+        names, frames = trajectory['element_names'], trajectory['frames']
+        coordinates, elements, cells = trajectory['coordinates'], trajectory['elements'], trajectory['cells']
+    return [dict(elements=names[elements[i:j]].tolist(), coordinates=coordinates[i:j], cell=cells[k].tolist())
+            for k, (i, j) in enumerate(zip(frames[:-1], frames[1:]))]
+
+
+def join_movies(framework_file, component_files, output='movies_joined.pdb', binary=None, serials='hybrid36',
+                verbose=True):
+    """
+    Join framework and component movies frame by frame in a single pass.
+
+    Args:
+        - framework_file (str): Framework movie or final framework pdb (single frame -> used for every frame)
+        - component_files (list): Component movie pdb files (frames are joined in order)
+        - output (str): Joined pdb trajectory (None -> not written)
+        - binary (str): Binary trajectory (.npz, None -> not written)
+        - serials (str): Serial numbers above 99999 -> 'hybrid36' or 'wrap'
+        - verbose (bool): Print progress
+
+    Returns:
+        - dict: number of frames and maximum number of atoms in a frame
+    """
+    framework_frames = iter_frames(framework_file)
+    framework = next(framework_frames, dict(cell=None, header=[], atoms=[]))
+    framework_atoms, framework_text, framework_columns = None, None, None
+    pdb = None if output is None else open(output, 'w')
+    trajectory = None if binary is None else BinaryTrajectory(binary)
+    n_frames, max_atoms = 0, 0
+    for frames in zip(*[iter_frames(f) for f in component_files]):
+        if n_frames > 0:
+            framework = next(framework_frames, framework)
+        if framework['atoms'] is not framework_atoms:
+            # Framework atoms are renumbered and converted once for a static framework
+            framework_atoms = framework['atoms']
+            framework_text = ''.join(renumber(framework_atoms, 1, serials))
+            framework_columns = atom_columns(framework_atoms) if trajectory is not None else None
+        cell = framework['cell'] or next((f['cell'] for f in frames if f['cell'] is not None), None)
+        atoms = [line for frame in frames for line in frame['atoms']]
+        n_frames += 1
+        max_atoms = max(max_atoms, len(framework_atoms) + len(atoms))
+        if pdb is not None:
+            pdb.write('MODEL %8i\n%s%s%sENDMDL\n' % (n_frames, cell or '', framework_text,
+                                                    ''.join(renumber(atoms, len(framework_atoms) + 1, serials))))
+        if trajectory is not None:
+            coordinates, elements = atom_columns(atoms)
+            trajectory.add_frame(np.concatenate([framework_columns[0], coordinates]), framework_columns[1] + elements,
+                                 cell_parameters(cell))
+        if verbose:
+            print('\rJoining frames... %3i' % n_frames, end='')
+    if pdb is not None:
+        pdb.write('END\n')
+        pdb.close()
+    if trajectory is not None:
+        trajectory.close()
+    if verbose:
+        print('\n%i frames (max. %i atoms) -> %s' % (n_frames, max_atoms, ', '.join(f for f in [output, binary] if f)))
+    return dict(frames=n_frames, max_atoms=max_atoms)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Join RASPA framework and component movies frame by frame",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('framework', type=str, help='Framework movie (or final framework) pdb file')
+    parser.add_argument('components', type=str, nargs='+', help='Component movie pdb files')
+    parser.add_argument('--output', '-o', type=str, default='movies_joined.pdb', metavar='',
+                        help="Joined pdb trajectory (default: movies_joined.pdb)")
+    parser.add_argument('--binary', '-b', type=str, default=None, metavar='',
+                        help="Also write a binary trajectory (.npz)")
+    parser.add_argument('--serials', '-s', type=str, default='hybrid36', choices=['hybrid36', 'wrap'],
+                        help="Serial numbers above 99999 (default: hybrid36)")
+    args = parser.parse_args()
+
+    join_movies(args.framework, args.components, output=args.output, binary=args.binary, serials=args.serials)
@@ -0,0 +1,338 @@
+"""
+Read RASPA output files for single and mixture gas adsorption simulations.
+- Output is read line by line in a single pass with constant memory
+- Can read unfinished simulation data (reads the last production cycle)
+
+ >>> from raspa_output import parse_output
+ >>> results = parse_output('Output/System_0/output_IRMOF-1_1.1.1_298.000000_1e+07.data')
+ >>> results['ads']['methane']['mol/kg'], results['err']['methane']['mol/kg']
+
+ >>> python raspa_output.py Output/System_0/output_IRMOF-1_1.1.1_298.000000_1e+07.data
+"""
+import os
+import re
+import sys
+
+
+UNITS = ['mol/uc', 'mol/kg', 'mg/g', 'cc/g', 'cc/cc']
+# Unit labels of the 'Average loading absolute/excess [...]' lines in the final results
+LOADING_UNITS = {'molecules/unit cell': 'mol/uc', 'mol/kg framework': 'mol/kg', 'milligram/gram framework': 'mg/g',
+                 'cm^3 (STP)/gr framework': 'cc/g', 'cm^3 (STP)/cm^3 framework': 'cc/cc'}
+ENERGIES = {'Average Host-Host energy': 'host_host', 'Average Adsorbate-Adsorbate energy': 'ads_ads',
+            'Average Host-Adsorbate energy': 'host_ads'}
+# Lines that start a section or have to be parsed outside of sections
+HEADERS = re.compile(r'\n(Current cycle:|\[Init\] Current cycle:|Component \d+ \[|Loadings per component|Average H|Average A|'
+                     r'Number of molecules:|Simulation finished)')
+# First characters of lines that do not start a new section
+INDENT = frozenset(['\t', ' ', '\n', '\r', '=', '-'])
+
+
+class RaspaOutput:
+    """
+    Line-streaming state machine for RASPA output files.
+    Lines are fed one by one (also while the simulation is running) and only the latest values are kept:
+        - components, warnings, finished state, last initialization and production cycle
+        - absolute and excess loadings of the last production cycle (errors are not printed for unfinished runs)
+        - average absolute and excess loadings with errors and average energies with errors of finished runs
+
+    Args:
+        - init_loadings (bool): Also read loadings of initialization cycles
+
+     >>> output = RaspaOutput()
+     >>> for line in open(data_file, 'r'):
+     ...     output.feed(line)
+     >>> output.results()
+
+    Complete files are read faster in chunks with feed_file, which only parses the lines of section headers and
+    the lines in sections (the loadings of the last cycle, final loadings and energies).
+    """
+    def __init__(self, init_loadings=False):
+        self.init_loadings = init_loadings
+        self.reset()
+
+    def reset(self):
+        """ Clear all parsed data """
+        self.components = []
+        self.warnings = []
+        self.finished = False
+        self.initialization = False
+        self.started = False
+        self.init_cycle = 0
+        self.cycle = 0
+        self.block = dict(absolute={}, excess={})
+        self.loadings = dict(absolute={}, excess={})
+        self.errors = dict(absolute={}, excess={})
+        self.energy = {}
+        self.energy_err = {}
+        self._section = None
+        self._name = None
+        self._kind = None
+        self._energy = None
+        self._handlers = {'Current c': self._production_cycle, '[Init] Cu': self._init_cycle,
+                          'Component': self._component, 'Loadings ': self._loadings,
+                          'Average H': self._energy_header, 'Average A': self._energy_header,
+                          'Number of': self._molecules, 'Simulatio': self._finished}
+
+    def feed(self, line):
+        """ Parse a line of RASPA output """
+        self.feed_lines((line,))
+
+    def feed_lines(self, lines):
+        """ Parse lines of RASPA output (an open file or a list of lines) """
+        # Section headers are dispatched on their first characters so most lines are skipped with one lookup
+        handlers = self._handlers
+        warnings = self.warnings
+        for line in lines:
+            if 'WARNING' in line and line not in warnings:
+                warnings.append(line)
+            if self._section is not None and self._section(line):
+                continue
+            handler = handlers.get(line[:9])
+            if handler is not None:
+                handler(line)
+
+    def feed_text(self, text):
+        """
+        Parse a block of complete lines of RASPA output.
+        Lines outside of sections are skipped by searching for the next header, lines in sections are parsed one by one.
+        """
+        warning = text.find('WARNING')
+        while warning >= 0:
+            start, end = text.rfind('\n', 0, warning) + 1, text.find('\n', warning) + 1
+            line = text[start:end] if end > 0 else text[start:]
+            if line not in self.warnings:
+                self.warnings.append(line)
+            warning = text.find('WARNING', max(end, warning + 1)) if end > 0 else -1
+        # Cycle numbers and loadings of earlier cycles are overwritten, only the last ones of the text are parsed
+        last = {'Loadings per component': text.rfind('\nLoadings per component'),
+                'Current cycle:': text.rfind('\nCurrent cycle:'),
+                '[Init] Current cycle:': text.rfind('\n[Init] Current cycle:')}
+        position, end = 0, len(text)
+        while position < end:
+            if self._section is None and position > 0:
+                match = HEADERS.search(text, position - 1)
+                if match is None:
+                    return
+                position = match.start() + 1
+                header = match.group(1)
+                # The first production cycle is always parsed so the following loadings are read
+                if header in last and match.start() < last[header] and (self.initialization or header[0] == '['):
+                    position += 1
+                    continue
+            line_end = text.find('\n', position) + 1
+            line_end = end if line_end == 0 else line_end
+            self.feed_lines((text[position:line_end],))
+            position = line_end
+
+    def feed_file(self, data_file, chunk_size=1 << 22):
+        """
+        Parse an open RASPA output file in chunks of chunk_size characters
+        (the last line is skipped if it is not complete, e.g. still being written by a running simulation)
+        """
+        rest = ''
+        for chunk in iter(lambda: data_file.read(chunk_size), ''):
+            chunk = rest + chunk
+            split = chunk.rfind('\n') + 1
+            self.feed_text(chunk[:split])
+            rest = chunk[split:]
+
+    def _production_cycle(self, line):
+        if line.startswith('Current cycle:'):
+            self.cycle = int(line.split()[2])
+            self.initialization = True
+
+    def _init_cycle(self, line):
+        if line.startswith('[Init] Current cycle:'):
+            self.init_cycle = int(line.split()[3])
+            self.started = True
+
+    def _component(self, line):
+        if '(Adsorbate molecule)' in line:
+            self.components.append(line.split()[2].strip('[]'))
+
+    def _loadings(self, line):
+        if line.startswith('Loadings per component') and (self.initialization or self.init_loadings):
+            self._section, self._name, self._kind = self._cycle_loadings, None, None
+
+    def _energy_header(self, line):
+        for header in ENERGIES:
+            if line.startswith(header):
+                self._section, self._energy = self._energies, ENERGIES[header]
+                break
+
+    def _molecules(self, line):
+        if line.startswith('Number of molecules:'):
+            self._section, self._name = self._average_loadings, None
+
+    def _finished(self, line):
+        if line.startswith('Simulation finished'):
+            self.finished = True
+            self.initialization = True
+
+    def _cycle_loadings(self, line):
+        """ 'Loadings per component' block of a production cycle """
+        first = line[:1]
+        if first not in INDENT and not line.startswith('Component'):
+            self._section = None
+            return False
+        tokens = line.split()
+        if len(tokens) == 0 or first == '=':
+            return True
+        if tokens[0] == 'Component' and len(tokens) > 2:
+            self._name, self._kind = tokens[2].strip('(),'), None
+        elif tokens[0] in ['absolute', 'excess'] and self._name is not None and len(tokens) > 10:
+            self._kind = tokens[0]
+            self.block[self._kind][self._name] = {'mol/uc': float(tokens[2]), 'mol/kg': float(tokens[6]),
+                                                  'mg/g': float(tokens[10])}
+        elif self._kind is not None and len(tokens) > 5:
+            # Volumetric loadings continue on the next line
+            loading = self.block[self._kind][self._name]
+            loading['cc/g'], loading['cc/cc'] = float(tokens[0]), float(tokens[5])
+            self._kind = None
+        return True
+
+    def _energies(self, line):
+        """ Block averages of an 'Average ... energy' section """
+        first = line[:1]
+        tokens = line.split()
+        if len(tokens) == 0 or first == '=':
+            return True
+        if tokens[0] == 'Average' and len(tokens) > 7:
+            self.energy['%s_avg' % self._energy] = float(tokens[1])
+            self.energy['%s_vdw' % self._energy] = float(tokens[5])
+            self.energy['%s_cou' % self._energy] = float(tokens[7])
+        elif tokens[0] == '+/-' and len(tokens) > 5:
+            self.energy_err['%s_avg' % self._energy] = float(tokens[1])
+            self.energy_err['%s_vdw' % self._energy] = float(tokens[3])
+            self.energy_err['%s_cou' % self._energy] = float(tokens[5])
+            self._section = None
+        elif first not in INDENT:
+            self._section = None
+            return False
+        return True
+
+    def _average_loadings(self, line):
+        """ Average loadings of all components ('Number of molecules' section) """
+        if line.startswith('Average Widom Rosenbluth factor'):
+            self._section = None
+            return True
+        tokens = line.split()
+        if len(tokens) < 3:
+            return True
+        if tokens[0] == 'Component':
+            self._name = tokens[2].strip('[]')
+        elif tokens[0] == 'Average' and tokens[1] == 'loading' and self._name is not None:
+            start, end = line.find('['), line.find(']')
+            unit = LOADING_UNITS.get(line[start + 1:end]) if 0 <= start < end else None
+            values = line[end + 1:].split()
+            if unit is not None and tokens[2] in self.loadings and len(values) > 2:
+                self.loadings[tokens[2]].setdefault(self._name, {})[unit] = float(values[0])
+                self.errors[tokens[2]].setdefault(self._name, {})[unit] = float(values[2])
+        return True
+
+    def phase(self):
+        """ Simulation phase -> 'finished', 'production', 'initialization' or 'started' """
+        if self.finished:
+            return 'finished'
+        if self.initialization:
+            return 'production'
+        return 'initialization' if self.started else 'started'
+
+    def results(self, loading='absolute'):
+        """
+        Parsed results.
+
+        Args:
+            - loading (str): Loading type reported in 'ads' and 'err' -> 'absolute' or 'excess'
+
+        Returns:
+            - dict: ads and err ({component: {id, units}} of the selected loading type), loadings and errors
+                    ({absolute/excess: {component: {units}}}), energy and energy_err, finished, initialization
+                    (production started), phase, init_cycle, cycle, warnings and components
+        """
+        if self.finished:
+            loadings, errors = self.loadings, self.errors
+        else:
+            # Errors are not printed for unfinished simulations
+            loadings = self.block
+            errors = {kind: {c: {u: 0 for u in v} for c, v in loadings[kind].items()} for kind in loadings}
+        ads, err = {}, {}
+        for component in loadings[loading]:
+            index = self.components.index(component) if component in self.components else len(ads)
+            ads[component] = dict(id=index, **loadings[loading][component])
+            err[component] = dict(id=index, **errors[loading][component])
+        return dict(ads=ads, err=err, loadings=loadings, errors=errors, energy=dict(self.energy),
+                    energy_err=dict(self.energy_err), finished=self.finished, initialization=self.initialization,
+                    phase=self.phase(), init_cycle=self.init_cycle, cycle=self.cycle,
+                    warnings=list(self.warnings), components=list(self.components))
+
+
+def simulation_conditions(data_file):
+    """
+    Read simulation conditions from RASPA output file name -> output_<framework>_<unitcell>_<temperature>_<pressure>.data
+
+    Returns:
+        - dict: framework, unitcell, temperature and pressure (None if not available)
+    """
+    name = os.path.splitext(os.path.basename(data_file))[0]
+    fields = name[len('output_'):].rsplit('_', 3) if name.startswith('output_') else []
+    if len(fields) < 4:
+        parts = name.split('_')
+        return dict(framework=parts[1] if len(parts) > 1 else name, unitcell=None, temperature=None, pressure=None)
+    try:
+        return dict(framework=fields[0], unitcell=[int(i) for i in fields[1].split('.')],
+                    temperature=float(fields[2]), pressure=float(fields[3]))
+    except ValueError:
+        return dict(framework=fields[0], unitcell=None, temperature=None, pressure=None)
+
+
+def parse_output(data_file, verbose=False, save=False, loading='absolute'):
+    """
+    Parse RASPA output file for gas adsorption data.
+
+    Args:
+        - data_file (str): path to RASPA simulation output file
+        - verbose (bool): Print results
+        - save (bool): Save results to raspa_ads.yaml
+        - loading (str): Loading type reported in 'ads' and 'err' -> 'absolute' or 'excess'
+
+    Returns:
+        - dict: molar, gravimetric and volumetric loadings (see RaspaOutput.results), energies of host-host,
+                host-adsorbate and adsorbate-adsorbate interactions, framework and simulation conditions
+    """
+    output = RaspaOutput()
+    with open(data_file, 'r') as ads_data:
+        output.feed_file(ads_data)
+    results = output.results(loading=loading)
+    results['conditions'] = simulation_conditions(data_file)
+    results['framework'] = results['conditions']['framework']
+
+    if verbose:
+        print_results(results, loading=loading)
+    if save:
+        import yaml
+        with open('raspa_ads.yaml', 'w') as rads:
+            yaml.dump(results, rads)
+    return results
+
+
+def print_results(results, loading='absolute', units=['mol/uc', 'mg/g', 'cc/cc']):
+    """ Print loadings of all components """
+    if len(results['warnings']) > 0:
+        print('%s - %i warning(s) found -> %s' % (results['framework'], len(results['warnings']),
+                                                  results['warnings'][0].strip()))
+    if not results['finished']:
+        print('%s\nSimulation not finished!' % ('=' * 50))
+        print('Initialization: %s | Last cycle: %i' % (results['initialization'], results['cycle']))
+    for component in results['ads']:
+        print('=' * 50)
+        print("%-15s\t%s" % ('%s [%s]' % (component, results['ads'][component]['id']), loading))
+        print('-' * 50)
+        for u in units:
+            print('%s\t\t%8.3f +/- %5.2f' % (u, results['ads'][component][u], results['err'][component][u]))
+    print('=' * 50)
+
+
+if __name__ == "__main__":
+    ads_path = os.path.abspath(sys.argv[1])
+    parse_output(ads_path, verbose=True, save=len(sys.argv) > 2 and sys.argv[2] == 's')
@@ -5,6 +5,41 @@ Generates RASPA job submission file for slurm scheduler.
 # Date: Nov 2017
 
 
+SLURM_TEMPLATE = (
+    "#!/bin/bash\n" +
+    "#SBATCH --nodes=1\n" +
+    "#SBATCH --ntasks-per-node=1\n" +
+    "#SBATCH --cluster=smp\n" +
+    "#SBATCH --time=%(walltime)s\n" +
+    "#SBATCH --job-name=%(jobname)s\n" +
+    "#SBATCH --output=out.raspa\n\n" +
+    ". /ihome/cwilmer/kbs37/venv/ipmof/bin/activate\n" +
+    "echo JOB_ID: $SBATCH_JOBID JOB_NAME: $SBATCH_JOB_NAME\n" +
+    "echo start_time: `date`\n" +
+    "cd $SLURM_SUBMIT_DIR\n\n" +
+    "simulate simulation.input\n\n" +
+    "echo end_time: `date`\n" +
+    "exit\n")
+
+ARRAY_TEMPLATE = (
+    "#!/bin/bash\n" +
+    "#SBATCH --nodes=1\n" +
+    "#SBATCH --ntasks=1\n" +
+    "#SBATCH --cpus-per-task=%(cores)i\n" +
+    "#SBATCH --cluster=smp\n" +
+    "#SBATCH --time=%(walltime)s\n" +
+    "#SBATCH --job-name=%(jobname)s\n" +
+    "#SBATCH --array=0-%(last)i\n" +
+    "#SBATCH --output=bundle_%%A_%%a.out\n\n" +
+    ". /ihome/cwilmer/kbs37/venv/ipmof/bin/activate\n" +
+    "echo JOB_ID: $SLURM_ARRAY_JOB_ID TASK_ID: $SLURM_ARRAY_TASK_ID JOB_NAME: $SLURM_JOB_NAME\n" +
+    "echo start_time: `date`\n" +
+    "cd $SLURM_SUBMIT_DIR\n\n" +
+    "%(command)s\n\n" +
+    "echo end_time: `date`\n" +
+    "exit\n")
+
+
 def write_raspa_slurm(slurm_file, jobname, walltime="24:00:00"):
     """
     Writes RASPA slurm file for simulating gas adsorption.
@@ -14,18 +49,20 @@ def write_raspa_slurm(slurm_file, jobname, walltime="24:00:00"):
         - walltime (str)       : Slurm job max. wall time
     """
     with open(slurm_file, "w") as raspa_slurm_file:
-        raspa_slurm_file.write(
-            "#!/bin/bash\n" +
-            "#SBATCH --nodes=1\n" +
-            "#SBATCH --ntasks-per-node=1\n" +
-            "#SBATCH --cluster=smp\n" +
-            "#SBATCH --time=%s\n" % walltime +
-            "#SBATCH --job-name=%s\n" % jobname +
-            "#SBATCH --output=out.raspa\n\n" +
-            ". /ihome/cwilmer/kbs37/venv/ipmof/bin/activate\n" +
-            "echo JOB_ID: $SBATCH_JOBID JOB_NAME: $SBATCH_JOB_NAME\n" +
-            "echo start_time: `date`\n" +
-            "cd $SLURM_SUBMIT_DIR\n\n" +
-            "simulate simulation.input\n\n" +
-            "echo end_time: `date`\n" +
-            "exit\n")
+        raspa_slurm_file.write(SLURM_TEMPLATE % dict(jobname=jobname, walltime=walltime))
+
+
+def write_raspa_array(slurm_file, jobname, command, n_tasks, cores=28, walltime="24:00:00"):
+    """
+    Writes slurm job array file, every array task runs command on one node ($SLURM_ARRAY_TASK_ID is the task index).
+    Arguments:
+        - slurm_file (str)     : path to slurm file.
+        - job_name (str)       : Slurm job name
+        - command (str)        : Command run by every array task
+        - n_tasks (int)        : Number of array tasks
+        - cores (int)          : Number of cores of each array task
+        - walltime (str)       : Slurm job max. wall time
+    """
+    with open(slurm_file, "w") as raspa_slurm_file:
+        raspa_slurm_file.write(ARRAY_TEMPLATE % dict(jobname=jobname, command=command, last=n_tasks - 1, cores=cores,
+                                                     walltime=walltime))
@@ -0,0 +1,164 @@
+"""
+Status of running RASPA simulations.
+
+The output file is read backwards from the end in blocks until the two most recent cycle headers are found, so only
+the last printed cycle (a few kilobytes) is read regardless of the file size.
+
+ >>> status = probe('Output/System_0/output_IRMOF-1_1.1.1_298.000000_1e+07.data')
+ >>> status['phase'], status['cycle'], status['loadings']['absolute']['methane']['mol/kg']
+
+ >>> python raspa_status.py ipmof-runs                   # status of all simulations
+ >>> python raspa_status.py ipmof-runs --watch 300       # poll every 5 minutes until all simulations are finished
+"""
+import os
+import sys
+import time
+import argparse
+from raspa_output import RaspaOutput, UNITS
+from raspa_harvest import find_outputs, read_convergence
+
+
+CYCLE_HEADERS = [b'\nCurrent cycle:', b'\n[Init] Current cycle:']
+
+
+def _last_header(tail, end=None):
+    """ Position of the last cycle header in tail before end (-1 if not found) """
+    end = len(tail) if end is None else end
+    return max(tail.rfind(header, 0, end) for header in CYCLE_HEADERS)
+
+
+def _complete(block, reference):
+    """ Check if loadings of a cycle block include all components of a reference block and all units """
+    for kind in block:
+        if len(block[kind]) == 0 or not set(reference[kind]) <= set(block[kind]):
+            return False
+        if any(len(loadings) < len(UNITS) for loadings in block[kind].values()):
+            return False
+    return True
+
+
+def probe(data_file, block_size=1 << 14, max_bytes=1 << 26):
+    """
+    Read the status of a RASPA simulation from the end of its output file.
+
+    Args:
+        - data_file (str): path to RASPA simulation output file
+        - block_size (int): Number of bytes read at a time (backwards from the end of the file)
+        - max_bytes (int): Maximum number of bytes read from the end of the file
+
+    Returns:
+        - dict: phase ('finished', 'production', 'initialization' or 'started'), cycle (last printed cycle),
+                loadings ({absolute/excess: {component: {units}}} of the last completely printed cycle or
+                final averages of finished simulations),
+                size, mtime and bytes_read
+    """
+    with open(data_file, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        position = f.seek(0, os.SEEK_END)
+        size, tail = position, b''
+        last, previous = -1, -1
+        while position > 0 and size - position < max_bytes:
+            start = max(0, position - block_size)
+            f.seek(start)
+            tail = f.read(position - start) + tail
+            position = start
+            last = _last_header(tail)
+            previous = _last_header(tail, last) if last >= 0 else -1
+            if previous >= 0:
+                break
+            # Larger blocks for long final results or initial output so the file is read O(n) at worst
+            block_size *= 2
+
+    finished = b'\nSimulation finished' in tail
+    output = RaspaOutput(init_loadings=True)
+    if finished and last >= 0:
+        # Last cycle and final averages
+        output.feed_lines(tail[last + 1:].decode(errors='replace').splitlines(True))
+        loadings = output.loadings if len(output.loadings['absolute']) > 0 else output.block
+    else:
+        # The last cycle may still be written, its loadings are used if all components of the cycle before are complete
+        if previous >= 0:
+            output.feed_lines(tail[previous + 1:last + 1].decode(errors='replace').splitlines(True))
+        loadings = output.block
+        if last >= 0:
+            current = RaspaOutput(init_loadings=True)
+            current.feed_lines(tail[last + 1:tail.rfind(b'\n') + 1].decode(errors='replace').splitlines(True))
+            if _complete(current.block, loadings):
+                loadings = current.block
+            output.feed(tail[last + 1:tail.find(b'\n', last + 1) + 1].decode(errors='replace'))
+
+    if finished:
+        phase = 'finished'
+    elif last < 0:
+        phase = 'started'
+    else:
+        phase = 'initialization' if tail.startswith(b'[Init]', last + 1) else 'production'
+    cycle = output.init_cycle if phase == 'initialization' else output.cycle
+    return dict(phase=phase, cycle=cycle, loadings=loadings, size=size, mtime=stat.st_mtime,
+                bytes_read=size - position)
+
+
+def campaign_status(run_dir, previous={}, **kwargs):
+    """
+    Status of all simulations of a campaign (outputs with unchanged size and modification time are not read again).
+
+    Args:
+        - run_dir (str): Campaign directory (outputs are found with raspa_harvest.find_outputs)
+        - previous (dict): Status of a previous call -> {path: status}
+
+    Returns:
+        - dict: path (relative to run_dir) -> status (see probe, phase 'converged' for simulations stopped by the
+                convergence controller)
+    """
+    status = {}
+    for data_file in find_outputs(run_dir):
+        path = os.path.relpath(data_file, run_dir)
+        stat = os.stat(data_file)
+        if path in previous and (previous[path]['size'], previous[path]['mtime']) == (stat.st_size, stat.st_mtime):
+            status[path] = dict(previous[path], bytes_read=0)
+        else:
+            status[path] = probe(data_file, **kwargs)
+            if status[path]['phase'] != 'finished' and read_convergence(data_file) is not None:
+                status[path]['phase'] = 'converged'
+    return status
+
+
+def print_status(status, summary=False):
+    """ Print status table and number of simulations in each phase """
+    counts = {}
+    for path in sorted(status):
+        s = status[path]
+        counts[s['phase']] = counts.get(s['phase'], 0) + 1
+        if not summary:
+            loadings = ' '.join('%s: %.3f' % (c, v['mol/kg']) for c, v in s['loadings']['absolute'].items()
+                                if 'mol/kg' in v)
+            print('%-70s %-14s %9i  %s' % (path, s['phase'], s['cycle'], loadings))
+    print('%s | %s | %.1f kB read' % (time.strftime('%H:%M:%S'), ' '.join('%s: %i' % (p, n) for p, n in counts.items()),
+                                      sum(s['bytes_read'] for s in status.values()) / 1e3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Status of running RASPA simulations",
+                                     epilog=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', type=str, help='RASPA output file or campaign directory')
+    parser.add_argument('--watch', '-w', type=float, default=None, metavar='',
+                        help="Poll the campaign every given seconds until all simulations are finished")
+    parser.add_argument('--summary', '-s', action='store_true', default=False,
+                        help="Only print the number of simulations in each phase")
+    args = parser.parse_args()
+
+    if os.path.isfile(args.path):
+        s = probe(args.path)
+        print_status({os.path.basename(args.path): s}, summary=args.summary)
+        sys.exit(0)
+
+    status = {}
+    while True:
+        status = campaign_status(args.path, previous=status)
+        print_status(status, summary=args.summary)
+        if args.watch is None or all(s['phase'] in ['finished', 'converged'] for s in status.values()):
+            break
+        try:
+            time.sleep(args.watch)
+        except KeyboardInterrupt:
+            break
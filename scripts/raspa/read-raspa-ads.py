@@ -4,6 +4,7 @@ Read RASPA output file for gas adsorption simulations.
 import os
 import sys
 import glob
+import raspa_output
 
 
 def parse_output(data_file, adsorbate='ADSORBATE', verbose=False):
@@ -16,59 +17,14 @@ def parse_output(data_file, adsorbate='ADSORBATE', verbose=False):
             Coulombic host-host, host-adsorbate, and adsorbate-adsorbate
             interactions.
     """
-    results = dict(ads=dict(absolute=dict(), excess=dict()), energy=dict(), warnings=[], finished=False, initialization=False)
-    with open(data_file) as ads_data:
-        data_lines = ads_data.readlines()
-
-    for i, line in enumerate(data_lines):
-        if 'Simulation finished' in line:
-            results['finished'] = True
-            results['initialization'] = True
-        if 'Average loading absolute [molecules/unit cell]' in line:
-            results['ads']['absolute']['mol/uc'] = float(data_lines[i].split()[5])
-            results['ads']['absolute']['mol/kg'] = float(data_lines[i + 1].split()[5])
-            results['ads']['absolute']['mg/g'] = float(data_lines[i + 2].split()[5])
-            results['ads']['absolute']['cc/g'] = float(data_lines[i + 3].split()[6])
-            results['ads']['absolute']['cc/cc'] = float(data_lines[i + 4].split()[6])
-        elif 'Average loading excess [molecules/unit cell]' in line:
-            results['ads']['excess']['mol/uc'] = float(data_lines[i].split()[5])
-            results['ads']['excess']['mol/kg'] = float(data_lines[i + 1].split()[5])
-            results['ads']['excess']['mg/g'] = float(data_lines[i + 2].split()[5])
-            results['ads']['excess']['cc/g'] = float(data_lines[i + 3].split()[6])
-            results['ads']['excess']['cc/cc'] = float(data_lines[i + 4].split()[6])
-        elif 'Average Host-Host energy' in line:
-            results['energy']['host_host_avg'] = float(data_lines[i + 8].split()[1])
-            results['energy']['host_host_vdw'] = float(data_lines[i + 8].split()[5])
-            results['energy']['host_host_cou'] = float(data_lines[i + 8].split()[7])
-        elif 'Average Adsorbate-Adsorbate energy' in line:
-            results['energy']['ads_ads_avg'] = float(data_lines[i + 8].split()[1])
-            results['energy']['ads_ads_vdw'] = float(data_lines[i + 8].split()[5])
-            results['energy']['ads_ads_cou'] = float(data_lines[i + 8].split()[7])
-        elif 'Average Host-Adsorbate energy' in line:
-            results['energy']['host_ads_avg'] = float(data_lines[i + 8].split()[1])
-            results['energy']['host_ads_vdw'] = float(data_lines[i + 8].split()[5])
-            results['energy']['host_ads_cou'] = float(data_lines[i + 8].split()[7])
-        elif 'WARNING' in line:
-            results['warnings'].append(line)
-
-#   If simulation is not finished ------------------------------------------------------------------
-    if not(results['finished']):
-        for i, line in enumerate(data_lines):
-            if 'Current cycle' in line and line[0] == 'C':  # If production cycle
-                results['cycle'] = int(line.split()[2])
-                results['initialization'] = True
-            if 'Loadings per component' in line and results['initialization']:
-                results['ads']['absolute']['mol/uc'] = float(data_lines[i + 3].split()[2])
-                results['ads']['absolute']['mol/kg'] = float(data_lines[i + 3].split()[6])
-                results['ads']['absolute']['mg/g'] = float(data_lines[i + 3].split()[10])
-                results['ads']['absolute']['cc/g'] = float(data_lines[i + 4].split()[0])
-                results['ads']['absolute']['cc/cc'] = float(data_lines[i + 4].split()[5])
-
-                results['ads']['excess']['mol/uc'] = float(data_lines[i + 5].split()[2])
-                results['ads']['excess']['mol/kg'] = float(data_lines[i + 5].split()[6])
-                results['ads']['excess']['mg/g'] = float(data_lines[i + 5].split()[10])
-                results['ads']['excess']['cc/g'] = float(data_lines[i + 6].split()[0])
-                results['ads']['excess']['cc/cc'] = float(data_lines[i + 6].split()[5])
+    output = raspa_output.parse_output(data_file)
+    ads = dict(absolute=dict(), excess=dict())
+    for loading in ads:
+        for component in output['loadings'][loading]:
+            ads[loading] = dict(output['loadings'][loading][component])
+            break
+    results = dict(ads=ads, energy=output['energy'], warnings=output['warnings'], finished=output['finished'],
+                   initialization=output['initialization'], cycle=output['cycle'])
 
     if verbose:
         print(
@@ -78,7 +34,8 @@ def parse_output(data_file, adsorbate='ADSORBATE', verbose=False):
             "cc/cc\t\t%8.3f\t%8.3f\n" % (results['ads']['absolute']['cc/cc'], results['ads']['excess']['cc/cc'])
         )
         if len(results['warnings']) > 0:
-            print('%s - %i warning(s) found -> %s' % (data_file, len(warnings), warnings[0].strip()))
+            print('%s - %i warning(s) found -> %s' % (data_file, len(results['warnings']),
+                                                      results['warnings'][0].strip()))
 
     return results
 
@@ -4,6 +4,7 @@ Read RASPA output file for mixture gas adsorption simulations.
 import os
 import sys
 import glob
+import raspa_output
 
 
 def parse_output(data_file, verbose=True, save=False):
@@ -12,31 +13,12 @@ def parse_output(data_file, verbose=True, save=False):
         data_file (str): path to RASPA simulation output file.
         verbose (bool): Print results
         save (bool): Save results to a yaml file
+    Returns:
+        results (dict): absolute loadings of each component (None if the simulation is not finished)
     """
-    with open(data_file) as ads_data:
-        data_lines = ads_data.readlines()
-    finished = False
-    for i, line in enumerate(data_lines):
-        if 'Number of molecules:' in line:
-            ads_start = i
-        if 'Average Widom Rosenbluth factor:' in line:
-            ads_end = i
-        if 'Simulation finished' in line:
-            finished = True
-
-    if finished:
-        results = {}
-        ads_lines = data_lines[ads_start:ads_end]
-        for i, line in enumerate(ads_lines):
-            if 'Component' in line:
-                comp_name = line.split()[2].replace('[', '').replace(']', '')
-                results[comp_name] = {'id': line.split()[1]}
-            if 'Average loading absolute [molecules/unit cell]' in line:
-                results[comp_name]['mol/uc'] = float(ads_lines[i].split()[5])
-                results[comp_name]['mol/kg'] = float(ads_lines[i + 1].split()[5])
-                results[comp_name]['mg/g'] = float(ads_lines[i + 2].split()[5])
-                results[comp_name]['cc/g'] = float(ads_lines[i + 3].split()[6])
-                results[comp_name]['cc/cc'] = float(ads_lines[i + 4].split()[6])
+    output = raspa_output.parse_output(data_file)
+    if output['finished']:
+        results = output['ads']
         if verbose:
             units = ['mol/uc', 'mg/g', 'cc/cc']
             for component in results:
@@ -48,6 +30,7 @@ def parse_output(data_file, verbose=True, save=False):
             import yaml
             with open('raspa_ads.yaml', 'w') as rads:
                 yaml.dump(results, rads)
+        return results
     else:
         print('Simulation not finished!')
 